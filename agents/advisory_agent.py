@@ -1,11 +1,16 @@
-from data_analyze import client, GROQ_MODEL
+from data_analyze import chat_completion, achat_completion
+from token_budget import fit
+
+def _advisory_prompt(data: str) -> str:
+    data = fit("advisory", data)
+    return f"Rewrite the clinical reasoning and treatment plan below into simple, patient-friendly advice:\n{data}"
 
 def advisory_agent(data: str) -> str:
     try:
-        prompt = f"Rewrite the clinical reasoning and treatment plan below into simple, patient-friendly advice:\n{data}"
-        resp = client.chat.completions.create(model=GROQ_MODEL,
-                                              messages=[{"role": "user", "content": prompt}],
-                                              temperature=0.4)
-        return resp.choices[0].message.content
+        return chat_completion(_advisory_prompt(data), temperature=0.4)
     except Exception as e:
         return f"❌ Advisory Agent failed: {str(e)}"
+
+async def aadvisory_agent(data: str) -> str:
+    """Async variant for the pipeline DAG; errors propagate so the stage can retry."""
+    return await achat_completion(_advisory_prompt(data), temperature=0.4)
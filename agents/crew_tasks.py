@@ -1,36 +1,68 @@
 # agents/crew_tasks.py
 
-from agents.document_analyzer import document_analyzer
-from agents.medical_context_agent import medical_context_icd
-from agents.reasoning_agent import reasoning_agent
-from agents.kb_agent import kb_agent
-from agents.treatment_planner_agent import treatment_planner_agent
-from agents.advisory_agent import advisory_agent
+from pipeline_dag import Stage, run_dag, is_failure
+from data_analyze import warm_up_kb
+from agents.document_analyzer import adocument_analyzer
+from agents.medical_context_agent import amedical_context_icd
+from agents.reasoning_agent import areasoning_agent
+from agents.kb_agent import retrieve_kb_hits, aformat_kb_hits
+from agents.treatment_planner_agent import aplan_treatment, prefetch_drug_warnings, add_safety_notes
+from agents.advisory_agent import aadvisory_agent
+
+def build_task_stages(file_paths, user_note=None, timeout=120, retries=1):
+    llm = dict(timeout=timeout, retries=retries)
+
+    def context(*parts):
+        return "\n".join(parts)
+
+    async def analyze_documents():
+        return await adocument_analyzer(file_paths, user_note)
+
+    async def reasoning(doc_report, icd_report):
+        return await areasoning_agent(context(doc_report, icd_report))
+
+    async def kb_snippets(hits):
+        return hits if is_failure(hits) else await aformat_kb_hits(hits)
+
+    async def plan(doc_report, icd_report, reasoning, kb):
+        return await aplan_treatment(context(doc_report, icd_report, reasoning), kb_snippets=kb)
+
+    def fda_prefetch(doc_report, icd_report, reasoning, kb):
+        return prefetch_drug_warnings(context(doc_report, icd_report, reasoning), kb_snippets=kb)
+
+    async def advisory(doc_report, icd_report, reasoning, treatment_text):
+        return await aadvisory_agent(context(doc_report, icd_report, reasoning, treatment_text))
+
+    def treatment(plan_text, prefetched, doc_report, icd_report, reasoning, kb):
+        if is_failure(plan_text):
+            return plan_text
+        known = None if is_failure(prefetched) else prefetched
+        return add_safety_notes(plan_text, context(doc_report, icd_report, reasoning), kb_snippets=kb, known=known)
+
+    return [
+        Stage("kb_warmup", warm_up_kb, label="KB Warm-up", timeout=600),
+        # Document Analysis
+        Stage("doc_report", analyze_documents, label="Document Analysis", timeout=timeout * 4),
+        # Medical Context
+        Stage("icd_report", amedical_context_icd, ["doc_report"], label="ICD Mapping", **llm),
+        # Reasoning
+        Stage("reasoning", reasoning, ["doc_report", "icd_report"], label="Clinical Reasoning", **llm),
+        # Knowledge Base Lookup
+        Stage("kb_hits", lambda d, i, r, _warm: retrieve_kb_hits(context(d, i, r), top_k=4),
+              ["doc_report", "icd_report", "reasoning", "kb_warmup"], label="KB Retrieval", timeout=120, retries=1),
+        Stage("kb_snippets", kb_snippets, ["kb_hits"], label="KB Lookup", **llm),
+        # Treatment Planning (FDA lookups for already-known drugs overlap with the plan)
+        Stage("plan", plan, ["doc_report", "icd_report", "reasoning", "kb_snippets"], label="Treatment Planning", **llm),
+        Stage("fda_prefetch", fda_prefetch, ["doc_report", "icd_report", "reasoning", "kb_snippets"],
+              label="FDA Prefetch", timeout=60),
+        Stage("treatment", treatment, ["plan", "fda_prefetch", "doc_report", "icd_report", "reasoning", "kb_snippets"],
+              label="FDA Safety Checks", timeout=60, retries=1),
+        # Advisory
+        Stage("advisory", advisory, ["doc_report", "icd_report", "reasoning", "treatment"],
+              label="Patient Advisory", **llm),
+    ]
 
 def sequential_executor(file_paths, user_note=None):
-    # Document Analysis
-    doc_report = document_analyzer(file_paths, user_note)
-    
-    # Medical Context
-    icd_report = medical_context_icd(doc_report)
-    
-    # Reasoning
-    reasoning = reasoning_agent(doc_report + "\n" + icd_report)
-    
-    # Knowledge Base Lookup
-    kb_snippets = kb_agent(doc_report + "\n" + icd_report + "\n" + reasoning, top_k=4)
-    
-    # Treatment Planning
-    treatment = treatment_planner_agent(doc_report + "\n" + icd_report + "\n" + reasoning, kb_snippets=kb_snippets)
-    
-    # Advisory
-    advisory = advisory_agent(doc_report + "\n" + icd_report + "\n" + reasoning + "\n" + treatment)
-    
-    return {
-        "doc_report": doc_report,
-        "icd_report": icd_report,
-        "reasoning": reasoning,
-        "kb_snippets": kb_snippets,
-        "treatment": treatment,
-        "advisory": advisory
-    }
+    # Runs as a DAG now (see pipeline_dag.py); the name and return value are kept for callers.
+    results = run_dag(build_task_stages(file_paths, user_note))
+    return {key: results[key] for key in ("doc_report", "icd_report", "reasoning", "kb_snippets", "treatment", "advisory")}
@@ -1,65 +1,265 @@
-from data_analyze import GROQ_MODEL, client, extract_text_from_pdf, file_to_base64
+from data_analyze import chat_completion, achat_completion, iter_pdf_pages
+from image_preprocess import prepare_images
+import structured_labs
+from pipeline_dag import run_coroutine_sync, current_delta_sink, set_delta_sink
+from token_budget import dedup_lines
+import tracing
+from typing import Dict, List
+import asyncio
+import random
+import time
+import re
 import os
+import base64
+import groq
 
-def document_analyzer(file_paths, user_note=None) -> str:
+# -------------------------
+# Settings
+# -------------------------
+# map_reduce: each image batch and each text chunk is one concurrent "map" call, text is
+# sent exactly once, and findings are merged and de-duplicated. batch: the old behaviour
+# (every image batch also carries all the text).
+DOC_ANALYZER_MODE = os.getenv("DOC_ANALYZER_MODE", "map_reduce")
+DOC_MAP_CONCURRENCY = int(os.getenv("DOC_MAP_CONCURRENCY", "4"))
+DOC_MAP_RETRIES = int(os.getenv("DOC_MAP_RETRIES", "4"))
+DOC_TEXT_CHUNK_CHARS = int(os.getenv("DOC_TEXT_CHUNK_CHARS", "24000"))  # ~6k tokens per text map call
+IMAGE_BATCH_SIZE = 5  # Groq hard limit on images per request
+# Lines repeated at least this often in one file (page headers/footers, disclaimers) are sent once.
+DOC_BOILERPLATE_REPEATS = int(os.getenv("DOC_BOILERPLATE_REPEATS", "3"))
+# CSV/TSV lab exports and key-value lab text are parsed locally (structured_labs.py); only
+# their abnormal findings reach later stages. 0 sends them to the LLM as plain text.
+DOC_STRUCTURED_LABS = os.getenv("DOC_STRUCTURED_LABS", "1") == "1"
+
+EXTRACT_PROMPT = "Extract all lab values, symptoms, and abnormalities from the following medical reports. Provide concise bullet points."
+
+def _image_part(image: Dict) -> Dict:
+    data = base64.b64encode(image["data"]).decode("utf-8")
+    return {"type": "image_url", "image_url": {"url": f"data:{image['mime']};base64,{data}"}}
+
+def _structured(file_path: str, text: str = None):
+    """structured_labs.analyze_file(), or None when disabled or the file is not a lab table."""
+    if not DOC_STRUCTURED_LABS:
+        return None
+    with tracing.span("labs.parse") as span:
+        try:
+            result = structured_labs.analyze_file(file_path, text)
+        except Exception as e:
+            print(f"WARNING: could not parse {os.path.basename(file_path)} as a lab table ({e}); sending it as text")
+            return None
+        span.set(rows=result["rows"] if result else 0)
+    return result
+
+def _collect_content(file_paths):
+    """Returns (image parts, [(file name, text)], [structured lab findings])."""
+    image_paths, texts, structured = [], [], []
+    for file_path in file_paths:
+        ext = os.path.splitext(file_path)[-1].lower()
+        name = os.path.basename(file_path)
+
+        if ext in [".png", ".jpg", ".jpeg", ".webp"]:
+            image_paths.append(file_path)
+
+        elif ext in (".txt",) + structured_labs.TABLE_EXTS:
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read()
+            labs = _structured(file_path, text if ext == ".txt" else None)
+            if labs:
+                structured.append(labs["findings"])
+                text = labs["rest"]  # narrative lines around the values still go to the LLM
+            if text.strip():
+                texts.append((name, dedup_lines(text, min_repeats=DOC_BOILERPLATE_REPEATS)))
+
+        elif ext == ".pdf":
+            # Pages are extracted in parallel for large PDFs (see PDF_WORKERS), but the text is joined
+            # here: boilerplate de-duplication counts lines across the whole file and every text chunk
+            # is sent in one concurrent map step, so memory still grows with the PDF on this path.
+            with tracing.span("pdf.extract") as span:
+                pages = [text for _, text in iter_pdf_pages(file_path)]
+                pdf_text = "\n".join(pages)
+                span.set(pages=len(pages), bytes=os.path.getsize(file_path))
+            texts.append((name, dedup_lines(pdf_text, min_repeats=DOC_BOILERPLATE_REPEATS)))
+    # Downscaled, re-encoded and de-duplicated (image_preprocess.py)
+    images = [_image_part(image) for image in prepare_images(image_paths)]
+    return images, texts, structured
+
+def _text_chunks(texts, max_chars: int = None) -> List[str]:
+    """Packs all text into as few chunks as possible (at most `max_chars` each), splitting on lines."""
+    max_chars = max_chars or DOC_TEXT_CHUNK_CHARS
+    chunks, current, size = [], [], 0
+    for name, text in texts:
+        for line in [f"[{name}]\n"] + text.splitlines(keepends=True):
+            while len(line) > max_chars:  # pathological single line
+                chunks.append(line[:max_chars])
+                line = line[max_chars:]
+            if size + len(line) > max_chars and current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            current.append(line)
+            size += len(line)
+        if current and not current[-1].endswith("\n"):
+            current.append("\n")
+            size += 1
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def _map_units(images, texts) -> List[Dict]:
+    units = []
+    for i in range(0, len(images), IMAGE_BATCH_SIZE):
+        batch = images[i:i + IMAGE_BATCH_SIZE]
+        units.append({"kind": "images", "items": len(batch), "content": batch})
+    for chunk in _text_chunks(texts):
+        units.append({"kind": "text", "items": 1, "content": [{"type": "text", "text": chunk}]})
+    return units
+
+# -------------------------
+# Reduce: merge and de-duplicate findings
+# -------------------------
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+
+def _finding_key(line: str) -> str:
+    line = _BULLET.sub("", line).replace("**", "").lower()
+    return " ".join(re.sub(r"[^\w%/.<>=+-]+", " ", line).split()).rstrip(".")
+
+def merge_findings(reports: List[str]) -> str:
+    """Joins map outputs; a bullet already reported by an earlier batch is dropped."""
+    if len(reports) == 1:
+        return reports[0]
+    seen, merged = set(), []
+    for report in reports:
+        lines = []
+        for line in report.splitlines():
+            if _BULLET.match(line):
+                key = _finding_key(line)
+                if key in seen:
+                    continue
+                seen.add(key)
+            lines.append(line)
+        text = "\n".join(lines).strip()
+        if text:
+            merged.append(text)
+    return "\n\n---\n\n".join(merged)
+
+# -------------------------
+# Map step
+# -------------------------
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Honours Retry-After on 429s, else exponential backoff with jitter."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
     try:
-        images = []
-        texts = []
-
-        # Collect all content
-        for file_path in file_paths:
-            ext = os.path.splitext(file_path)[-1].lower()
-
-            if ext in [".png", ".jpg", ".jpeg", ".webp"]:
-                image_b64 = file_to_base64(file_path)
-                images.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/{ext[1:]};base64,{image_b64}"}
-                })
-
-            elif ext == ".txt":
-                with open(file_path, "r", encoding="utf-8") as f:
-                    texts.append({"type": "text", "text": f.read()})
-
-            elif ext == ".pdf":
-                pdf_text = extract_text_from_pdf(file_path)
-                texts.append({"type": "text", "text": pdf_text})
-
-        reports = []
-
-        # Function to run a batch safely
-        def run_batch(batch_content, note=None):
-            try:
-                prompt = "Extract all lab values, symptoms, and abnormalities from the following medical reports. Provide concise bullet points."
-                if note:
-                    prompt += f"\nUser Note: {note}"
-
-                combined_input = [{"role": "user", "content": batch_content + [{"type": "text", "text": prompt}]}]
-
-                resp = client.chat.completions.create(
-                    model=GROQ_MODEL,
-                    messages=combined_input,
-                    temperature=0.2
-                )
-                return resp.choices[0].message.content
-            except Exception as e:
-                return f"⚠️ Batch failed: {str(e)}"
-
-        # --- Step 1: Process images in batches of 5 (Groq hard limit) ---
-        batch_size = 5
-        for i in range(0, len(images), batch_size):
-            batch = images[i:i + batch_size] + texts
-            reports.append(run_batch(batch, user_note))
-
-        # --- Step 2: If no images, just process texts ---
-        if not images and texts:
-            reports.append(run_batch(texts, user_note))
-
-        # --- Step 3: If still no reports, fallback ---
-        if not reports:
+        if retry_after is not None:
+            return min(float(retry_after), 60.0)
+    except ValueError:
+        pass
+    return min(2 ** attempt, 30) * (0.5 + random.random())
+
+_RETRYABLE = (groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError)
+
+async def _map_one(index: int, total: int, unit: Dict, prompt: str, semaphore: asyncio.Semaphore, stats: List[Dict]):
+    usage: Dict[str, int] = {}
+    attempt = 0
+    # Concurrent batches must not interleave their tokens in one stream: with several
+    # batches, each finished batch is forwarded whole instead (this task's context only).
+    stage_sink = current_delta_sink()
+    if total > 1:
+        set_delta_sink(None)
+    async with semaphore:
+        start = time.perf_counter()  # latency of this batch, not time spent queued
+        with tracing.span("doc.map_batch", kind=unit["kind"], items=unit["items"]) as span:
+            while True:
+                attempt += 1
+                try:
+                    result = await achat_completion(unit["content"] + [{"type": "text", "text": prompt}],
+                                                    temperature=0.2, usage=usage)
+                    break
+                except _RETRYABLE as e:
+                    if attempt > DOC_MAP_RETRIES:
+                        result = f"⚠️ Batch failed: {str(e)}"
+                        break
+                    delay = _retry_delay(e, attempt)
+                    print(f"WARNING: map batch {index + 1}/{total} attempt {attempt} failed ({type(e).__name__}); retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    result = f"⚠️ Batch failed: {str(e)}"
+                    break
+            span.set(retries=attempt - 1)
+    seconds = time.perf_counter() - start
+    stats.append({"batch": index + 1, "kind": unit["kind"], "items": unit["items"], "seconds": round(seconds, 3),
+                  "attempts": attempt, **usage})
+    print(f"📊 Map batch {index + 1}/{total} ({unit['kind']} x{unit['items']}): {seconds:.1f}s, "
+          f"{usage.get('prompt_tokens', '?')} prompt / {usage.get('completion_tokens', '?')} completion tokens")
+    if stage_sink is not None and total > 1:
+        stage_sink(result + "\n\n---\n\n")
+    return result
+
+async def adocument_analyzer(file_paths, user_note=None, stats: List[Dict] = None) -> str:
+    """
+    Map-reduce document analysis. `stats`, if given, receives one dict per map
+    batch (kind, items, seconds, attempts, token counts).
+    """
+    if DOC_ANALYZER_MODE == "batch":
+        return await asyncio.to_thread(document_analyzer, file_paths, user_note)
+    try:
+        images, texts, structured = await asyncio.to_thread(_collect_content, file_paths)
+        units = _map_units(images, texts)
+        if not units and not structured:
             return "⚠️ No valid content found to analyze."
+        labs = "\n\n".join(structured)
+        sink = current_delta_sink()
+        if labs and sink is not None:
+            sink(labs + ("\n\n---\n\n" if units else ""))
+        if not units:
+            return labs
+
+        prompt = EXTRACT_PROMPT + (f"\nUser Note: {user_note}" if user_note else "")
+        stats = [] if stats is None else stats
+        semaphore = asyncio.Semaphore(max(1, DOC_MAP_CONCURRENCY))
+        reports = await asyncio.gather(*(_map_one(i, len(units), u, prompt, semaphore, stats)
+                                         for i, u in enumerate(units)))
+        stats.sort(key=lambda s: s["batch"])
+        return "\n\n---\n\n".join(filter(None, [labs, merge_findings(list(reports))]))
+
+    except Exception as e:
+        return f"❌ Document Analyzer failed: {str(e)}"
+
+def _batch_document_analyzer(file_paths, user_note=None) -> str:
+    """The original sequential path: image batches of 5, each carrying all of the text."""
+    images, texts, structured = _collect_content(file_paths)
+    texts = [{"type": "text", "text": text} for _, text in texts]
+    reports = list(structured)
 
-        return "\n\n---\n\n".join(reports)
+    # Function to run a batch safely
+    def run_batch(batch_content, note=None):
+        try:
+            prompt = EXTRACT_PROMPT
+            if note:
+                prompt += f"\nUser Note: {note}"
+
+            return chat_completion(batch_content + [{"type": "text", "text": prompt}], temperature=0.2)
+        except Exception as e:
+            return f"⚠️ Batch failed: {str(e)}"
+
+    # --- Step 1: Process images in batches of 5 (Groq hard limit) ---
+    for i in range(0, len(images), IMAGE_BATCH_SIZE):
+        batch = images[i:i + IMAGE_BATCH_SIZE] + texts
+        reports.append(run_batch(batch, user_note))
+
+    # --- Step 2: If no images, just process texts ---
+    if not images and texts:
+        reports.append(run_batch(texts, user_note))
+
+    # --- Step 3: If still no reports, fallback ---
+    if not reports:
+        return "⚠️ No valid content found to analyze."
+
+    return "\n\n---\n\n".join(reports)
+
+def document_analyzer(file_paths, user_note=None, stats: List[Dict] = None) -> str:
+    try:
+        if DOC_ANALYZER_MODE == "batch":
+            return _batch_document_analyzer(file_paths, user_note)
+        return run_coroutine_sync(adocument_analyzer(file_paths, user_note, stats))
 
     except Exception as e:
         return f"❌ Document Analyzer failed: {str(e)}"
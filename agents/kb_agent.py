@@ -1,32 +1,71 @@
-from data_analyze import client, GROQ_MODEL, rag_lookup_kb
+import re
+from data_analyze import chat_completion, achat_completion, rag_lookup_kb_batch
+from token_budget import fit
 
-def kb_agent(query_text, top_k=4):
-    hits = rag_lookup_kb(query_text, top_k=top_k)
-    if not hits:
-        return "No guideline passages found in KB."
+MAX_KB_QUERIES = 8
+MAX_KB_PASSAGES = 8
+
+def _differential_queries(text: str):
+    """One retrieval query per bullet / line of the reasoning (e.g. each differential diagnosis)."""
+    queries = []
+    for line in text.splitlines():
+        line = re.sub(r"^[\s\-\*\u2022#\d\.\)]+", "", line).replace("**", "").strip()
+        if len(line.split()) >= 2 and line not in queries:
+            queries.append(line[:300])
+    return queries[:MAX_KB_QUERIES]
+
+def _merge_hits(hits_per_query, limit):
+    """Round-robin over queries (best hit of each first) so every differential gets evidence."""
+    merged, seen = [], set()
+    for rank in range(max((len(h) for h in hits_per_query), default=0)):
+        for hits in hits_per_query:
+            if rank < len(hits) and hits[rank]["passage"] not in seen:
+                seen.add(hits[rank]["passage"])
+                merged.append(hits[rank])
+    return merged[:limit]
+
+NO_KB_PASSAGES = "No guideline passages found in KB."
+
+def retrieve_kb_hits(query_text, top_k=4):
+    # Whole text first (the original single query), then one query per differential,
+    # all retrieved in a single batched encoder call and FAISS search.
+    queries = [query_text] + _differential_queries(query_text)
+    limit = max(top_k, min(len(queries) - 1, MAX_KB_PASSAGES))
+    return _merge_hits(rag_lookup_kb_batch(queries, top_k=top_k), limit)
 
+def _kb_format_prompt(hits) -> str:
     raw_passages = []
     for h in hits:
         passage = h.get("passage", "").strip()
         if len(passage) > 1000:
             passage = passage[:950].rsplit(" ", 1)[0] + "..."
+        if h.get("source"):
+            passage = f"[{h['source']}, p.{h.get('page')}] {passage}"
         raw_passages.append(passage)
 
-    combined_text = "\n\n".join(raw_passages)
+    combined_text = fit("kb_format", "\n\n".join(raw_passages))
 
-    prompt = f"""
+    return f"""
 Reformat the following medical guideline passages into clear, easy-to-read bullet points.
 Each bullet point should be concise and include a short explanation for better understanding.
 
 Passages:
 {combined_text}
 """
+
+def format_kb_hits(hits) -> str:
+    if not hits:
+        return NO_KB_PASSAGES
     try:
-        resp = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
-        )
-        return resp.choices[0].message.content
+        return chat_completion(_kb_format_prompt(hits), temperature=0.3)
     except Exception as e:
         return f"Error formatting KB output: {str(e)}"
+
+async def aformat_kb_hits(hits) -> str:
+    """Async variant for the pipeline DAG; errors propagate so the stage can retry."""
+    if not hits:
+        return NO_KB_PASSAGES
+    return await achat_completion(_kb_format_prompt(hits), temperature=0.3)
+
+def kb_agent(query_text, top_k=4):
+    return format_kb_hits(retrieve_kb_hits(query_text, top_k=top_k))
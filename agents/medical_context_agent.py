@@ -1,17 +1,93 @@
-from data_analyze import client, GROQ_MODEL
+import os
+import asyncio
+from typing import Dict, List, Optional, Tuple
 
-def medical_context_icd(data: str) -> str:
-    try:
-        prompt = f"""
+from data_analyze import chat_completion, achat_completion
+from pipeline_dag import current_delta_sink
+from token_budget import fit
+import tracing
+import icd_index
+
+# hybrid: code findings from the local ICD-10 catalogue (icd_index.py) and ask the LLM only to
+# confirm the uncertain ones; llm: the full free-form prompt; local: never call the LLM.
+ICD_MODE = os.getenv("ICD_MODE", "hybrid").lower()
+
+def _icd_prompt(data: str) -> str:
+    data = fit("icd", data)
+    return f"""
         You are a clinical assistant. Based on the extracted findings below, list likely ICD-10 codes with short explanations.
         Provide concise bullet points for context.
 
         Findings:
         {data}
         """
-        resp = client.chat.completions.create(model=GROQ_MODEL,
-                                              messages=[{"role": "user", "content": prompt}],
-                                              temperature=0.2)
-        return resp.choices[0].message.content
+
+def _confirm_prompt(pending: List[Dict]) -> str:
+    items = []
+    for i, r in enumerate(pending, 1):
+        options = "; ".join(f"{c['code']} {c['description']}" + (" (negated in the finding)" if c.get("negated") else "")
+                            for c in r["candidates"]) or "none in the local catalogue"
+        items.append(f"{i}. {r['finding']}\n   Candidates: {options}")
+    listing = "\n".join(items)
+    return f"""
+        You are a clinical assistant. For each finding below, choose the ICD-10 code(s) that apply from its candidates,
+        or answer "none" if no candidate fits; suggest a code only where no candidates are listed.
+        Do not code anything the finding negates ("denies smoking", "HBsAg negative").
+        Reply with one concise bullet per finding: code - description - short explanation.
+
+        Findings:
+        {listing}
+        """
+
+def _local_bullets(resolved: List[Dict]) -> str:
+    seen = {}
+    for r in resolved:
+        for c in r["candidates"]:
+            if c["score"] >= icd_index.ICD_CONFIDENT_SCORE:
+                seen.setdefault(c["code"], f"- {c['code']} {c['description']} — {r['finding'][:120]}")
+    return "ICD-10 codes (local catalogue):\n" + "\n".join(seen.values())
+
+def _plan(data: str) -> Tuple[str, Optional[str]]:
+    """
+    (locally coded bullets, prompt for the LLM or None). Findings coded confidently
+    by the catalogue, with nothing negated, are answered locally; the rest go to
+    the LLM with their candidate codes, as do lines that negate one thing and
+    report another. Falls back to the free-form prompt when nothing matches.
+    """
+    if ICD_MODE == "llm":
+        return "", _icd_prompt(data)
+    with tracing.span("icd.match") as span:
+        results = icd_index.get_icd_index().match(icd_index.finding_lines(data))
+        resolved = [r for r in results if r["resolved"]]
+        pending = [r for r in results if not r["resolved"]
+                   and (r["candidates"] or r["mixed"] or icd_index.is_abnormal(r["finding"]))]
+        span.set(findings=len(results), resolved=len(resolved), pending=len(pending))
+    local = _local_bullets(resolved) if resolved else ""
+    if ICD_MODE == "local":
+        if pending:
+            local += ("\n\n" if local else "") + "Possible ICD-10 codes (unconfirmed):\n" + "\n".join(
+                f"- {r['finding'][:120]}: " + (", ".join(c["code"] for c in r["candidates"]) or "no local match")
+                for r in pending)
+        return local or "No ICD-10 codes matched the findings.", None
+    if not resolved and not any(r["candidates"] for r in pending):
+        return "", _icd_prompt(data)
+    print(f"📊 ICD mapping: {len(resolved)} findings coded locally, {len(pending)} sent to the LLM")
+    return local, _confirm_prompt(pending) if pending else None
+
+def _join(local: str, answer: str) -> str:
+    return "\n\n".join(part for part in (local, answer) if part)
+
+def medical_context_icd(data: str) -> str:
+    try:
+        local, prompt = _plan(data)
+        return _join(local, chat_completion(prompt, temperature=0.2) if prompt else "")
     except Exception as e:
         return f"❌ Medical Context Agent failed: {str(e)}"
+
+async def amedical_context_icd(data: str) -> str:
+    """Async variant for the pipeline DAG; errors propagate so the stage can retry."""
+    local, prompt = await asyncio.to_thread(_plan, data)  # the embedding search is CPU-bound
+    sink = current_delta_sink()
+    if local and sink is not None:
+        sink(local + ("\n\n" if prompt else ""))
+    return _join(local, await achat_completion(prompt, temperature=0.2) if prompt else "")
@@ -1,16 +1,21 @@
-from data_analyze import client, GROQ_MODEL
+from data_analyze import chat_completion, achat_completion
+from token_budget import fit
 
-def reasoning_agent(data: str) -> str:
-    try:
-        prompt = f"""
+def _reasoning_prompt(data: str) -> str:
+    data = fit("reasoning", data)
+    return f"""
         Analyze the medical findings and ICD codes below.
         Provide a concise clinical reasoning summary in bullet points.
 
         {data}
         """
-        resp = client.chat.completions.create(model=GROQ_MODEL,
-                                              messages=[{"role": "user", "content": prompt}],
-                                              temperature=0.2)
-        return resp.choices[0].message.content
+
+def reasoning_agent(data: str) -> str:
+    try:
+        return chat_completion(_reasoning_prompt(data), temperature=0.2)
     except Exception as e:
         return f"❌ Reasoning Agent failed: {str(e)}"
+
+async def areasoning_agent(data: str) -> str:
+    """Async variant for the pipeline DAG; errors propagate so the stage can retry."""
+    return await achat_completion(_reasoning_prompt(data), temperature=0.2)
@@ -1,23 +1,16 @@
-import re
-from data_analyze import client, GROQ_MODEL, get_openfda_warnings
+from typing import Dict, List
+from data_analyze import chat_completion, achat_completion, get_openfda_warnings_many
+from drug_lexicon import extract_drugs
+from token_budget import fit, budget_for, count_tokens
 
 def _extract_drug_candidates(text: str):
-    common_drugs = ["metformin", "insulin", "ibuprofen", "aspirin", "atorvastatin",
-                    "amlodipine", "lisinopril", "paracetamol", "amoxicillin",
-                    "ciprofloxacin", "warfarin"]
-    found = set()
-    text_lower = text.lower()
-    for d in common_drugs:
-        if d in text_lower:
-            found.add(d)
-    candidates = re.findall(r"\b([A-Za-z]{3,20}(?:in|ol|ide|ene|ine|cillin))\b", text_lower)
-    for c in candidates:
-        found.add(c)
-    return list(found)
+    # Whole-word lexicon match (see drug_lexicon.py); brand names come back as their generic.
+    return extract_drugs(text)
 
-def treatment_planner_agent(data: str, kb_snippets: str = None) -> str:
-    try:
-        prompt = f"""
+def _plan_prompt(data: str, kb_snippets: str = None) -> str:
+    # KB snippets are already bounded (kb_agent); the upstream reports take the rest of the budget.
+    data = fit("plan", data, budget=max(budget_for("plan") - count_tokens(kb_snippets or ""), 1000))
+    return f"""
         Based on findings, ICD codes, clinical reasoning, and guideline snippets, create a concise treatment plan.
         Use bullet points and short explanations. Mention FDA drug warnings if relevant.
 
@@ -27,33 +20,46 @@ def treatment_planner_agent(data: str, kb_snippets: str = None) -> str:
         KB SNIPPETS:
         {kb_snippets if kb_snippets else 'No KB snippets provided.'}
         """
-        resp = client.chat.completions.create(model=GROQ_MODEL,
-                                              messages=[{"role": "user", "content": prompt}],
-                                              temperature=0.3)
-        plan = resp.choices[0].message.content
-
-        candidates = _extract_drug_candidates(plan + "\n" + data + ("\n" + (kb_snippets or "")))
-        enriched_notes = []
-        for drug in candidates:
-            warnings = get_openfda_warnings(drug)
-            enriched_notes.append({
-                "drug": drug,
-                "fda_warnings": warnings
-            })
-
-        safety_sections = []
-        for e in enriched_notes:
-            s = f"🔹 {e['drug'].title()}\n"
-            warnings = e["fda_warnings"]
-            if isinstance(warnings, dict):
-                s += f"- FDA Warnings (brand/generic): {warnings.get('brand')}/{warnings.get('generic')}\n"
-                s += f"  * Summary: {warnings.get('warnings')}\n"
-            else:
-                s += f"- FDA Warnings: {warnings}\n"
-            safety_sections.append(s)
-
-        safety_text = "\n\n".join(safety_sections) if safety_sections else "No drug candidates found for FDA safety checks."
-        return plan + "\n\n---\n\nSafety Notes (FDA-augmented):\n" + safety_text
+
+def lookup_drug_warnings(candidates: List[str], known: Dict[str, dict] = None) -> Dict[str, dict]:
+    """OpenFDA warnings per drug; drugs already in `known` (e.g. prefetched) are not looked up again."""
+    known = dict(known or {})
+    missing = [d for d in candidates if d not in known]
+    # All missing candidates are checked concurrently (pooled, cached; see openfda_client.py).
+    known.update(zip(missing, get_openfda_warnings_many(missing)))
+    return known
+
+def prefetch_drug_warnings(data: str, kb_snippets: str = None) -> Dict[str, dict]:
+    """Looks up the drugs already named in the inputs while the plan is still being written."""
+    return lookup_drug_warnings(_extract_drug_candidates(data + ("\n" + (kb_snippets or ""))))
+
+def add_safety_notes(plan: str, data: str, kb_snippets: str = None, known: Dict[str, dict] = None) -> str:
+    candidates = _extract_drug_candidates(plan + "\n" + data + ("\n" + (kb_snippets or "")))
+    warnings_by_drug = lookup_drug_warnings(candidates, known)
+    enriched_notes = [{"drug": drug, "fda_warnings": warnings_by_drug[drug]} for drug in candidates]
+
+    safety_sections = []
+    for e in enriched_notes:
+        s = f"🔹 {e['drug'].title()}\n"
+        warnings = e["fda_warnings"]
+        if isinstance(warnings, dict):
+            s += f"- FDA Warnings (brand/generic): {warnings.get('brand')}/{warnings.get('generic')}\n"
+            s += f"  * Summary: {warnings.get('warnings')}\n"
+        else:
+            s += f"- FDA Warnings: {warnings}\n"
+        safety_sections.append(s)
+
+    safety_text = "\n\n".join(safety_sections) if safety_sections else "No drug candidates found for FDA safety checks."
+    return plan + "\n\n---\n\nSafety Notes (FDA-augmented):\n" + safety_text
+
+async def aplan_treatment(data: str, kb_snippets: str = None) -> str:
+    """Async plan-writing step for the pipeline DAG (FDA notes are added by add_safety_notes)."""
+    return await achat_completion(_plan_prompt(data, kb_snippets), temperature=0.3)
+
+def treatment_planner_agent(data: str, kb_snippets: str = None) -> str:
+    try:
+        plan = chat_completion(_plan_prompt(data, kb_snippets), temperature=0.3)
+        return add_safety_notes(plan, data, kb_snippets)
 
     except Exception as e:
         return f"❌ Treatment Planner Agent failed: {str(e)}"
@@ -0,0 +1,88 @@
+# ann_index.py - FAISS index backends for the STG knowledge base
+#
+# Supported index types (all L2, so scores stay comparable with the original flat index):
+#   flat      exact brute-force search (IndexFlatL2), the default
+#   ivf_flat  inverted lists over full vectors; search knob: nprobe
+#   hnsw      HNSW graph over full vectors; search knob: ef_search
+#   ivf_pq    inverted lists over product-quantized codes, for memory-bound nodes; knob: nprobe
+
+import math
+import numpy as np
+from typing import Dict, Any, Optional
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+# Build/search defaults; anything passed to build_faiss_index overrides these.
+DEFAULT_INDEX_PARAMS = {
+    "ivf_flat": {"nlist": None, "nprobe": 8},
+    "hnsw": {"M": 32, "ef_construction": 80, "ef_search": 64},
+    "ivf_pq": {"nlist": None, "m": 48, "nbits": 8, "nprobe": 16},
+}
+
+def _default_nlist(n: int) -> int:
+    # ~4*sqrt(n) lists, but keep at least ~39 training points per centroid.
+    return max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+
+def _largest_divisor_at_most(d: int, m: int) -> int:
+    for k in range(min(m, d), 0, -1):
+        if d % k == 0:
+            return k
+    return 1
+
+def build_faiss_index(embeddings: np.ndarray, index_type: str = "flat", **params):
+    """
+    Builds, trains and fills a FAISS index of `index_type` over `embeddings`.
+    Returns (index, resolved_params); the params dict is what should be persisted
+    next to the index so it can be rebuilt and searched with the same settings.
+    """
+    import faiss
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown KB index type '{index_type}'. Choose one of: {', '.join(INDEX_TYPES)}")
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, d = embeddings.shape
+    resolved: Dict[str, Any] = {**DEFAULT_INDEX_PARAMS.get(index_type, {}), **params}
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, int(resolved["M"]))
+        index.hnsw.efConstruction = int(resolved["ef_construction"])
+        index.hnsw.efSearch = int(resolved["ef_search"])
+
+    else:
+        nlist = int(resolved.get("nlist") or _default_nlist(n))
+        resolved["nlist"] = nlist
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            m = _largest_divisor_at_most(d, int(resolved["m"]))
+            # PQ training needs at least 2**nbits points per sub-quantizer.
+            nbits = min(int(resolved["nbits"]), max(1, int(math.log2(max(n, 2)))))
+            resolved.update(m=m, nbits=nbits)
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, m, nbits)
+        index.train(embeddings)
+        index.nprobe = int(resolved["nprobe"])
+
+    if n:
+        index.add(embeddings)
+    resolved["type"] = index_type
+    resolved["dim"] = d
+    return index, resolved
+
+def search_parameters(index_params: Optional[Dict[str, Any]], nprobe: int = None, ef_search: int = None):
+    """
+    Per-call FAISS SearchParameters for the index described by `index_params`.
+    Passed to index.search(...) so concurrent queries can use different knobs
+    without mutating the shared index. Returns None for exact (flat) search.
+    """
+    import faiss
+
+    index_type = (index_params or {}).get("type", "flat")
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe or index_params.get("nprobe", 8)))
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search or index_params.get("ef_search", 64)))
+    return None
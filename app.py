@@ -1,8 +1,10 @@
 import streamlit as st
 import os
-import tempfile
+import uuid
+import shutil
 from datetime import datetime
-from crew_orchestrator import run_medical_crew  # Correct import
+from crew_orchestrator import REPORT_SECTIONS
+from job_queue import get_job_queue, new_upload_dir, AdmissionError, FINISHED
 
 # --- Streamlit App Config ---
 st.set_page_config(
@@ -58,6 +60,97 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# --- Analysis jobs ---
+# Analyses run in a background worker pool (job_queue.py); this page only polls the
+# job's stored progress, so a rerun, reload or second tab can reattach to it.
+JOB_POLL_INTERVAL_S = 0.5
+jobs = get_job_queue()
+if "user_id" not in st.session_state:
+    st.session_state.user_id = uuid.uuid4().hex
+
+def _render_job(info):
+    """Status line and report sections of a job, as far as its stages got."""
+    file_names = [os.path.basename(p) for p in info["file_paths"]]
+    if info["status"] == "queued":
+        st.markdown(f'<div class="processing">Queued (position {info.get("position", 1)})...</div>', unsafe_allow_html=True)
+    elif info["status"] == "running":
+        label = info["current_label"] or f"Processing {len(file_names)} files"
+        st.markdown(f'<div class="processing">{label}...</div>', unsafe_allow_html=True)
+
+    # Sections fill in as their stages stream tokens; each shows the stage's
+    # final text once it completes.
+    with st.container():
+        st.markdown('<div class="result-card">', unsafe_allow_html=True)
+        st.markdown("### 🧾 Combined Analysis Report")
+        st.markdown(f'<div class="file-info">Files analyzed: {", ".join(file_names)}</div>', unsafe_allow_html=True)
+        for _, heading, stages in REPORT_SECTIONS:
+            started = [info["stages"][s] for s in stages if s in info["stages"]]
+            if not started:
+                continue
+            done = stages[-1] in info["stages"] and info["stages"][stages[-1]]["status"] != "running"
+            st.markdown(f"{heading}\n{started[-1]['text']}{'' if done else ' ▌'}")
+        if info["status"] == "done" and not info["stages"]:  # setup failed before any stage ran
+            st.markdown(info["report"])
+        st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_S)
+def _job_progress(job_id):
+    # Only this fragment reruns on each tick, so the rest of the page (chat
+    # history tab included) stays live while the job runs.
+    info = jobs.status(job_id)
+    if info is None or info["status"] in FINISHED:
+        st.rerun()  # the full run renders the finished job and stops polling
+    _render_job(info)
+
+def show_job(job_id):
+    info = jobs.status(job_id)
+    if info is None:
+        st.warning("This analysis is no longer available.")
+        st.session_state.pop("active_job", None)
+        return
+    if info["status"] not in FINISHED:
+        if st.button("✖ Cancel analysis", type="secondary"):
+            jobs.cancel(job_id)
+        _job_progress(job_id)
+        return
+
+    status_placeholder = st.empty()
+    _render_job(info)
+    if info["status"] == "cancelled":
+        status_placeholder.info("Analysis cancelled.")
+        return
+    if info["status"] == "failed":
+        st.error(f"Error during analysis: {info['error']}")
+        return
+
+    analysis = info["report"]
+    recorded = st.session_state.setdefault("recorded_jobs", set())
+    if job_id not in recorded:
+        recorded.add(job_id)
+        st.session_state.setdefault("chat_history", []).append({
+            "role": "bot",
+            "content": analysis,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+
+    status_placeholder.markdown('<div class="success">✅ Analysis Complete!</div>', unsafe_allow_html=True)
+
+    full_report = f"""Healthcare Diagnostic Analysis Report
+Generated on: {datetime.fromtimestamp(info["finished"]).strftime("%Y-%m-%d %H:%M:%S")}
+
+{analysis}
+
+---
+Disclaimer: This report is for informational purposes only.
+"""
+    st.download_button(
+        "📥 Download Full Report (TXT)",
+        data=full_report,
+        file_name=f"healthcare_analysis_{datetime.fromtimestamp(info['finished']).strftime('%Y%m%d_%H%M%S')}.txt",
+        mime="text/plain",
+        use_container_width=True
+    )
+
 # --- Tabs ---
 tab1, tab2 = st.tabs(["📋 Upload & Analyze", "💬 Chat History"])
 
@@ -66,7 +159,7 @@ with tab1:
     st.markdown("### 📁 Upload Medical Documents")
     uploaded_files = st.file_uploader(
         "Choose files",
-        type=["pdf", "txt", "png", "jpg", "jpeg", "webp"],
+        type=["pdf", "txt", "csv", "tsv", "png", "jpg", "jpeg", "webp"],
         accept_multiple_files=True,
         help="Upload one or more files."
     )
@@ -86,66 +179,40 @@ with tab1:
             if "chat_history" not in st.session_state:
                 st.session_state.chat_history = []
 
-            # Save uploaded files temporarily
+            # Files are kept in a per-job directory until the job finishes (the job outlives this script run).
+            upload_dir = new_upload_dir()
             file_paths, file_names = [], []
-            for file in uploaded_files:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as tmp_file:
-                    tmp_file.write(file.read())
-                    file_paths.append(tmp_file.name)
-                    file_names.append(file.name)
-
-            user_message = f"Analyzed {len(file_names)} file(s): {', '.join(file_names)}"
-            if user_description:
-                user_message += f"\n\nWith additional context: {user_description}"
-            st.session_state.chat_history.append({
-                "role": "user",
-                "content": user_message,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-
-            status_placeholder = st.empty()
-            status_placeholder.markdown(f'<div class="processing">Processing {len(file_names)} files with CrewAI...</div>', unsafe_allow_html=True)
+            for i, file in enumerate(uploaded_files):
+                name = os.path.basename(file.name)
+                path = os.path.join(upload_dir, name)
+                if os.path.exists(path):
+                    path = os.path.join(upload_dir, f"{i}_{name}")
+                with open(path, "wb") as f:
+                    f.write(file.read())
+                file_paths.append(path)
+                file_names.append(file.name)
 
             try:
-                analysis = run_medical_crew(file_paths, user_description)
-
-                with st.container():
-                    st.markdown('<div class="result-card">', unsafe_allow_html=True)
-                    st.markdown("### 🧾 Combined Analysis Report")
-                    st.markdown(f'<div class="file-info">Files analyzed: {", ".join(file_names)}</div>', unsafe_allow_html=True)
-                    st.markdown(analysis)
-                    st.markdown('</div>', unsafe_allow_html=True)
+                job_id = jobs.submit(st.session_state.user_id, file_paths, user_description, upload_dir=upload_dir)
+            except AdmissionError as e:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+                st.warning(f"⏳ {e}")
+            else:
+                st.session_state.active_job = job_id
+                st.query_params["job"] = job_id  # a reload of this URL reattaches to the job
 
+                user_message = f"Analyzed {len(file_names)} file(s): {', '.join(file_names)}"
+                if user_description:
+                    user_message += f"\n\nWith additional context: {user_description}"
                 st.session_state.chat_history.append({
-                    "role": "bot",
-                    "content": analysis,
+                    "role": "user",
+                    "content": user_message,
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 })
 
-                status_placeholder.markdown('<div class="success">✅ Analysis Complete!</div>', unsafe_allow_html=True)
-
-                full_report = f"""Healthcare Diagnostic Analysis Report
-Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
-{analysis}
-
----
-Disclaimer: This report is for informational purposes only.
-"""
-                st.download_button(
-                    "📥 Download Full Report (TXT)",
-                    data=full_report,
-                    file_name=f"healthcare_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                    mime="text/plain",
-                    use_container_width=True
-                )
-
-            except Exception as e:
-                st.error(f"Error during analysis: {str(e)}")
-            finally:
-                for path in file_paths:
-                    if os.path.exists(path):
-                        os.unlink(path)
+    active_job = st.session_state.get("active_job") or st.query_params.get("job")
+    if active_job:
+        show_job(active_job)
 
 with tab2:
     st.markdown("### 💬 Analysis History")
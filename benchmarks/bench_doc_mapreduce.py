@@ -0,0 +1,125 @@
+# benchmarks/bench_doc_mapreduce.py - Document analysis: old batch mode vs. map-reduce
+#
+# Builds a synthetic upload (N small images + an M-page PDF) and runs both
+# modes of agents/document_analyzer.py against a simulated Groq endpoint:
+# latency = base + per-prompt-token cost, a fraction of calls answer 429 with
+# Retry-After, and token counts are estimated (text chars / 4, fixed cost per
+# image). No network or API key is needed.
+#
+#   python benchmarks/bench_doc_mapreduce.py --images 20 --pages 100 --concurrency 4
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import groq
+import httpx
+import agents.document_analyzer as da
+
+IMAGE_TOKENS = 800
+FINDINGS = ["- Hemoglobin 10.2 g/dL (low)", "- Fasting glucose 142 mg/dL (high)", "- Blood pressure 150/95 mmHg",
+            "- Serum creatinine 1.1 mg/dL (normal)", "- Complains of fatigue for 3 weeks", "- HbA1c 7.8 %"]
+
+class FakeGroq:
+    def __init__(self, base_s: float, per_1k_tokens_s: float, rate_limit: float, seed: int = 0):
+        self.base_s, self.per_1k, self.rate_limit = base_s, per_1k_tokens_s, rate_limit
+        self.rng = random.Random(seed)
+        self.calls = self.throttled = 0
+
+    def _tokens(self, content) -> int:
+        return sum(IMAGE_TOKENS if p["type"] == "image_url" else len(p["text"]) // 4 for p in content)
+
+    def _respond(self, prompt, usage):
+        self.calls += 1
+        prompt_tokens = self._tokens(prompt)
+        if self.rng.random() < self.rate_limit:
+            self.throttled += 1
+            req = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+            resp = httpx.Response(429, headers={"retry-after": "0.2"}, request=req)
+            raise groq.RateLimitError("rate limited", response=resp, body=None)
+        text = "\n".join(self.rng.sample(FINDINGS, 4))
+        if usage is not None:
+            usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + prompt_tokens
+            usage["completion_tokens"] = usage.get("completion_tokens", 0) + len(text) // 4
+        return prompt_tokens, text
+
+    def sync(self, prompt, temperature=0.2, usage=None, **kw):
+        while True:  # the SDK's own retry loop, for the batch path
+            try:
+                tokens, text = self._respond(prompt, usage)
+                break
+            except groq.RateLimitError:
+                time.sleep(0.2)
+        self.prompt_tokens += tokens
+        time.sleep(self.base_s + self.per_1k * tokens / 1000)
+        return text
+
+    async def aio(self, prompt, temperature=0.2, usage=None, **kw):
+        tokens, text = self._respond(prompt, usage)
+        self.prompt_tokens += tokens
+        await asyncio.sleep(self.base_s + self.per_1k * tokens / 1000)
+        return text
+
+def make_upload(tmp: str, n_images: int, pages: int):
+    from PIL import Image
+    import fitz
+    paths = []
+    for i in range(n_images):
+        path = os.path.join(tmp, f"scan_{i}.png")
+        Image.new("RGB", (64, 64), (i * 7 % 255, 80, 120)).save(path)
+        paths.append(path)
+    pdf = os.path.join(tmp, "report.pdf")
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), f"Page {p + 1}\n" + "Hemoglobin 10.2 g/dL. Glucose 142 mg/dL. " * 40, fontsize=9)
+    doc.save(pdf)
+    doc.close()
+    return paths + [pdf]
+
+def run(mode: str, files, fake: FakeGroq):
+    da.DOC_ANALYZER_MODE = mode
+    fake.calls = fake.throttled = fake.prompt_tokens = 0
+    stats = []
+    t0 = time.perf_counter()
+    report = da.document_analyzer(files, "benchmark", stats=stats)
+    return {"wall": time.perf_counter() - t0, "calls": fake.calls, "throttled": fake.throttled,
+            "prompt_tokens": fake.prompt_tokens, "bullets": sum(l.startswith("- ") for l in report.splitlines()),
+            "stats": stats}
+
+def main():
+    ap = argparse.ArgumentParser(description="Document analyzer map-reduce benchmark (simulated Groq)")
+    ap.add_argument("--images", type=int, default=20)
+    ap.add_argument("--pages", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--base", type=float, default=0.3, help="simulated per-call latency (s)")
+    ap.add_argument("--per-1k", type=float, default=0.05, help="simulated latency per 1k prompt tokens (s)")
+    ap.add_argument("--rate-limit", type=float, default=0.1, help="fraction of calls answered with 429")
+    args = ap.parse_args()
+
+    da.DOC_MAP_CONCURRENCY = args.concurrency
+    fake = FakeGroq(args.base, args.per_1k, args.rate_limit)
+    da.chat_completion, da.achat_completion = fake.sync, fake.aio
+    with tempfile.TemporaryDirectory() as tmp:
+        files = make_upload(tmp, args.images, args.pages)
+        rows = [("batch (old)", run("batch", files, fake)), ("map_reduce", run("map_reduce", files, fake))]
+
+    print(f"\n{args.images} images + {args.pages}-page PDF, concurrency {args.concurrency}, "
+          f"{args.rate_limit:.0%} of calls rate-limited\n")
+    print(f"{'mode':<13}{'wall s':>8}{'calls':>7}{'429s':>6}{'prompt tokens':>15}{'bullets':>9}")
+    for name, r in rows:
+        print(f"{name:<13}{r['wall']:>8.2f}{r['calls']:>7}{r['throttled']:>6}{r['prompt_tokens']:>15}{r['bullets']:>9}")
+    print("\nmap_reduce per batch:")
+    for s in rows[1][1]["stats"]:
+        print(f"  #{s['batch']:<3}{s['kind']:<7}x{s['items']:<3}{s['seconds']:>6.2f}s  attempts {s['attempts']}  "
+              f"{s.get('prompt_tokens', 0)} prompt / {s.get('completion_tokens', 0)} completion tokens")
+
+if __name__ == "__main__":
+    main()
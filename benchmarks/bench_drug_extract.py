@@ -0,0 +1,107 @@
+# benchmarks/bench_drug_extract.py - Drug-entity extraction: precision, recall, throughput
+#
+# Generates synthetic clinical notes with known drug mentions (generic and brand
+# names, mixed case, plus some real drugs that are NOT in the lexicon) around
+# filler text full of suffix traps ("protein", "routine", "creatinine",
+# "examine", ...). It then compares the old substring + suffix-regex extractor
+# with the lexicon matcher:
+#
+#   python benchmarks/bench_drug_extract.py --docs 2000 --seed 0
+#
+# "lookups/doc" is the number of OpenFDA calls each extractor would trigger.
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drug_lexicon import load_lexicon, read_lexicon_file
+
+FILLER = (
+    "patient reports fatigue within the last two weeks . routine examination was unremarkable . "
+    "serum creatinine and urine protein are within normal limits . examine the abdomen and review "
+    "baseline hemoglobin . medicine reconciliation done at discharge . continue the routine diet and "
+    "adequate protein intake . thyroid function, vitamin levels and cholesterol to be repeated . "
+    "the patient is a retired engineer who walks daily . no chest pain , no dyspnea on exertion . "
+    "discussed the treatment plan and the discipline of taking medicine on time . review in the clinic"
+).split()
+
+# Real drugs deliberately absent from data/drug_lexicon.tsv (bounded recall, honestly measured).
+UNLISTED = ["dolutegravir", "semaglutide", "apremilast", "sacubitril", "ertugliflozin", "lurasidone"]
+
+def legacy_extract(text: str):
+    """The extractor the treatment planner used before the lexicon."""
+    common_drugs = ["metformin", "insulin", "ibuprofen", "aspirin", "atorvastatin",
+                    "amlodipine", "lisinopril", "paracetamol", "amoxicillin",
+                    "ciprofloxacin", "warfarin"]
+    found = set()
+    text_lower = text.lower()
+    for d in common_drugs:
+        if d in text_lower:
+            found.add(d)
+    for c in re.findall(r"\b([A-Za-z]{3,20}(?:in|ol|ide|ene|ine|cillin))\b", text_lower):
+        found.add(c)
+    return list(found)
+
+def make_corpus(n_docs: int, seed: int):
+    rng = random.Random(seed)
+    entries = read_lexicon_file()
+    surfaces = sorted(entries)
+    docs = []
+    for _ in range(n_docs):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(150, 400))]
+        truth_canonical, truth_surface = set(), set()
+        for _ in range(rng.randint(1, 6)):
+            if rng.random() < 0.1:
+                name = canonical = rng.choice(UNLISTED)
+            else:
+                name = rng.choice(surfaces)
+                canonical = entries[name]
+            form = rng.choice([name, name.title(), name.upper()])
+            words.insert(rng.randrange(len(words)), f"{form} {rng.choice(['500 mg', '10 mg daily', 'bd', 'prn'])}")
+            truth_canonical.add(canonical)
+            truth_surface.add(name)
+        docs.append((" ".join(words), truth_canonical, truth_surface))
+    return docs
+
+def score(extract, docs, truth_index: int):
+    tp = fp = fn = calls = 0
+    t0 = time.perf_counter()
+    outputs = [extract(text) for text, *_ in docs]
+    seconds = time.perf_counter() - t0
+    for out, doc in zip(outputs, docs):
+        truth, got = doc[truth_index], set(out)
+        calls += len(got)
+        tp += len(got & truth)
+        fp += len(got - truth)
+        fn += len(truth - got)
+    mb = sum(len(text.encode("utf-8")) for text, *_ in docs) / 2**20
+    return {"precision": tp / max(tp + fp, 1), "recall": tp / max(tp + fn, 1),
+            "mb_s": mb / seconds, "calls": calls / len(docs)}
+
+def main():
+    ap = argparse.ArgumentParser(description="Drug extraction benchmark")
+    ap.add_argument("--docs", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--use-mirror", action="store_true", help="extend the lexicon from the OpenFDA mirror")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    lexicon = load_lexicon(use_mirror=args.use_mirror)
+    build_s = time.perf_counter() - t0
+    docs = make_corpus(args.docs, args.seed)
+    mb = sum(len(d[0]) for d in docs) / 2**20
+    print(f"{args.docs} docs, {mb:.1f} MB; lexicon: {len(lexicon)} names, built in {build_s * 1000:.0f} ms\n")
+
+    # The legacy extractor returns surface forms; score it against surface names.
+    rows = [("legacy regex", score(legacy_extract, docs, 2)), ("lexicon (AC)", score(lexicon.extract, docs, 1))]
+    print(f"{'extractor':<14}{'precision':>11}{'recall':>9}{'MB/s':>8}{'lookups/doc':>13}")
+    for name, r in rows:
+        print(f"{name:<14}{r['precision']:>11.3f}{r['recall']:>9.3f}{r['mb_s']:>8.1f}{r['calls']:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# benchmarks/bench_embedder_backends.py - MiniLM embedder: torch vs. ONNX Runtime (fp32 / int8)
+#
+# Each backend runs in a fresh interpreter (so import cost and RSS are its own)
+# over the same texts: passages chunked from standard-treatment-guidelines.pdf
+# and the clinical queries of bench_kb_ann.py. Reports load time (imports +
+# model), batch encode throughput, single-query latency, peak RSS, and against
+# the first backend (the fp32 reference, torch by default): cosine agreement of
+# the vectors and overlap of the top-k passages retrieved per query.
+#
+#   python benchmarks/bench_embedder_backends.py --passages 2000 --threads 0
+#   python benchmarks/bench_embedder_backends.py --model /path/to/local/model   # offline
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter: load one backend, encode, report timings.
+_WORKER = r"""
+import os, sys, time, json, resource
+import numpy as np
+sys.path.insert(0, os.getcwd())
+backend, model, texts_path, out_prefix, batch_size = sys.argv[1:6]
+t0 = time.perf_counter()
+from embedder_backends import load_embedder
+embedder = load_embedder(model, backend)
+load_s = time.perf_counter() - t0
+with open(texts_path, encoding="utf-8") as f:
+    texts = json.load(f)
+embedder.encode(texts["queries"][:4], convert_to_numpy=True)  # warm-up
+t0 = time.perf_counter()
+passages = np.asarray(embedder.encode(texts["passages"], batch_size=int(batch_size), convert_to_numpy=True), dtype=np.float32)
+encode_s = time.perf_counter() - t0
+latencies, queries = [], []
+for round_ in range(3):
+    for q in texts["queries"]:
+        t0 = time.perf_counter()
+        vec = embedder.encode([q], convert_to_numpy=True)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if round_ == 0:
+            queries.append(vec[0])
+np.save(out_prefix + "_passages.npy", passages)
+np.save(out_prefix + "_queries.npy", np.asarray(queries, dtype=np.float32))
+print(json.dumps({"load_s": load_s, "sentences_per_s": len(texts["passages"]) / encode_s,
+                  "query_p50_ms": float(np.percentile(latencies, 50)), "query_p95_ms": float(np.percentile(latencies, 95)),
+                  "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "torch_loaded": "torch" in sys.modules}))
+"""
+
+def load_texts(n_passages: int):
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+    from data_analyze import STG_PDF, extract_text_from_pdf, chunk_text
+    from bench_kb_ann import CLINICAL_QUERIES
+    text = re.sub(r"\n{2,}", "\n", extract_text_from_pdf(os.path.join(ROOT, STG_PDF)))
+    return {"passages": chunk_text(text, chunk_size=300, overlap=50)[:n_passages], "queries": CLINICAL_QUERIES}
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    return v / np.clip(np.linalg.norm(v, axis=1, keepdims=True), 1e-12, None)
+
+def agreement(ref: dict, other: dict, k: int):
+    cos = np.concatenate([(_unit(ref[p]) * _unit(other[p])).sum(axis=1) for p in ("passages", "queries")])
+    top_ref = np.argsort(-(_unit(ref["queries"]) @ _unit(ref["passages"]).T), axis=1)[:, :k]
+    top_new = np.argsort(-(_unit(other["queries"]) @ _unit(other["passages"]).T), axis=1)[:, :k]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(top_ref, top_new)])
+    return float(cos.mean()), float(cos.min()), float(overlap)
+
+def main():
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    sys.path.insert(0, ROOT)
+    from data_analyze import EMBED_MODEL_NAME
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default="torch,onnx,onnx-int8", help="the first one is the reference")
+    ap.add_argument("--model", default=EMBED_MODEL_NAME)
+    ap.add_argument("--passages", type=int, default=2000)
+    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--threads", type=int, default=0, help="EMBED_THREADS for the ONNX backends (0 = one per core)")
+    ap.add_argument("--k", type=int, default=4)
+    args = ap.parse_args()
+
+    texts = load_texts(args.passages)
+    env = dict(os.environ, EMBED_THREADS=str(args.threads))
+    results, vectors = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_path = os.path.join(tmp, "texts.json")
+        with open(texts_path, "w", encoding="utf-8") as f:
+            json.dump(texts, f)
+        for backend in args.backends.split(","):
+            prefix = os.path.join(tmp, backend)
+            proc = subprocess.run([sys.executable, "-c", _WORKER, backend, args.model, texts_path, prefix,
+                                   str(args.batch_size)], cwd=ROOT, env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"❌ {backend}: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}")
+                continue
+            results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+            vectors[backend] = {p: np.load(f"{prefix}_{p}.npy") for p in ("passages", "queries")}
+
+    if not results:
+        return
+    reference = next(iter(results))
+    print(f"\n{len(texts['passages'])} passages, {len(texts['queries'])} queries, batch size {args.batch_size}, "
+          f"model {args.model}; agreement vs. {reference}")
+    print(f"{'backend':<10} {'load s':>7} {'sent/s':>8} {'query p50 ms':>13} {'p95 ms':>7} {'peak RSS MB':>12} "
+          f"{'torch':>6} {'cos mean':>9} {'cos min':>8} {f'top-{args.k}':>6}")
+    for backend, r in results.items():
+        cos_mean, cos_min, overlap = agreement(vectors[reference], vectors[backend], args.k)
+        print(f"{backend:<10} {r['load_s']:>7.2f} {r['sentences_per_s']:>8.0f} {r['query_p50_ms']:>13.2f} "
+              f"{r['query_p95_ms']:>7.2f} {r['peak_rss_mb']:>12.0f} {'yes' if r['torch_loaded'] else 'no':>6} "
+              f"{cos_mean:>9.5f} {cos_min:>8.5f} {overlap:>6.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/bench_fda_mirror.py - OpenFDA mirror coverage of the drug lexicon, and lookup latency
+#
+# Writes a synthetic bulk drug-label file shaped like the OpenFDA download:
+# every canonical name of data/drug_lexicon.tsv gets single-ingredient labels
+# whose generic name carries a salt the way real labels do ("METFORMIN
+# HYDROCHLORIDE", "FERROUS SULFATE HEPTAHYDRATE"), some names also a combination label
+# ("SITAGLIPTIN AND METFORMIN HYDROCHLORIDE"), plus unrelated filler labels.
+# The file is ingested with fda_mirror.py and every canonical name is looked
+# up the way openfda_client does before it falls back to the live API.
+#
+#   python benchmarks/bench_fda_mirror.py --filler 20000
+#
+# Checks (exit code 1 if any fails):
+#   - every lexicon generic hits the mirror (the live search is tokenized, so it would find them too)
+#   - a salted name resolves to the single-ingredient label, not a combination product
+#   - a mirror built before word-run rows existed gains them when opened for writing
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SALTS = ["hydrochloride", "heptahydrate", "calcium", "sodium", "potassium", "maleate", "besylate", "sulfate", "tartrate"]
+
+def label(i: int, generic: str, brand: str, warnings: bool = True):
+    return {"set_id": f"set-{i}", "id": f"id-{i}", "effective_time": f"2024{1 + i % 12:02d}01",
+            "openfda": {"generic_name": [generic.upper()], "brand_name": [brand.upper()],
+                        "substance_name": [generic.upper()]},
+            **({"warnings": [f"Warnings for {generic}."]} if warnings else {})}
+
+def write_bulk(path: str, generics, n_filler: int, seed: int = 0):
+    rng = random.Random(seed)
+    records = []
+    for g in generics:
+        salted = f"{g} {rng.choice(SALTS)}" if rng.random() < 0.7 else g
+        records.append(label(len(records), salted, f"{g}x"))
+        records.append(label(len(records), salted, f"{g} generic", warnings=False))
+        if rng.random() < 0.3:
+            other = rng.choice(generics)
+            records.append(label(len(records), f"{other} and {salted}", f"{other}{g} combo"))
+    for i in range(n_filler):
+        records.append(label(len(records), f"filler compound {i} {rng.choice(SALTS)}", f"fillerbrand{i}"))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": {}, "results": records}, f)
+    return len(records)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--filler", type=int, default=20000, help="unrelated labels added to the bulk file")
+    args = ap.parse_args()
+
+    import fda_mirror
+    from drug_lexicon import read_lexicon_file
+    generics = sorted(set(read_lexicon_file().values()))
+    with tempfile.TemporaryDirectory() as tmp:
+        bulk = os.path.join(tmp, "drug-label-0001-of-0001.json")
+        n_labels = write_bulk(bulk, generics, args.filler)
+        mirror = fda_mirror.FdaMirror(os.path.join(tmp, "mirror.sqlite"))
+        t0 = time.perf_counter()
+        mirror.ingest_file(bulk)
+        ingest_s = time.perf_counter() - t0
+
+        latencies, results = [], {}
+        for g in generics:
+            t0 = time.perf_counter()
+            results[g] = mirror.lookup(g)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        exact = mirror._conn().execute(
+            f"SELECT COUNT(DISTINCT name) FROM names WHERE kind < {fda_mirror.PHRASE_KIND} AND name IN "
+            f"({','.join('?' * len(generics))})", generics).fetchone()[0]
+
+        # A mirror from before the word-run rows: drop them and reopen it for writing.
+        conn = mirror._conn()
+        conn.execute("DELETE FROM names WHERE kind >= ?", (fda_mirror.PHRASE_KIND,))
+        conn.execute("DELETE FROM meta WHERE key = 'name_phrases'")
+        conn.commit()
+        mirror.close()
+        migrated = fda_mirror.FdaMirror(mirror.path)
+        migrated_hits = sum(migrated.lookup(g) is not None for g in generics)
+        info = migrated.info()
+        migrated.close()
+
+    hits = [g for g, r in results.items() if r is not None]
+    combos = [g for g, r in results.items()
+              if r is not None and " and " in r["generic"].lower() and " and " not in g]
+    print(f"{n_labels} labels ingested in {ingest_s:.1f}s ({info['names']} name rows, {info['size_mb']} MB); "
+          f"{len(generics)} lexicon generics")
+    print(f"exact name match only: {exact}/{len(generics)}; with name word runs: {len(hits)}/{len(generics)}")
+    print(f"lookup p50 {np.percentile(latencies, 50):.3f} ms, p99 {np.percentile(latencies, 99):.3f} ms")
+    checks = {
+        "every lexicon generic hits the mirror": len(hits) == len(generics),
+        "salted names resolve to single-ingredient labels": not combos,
+        "an older mirror gains word-run rows on open": migrated_hits == len(generics),
+    }
+    print()
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'}  {name}")
+    if combos:
+        print("combination labels returned for: " + ", ".join(combos[:10]))
+    sys.exit(0 if all(checks.values()) else 1)
+
+if __name__ == "__main__":
+    main()
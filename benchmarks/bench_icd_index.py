@@ -0,0 +1,121 @@
+# benchmarks/bench_icd_index.py - ICD mapping stage: free-form LLM prompt vs. local ICD-10 index
+#
+# Runs amedical_context_icd() on a few stage inputs with ICD_MODE=llm (the old
+# prompt) and ICD_MODE=hybrid (codes from icd_index.py, the LLM only confirms
+# uncertain findings from a short candidate list) against the local Groq mock
+# (benchmarks/e2e/mock_groq.py). Reports LLM calls, prompt/completion tokens,
+# local matching time and stage latency per case. Cases:
+#   doc_report    the document-analyzer report the mock produces (codes already named)
+#   lab_export    structured_labs findings of a 2000-row synthetic lab export
+#   mixed         a flagged lab panel plus imaging findings and a negated finding
+# The mock answers every request with --out-tokens tokens, so completion tokens
+# only show whether a call was made; a real model writes less for a short
+# confirmation list than for a free-form coding of the whole report.
+#
+#   python benchmarks/bench_icd_index.py --repeats 3
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks", "e2e"))
+
+from run_e2e import free_port, _wait_ready
+from mock_groq import ANSWER_LINES
+
+MIXED = """## Laboratory
+- Hemoglobin: 9.8 g/dL (13-17) LOW
+- WBC: 14.2 x10^3/uL (4-11) HIGH
+- CRP: 48 mg/L (< 5) HIGH
+- Creatinine: 1.9 mg/dL (0.6-1.2) HIGH
+- Ferritin: 8 ng/mL (30-400) LOW
+## Imaging
+- Chest X-ray: right lower lobe consolidation with small pleural effusion
+- Mild cardiomegaly
+- Ground-glass opacity in the left upper lobe
+- No pneumothorax
+## Impression
+- Findings suggest community-acquired infection with anemia
+"""
+
+def cases(tmp: str):
+    import structured_labs
+    from bench_structured_labs import write_export
+    path = os.path.join(tmp, "lab_export.csv")
+    write_export(path, 2000)
+    return {"doc_report": "\n".join(ANSWER_LINES), "lab_export": structured_labs.analyze_file(path)["findings"],
+            "mixed": MIXED}
+
+def run(text: str, mode: str, groq_url: str):
+    import requests
+    import icd_index
+    from agents import medical_context_agent
+    medical_context_agent.ICD_MODE = mode
+    start = time.perf_counter()
+    icd_index.get_icd_index().match(icd_index.finding_lines(text))
+    match_ms = (time.perf_counter() - start) * 1000 if mode != "llm" else 0.0
+    before = requests.get(groq_url + "/stats").json()
+    start = time.perf_counter()
+    answer = asyncio.run(medical_context_agent.amedical_context_icd(text))
+    seconds = time.perf_counter() - start
+    after = requests.get(groq_url + "/stats").json()
+    return {"calls": after["requests"] - before["requests"], "seconds": seconds, "match_ms": match_ms,
+            "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"],
+            "completion_tokens": after["completion_tokens"] - before["completion_tokens"], "answer": answer}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--latency", type=float, default=0.3)
+    ap.add_argument("--out-tokens", type=int, default=200)
+    ap.add_argument("--show", action="store_true", help="print the hybrid answers")
+    args = ap.parse_args()
+
+    port = free_port()
+    groq_url = f"http://127.0.0.1:{port}"
+    mock = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "e2e", "mock_groq.py"),
+                             "--port", str(port), "--latency", str(args.latency), "--out-tokens", str(args.out_tokens)])
+    try:
+        _wait_ready(mock, groq_url + "/health", "mock_groq")
+        os.environ.update(GROQ_BASE_URL=groq_url, GROQ_API_KEY="benchmark", LLM_CACHE="0")
+        import icd_index
+        index = icd_index.get_icd_index()
+        index.embeddings()  # build (or load) the embedding matrix outside the timed runs
+        with tempfile.TemporaryDirectory() as tmp:
+            inputs = cases(tmp)
+        rows = []
+        for name, text in inputs.items():
+            for mode in ("llm", "hybrid"):
+                runs = [run(text, mode, groq_url) for _ in range(args.repeats)]
+                rows.append((name, mode, runs[-1], statistics.median(r["seconds"] for r in runs),
+                             statistics.median(r["match_ms"] for r in runs)))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print(f"\nICD catalogue: {len(index)} codes, embedding index {'on' if index.embeddings() is not None else 'off'}; "
+          f"{args.latency:g}s time to first token, median of {args.repeats}")
+    print(f"{'case':<12} {'mode':>7} {'LLM calls':>10} {'prompt tok':>11} {'compl tok':>10} {'match ms':>9} {'stage s':>8}")
+    for name, mode, r, seconds, match_ms in rows:
+        print(f"{name:<12} {mode:>7} {r['calls']:>10} {r['prompt_tokens']:>11} {r['completion_tokens']:>10} "
+              f"{match_ms:>9.1f} {seconds:>8.2f}")
+    for name in dict.fromkeys(n for n, *_ in rows):
+        old, new = [(r, s) for n, _, r, s, _ in rows if n == name]
+        print(f"{name}: prompt tokens {old[0]['prompt_tokens']} -> {new[0]['prompt_tokens']} "
+              f"({1 - new[0]['prompt_tokens'] / max(old[0]['prompt_tokens'], 1):.0%} fewer), "
+              f"stage {old[1]:.2f}s -> {new[1]:.2f}s")
+    if args.show:
+        for name, mode, r, *_ in rows:
+            if mode == "hybrid":
+                print(f"\n--- {name} ---\n{r['answer']}")
+
+if __name__ == "__main__":
+    main()
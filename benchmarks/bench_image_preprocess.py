@@ -0,0 +1,106 @@
+# benchmarks/bench_image_preprocess.py - Image preprocessing before multimodal upload
+#
+# For each image set, runs the document analyzer with IMAGE_PREPROCESS off and
+# on against the local Groq mock (benchmarks/e2e/mock_groq.py), which charges
+# image tokens by resolution and receives the request body over a simulated
+# uplink. Reports images sent, upload bytes, preprocessing time, image tokens
+# and end-to-end analyzer latency. Image sets:
+#   sample         the images in "sample data/"
+#   temp           the images in temp/
+#   sample+temp    both (temp/ holds copies of sample images: duplicate uploads)
+#   photos         the sample pages re-saved as 12 MP phone-camera JPEGs
+#
+#   python benchmarks/bench_image_preprocess.py --upload-mbps 20 --image-tokens-per-mpix 1500
+
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks", "e2e"))
+
+from run_e2e import free_port, _wait_ready
+
+EXTS = (".png", ".jpg", ".jpeg", ".webp")
+
+def images_in(folder: str):
+    return sorted(p for p in glob.glob(os.path.join(ROOT, folder, "*")) if p.lower().endswith(EXTS))
+
+def phone_photos(out_dir: str):
+    """The sample pages upscaled to 4000x3000-class camera JPEGs (quality 92, EXIF-free)."""
+    from PIL import Image
+    paths = []
+    for i, src in enumerate(images_in("sample data")):
+        with Image.open(src) as img:
+            img = img.convert("RGB")
+            scale = 4000 / max(img.size)
+            path = os.path.join(out_dir, f"photo_{i}.jpg")
+            img.resize((round(img.width * scale), round(img.height * scale))).save(path, quality=92)
+            paths.append(path)
+    return paths
+
+def run(paths, preprocess: bool, groq_url: str):
+    import requests
+    import image_preprocess
+    from agents.document_analyzer import document_analyzer, _collect_content
+    image_preprocess.IMAGE_PREPROCESS = preprocess
+    start = time.perf_counter()
+    images = _collect_content(paths)[0]
+    prep = time.perf_counter() - start
+    upload = sum(len(part["image_url"]["url"]) for part in images)
+    before = requests.get(groq_url + "/stats").json()
+    start = time.perf_counter()
+    document_analyzer(paths)
+    e2e = time.perf_counter() - start
+    after = requests.get(groq_url + "/stats").json()
+    return {"images": len(images), "upload_kb": upload / 1024, "prep_s": prep,
+            "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"], "e2e_s": e2e}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sets", default="sample,temp,sample+temp,photos")
+    ap.add_argument("--upload-mbps", type=float, default=20)
+    ap.add_argument("--image-tokens-per-mpix", type=float, default=1500)
+    ap.add_argument("--latency", type=float, default=0.3)
+    args = ap.parse_args()
+
+    port = free_port()
+    groq_url = f"http://127.0.0.1:{port}"
+    mock = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "e2e", "mock_groq.py"),
+                             "--port", str(port), "--latency", str(args.latency), "--upload-mbps", str(args.upload_mbps),
+                             "--image-tokens-per-mpix", str(args.image_tokens_per_mpix)])
+    try:
+        _wait_ready(mock, groq_url + "/health", "mock_groq")
+        os.environ.update(GROQ_BASE_URL=groq_url, GROQ_API_KEY="benchmark", LLM_CACHE="0")
+        with tempfile.TemporaryDirectory() as tmp:
+            sets = {"sample": images_in("sample data"), "temp": images_in("temp"),
+                    "sample+temp": images_in("sample data") + images_in("temp")}
+            if "photos" in args.sets:
+                sets["photos"] = phone_photos(tmp)
+            rows = []
+            for name in args.sets.split(","):
+                for preprocess in (False, True):
+                    rows.append((name, preprocess, run(sets[name], preprocess, groq_url)))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print(f"\nUplink {args.upload_mbps:g} Mbit/s, {args.image_tokens_per_mpix:g} image tokens per megapixel, "
+          f"{args.latency:g}s time to first token")
+    print(f"{'set':<12} {'preprocess':>10} {'images':>7} {'upload KB':>10} {'prep s':>7} {'tokens':>8} {'e2e s':>7}")
+    for name, preprocess, r in rows:
+        print(f"{name:<12} {'on' if preprocess else 'off':>10} {r['images']:>7} {r['upload_kb']:>10.0f} "
+              f"{r['prep_s']:>7.2f} {r['prompt_tokens']:>8} {r['e2e_s']:>7.2f}")
+    for name in dict.fromkeys(n for n, _, _ in rows):
+        off, on = [r for n, _, r in rows if n == name]
+        print(f"{name}: {1 - on['upload_kb'] / off['upload_kb']:.0%} fewer bytes, "
+              f"{1 - on['prompt_tokens'] / max(off['prompt_tokens'], 1):.0%} fewer prompt tokens, "
+              f"end-to-end {off['e2e_s']:.2f}s -> {on['e2e_s']:.2f}s")
+
+if __name__ == "__main__":
+    main()
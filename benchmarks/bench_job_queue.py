@@ -0,0 +1,161 @@
+# benchmarks/bench_job_queue.py - Load test of the analysis job queue
+#
+# Runs the real task pipeline (agents/crew_tasks.py on the pipeline DAG) inside
+# job_queue.JobQueue workers against a stubbed, streaming Groq client (fixed
+# latency per LLM call); KB retrieval and OpenFDA are stubbed too. Users submit
+# their jobs in bursts, one user after the other. For each worker count it
+# reports throughput, job latency percentiles, and the mean wait per user (with
+# fair scheduling the last user to submit is not stuck behind the first one's
+# burst). A final run shows admission control rejecting an oversized burst.
+# One untimed job runs first, so the first row does not include the process's
+# cold start (ICD catalogue, tokenizer); the ICD embedding index is off
+# (ICD_EMBED=0) and Hugging Face is not contacted (HF_HUB_OFFLINE=1).
+#
+#   python benchmarks/bench_job_queue.py --users 6 --jobs-per-user 4 --latency 0.2 --workers 1,2,4,8
+
+import os
+import sys
+import time
+import types
+import queue
+import threading
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("ICD_EMBED", "0")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import asyncio
+import data_analyze
+import job_queue
+import agents.crew_tasks as crew_tasks
+import agents.treatment_planner_agent as tpa
+from pipeline_dag import run_dag, PipelineCancelled
+
+class FakeStream:
+    def __init__(self, text: str):
+        self.words = text.split(" ")
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for i, word in enumerate(self.words):
+            await asyncio.sleep(0)
+            delta = types.SimpleNamespace(content=word + " ")
+            last = i == len(self.words) - 1
+            usage = types.SimpleNamespace(prompt_tokens=800, completion_tokens=len(self.words), total_tokens=800)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)],
+                                        x_groq=types.SimpleNamespace(usage=usage) if last else None)
+
+class FakeCompletions:
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+
+    async def create(self, model, messages, temperature=0.2, stream=False, **kwargs):
+        await asyncio.sleep(self.latency_s)
+        text = "- Metformin 500 mg twice daily\n- Recheck HbA1c in 3 months\n- Encourage regular exercise"
+        if stream:
+            return FakeStream(text)
+        usage = types.SimpleNamespace(prompt_tokens=800, completion_tokens=20, total_tokens=820)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text))],
+                                     usage=usage)
+
+def stub_runner(file_paths, user_note=None, cancel=None):
+    """Same event stream as crew_orchestrator.stream_medical_crew(), using the crewai-free task stages."""
+    events: "queue.Queue" = queue.Queue()
+    cancel = cancel or threading.Event()
+
+    def run():
+        try:
+            results = run_dag(crew_tasks.build_task_stages(file_paths, user_note), on_event=events.put, cancel=cancel)
+            events.put({"type": "report", "text": "\n\n".join(str(v) for v in results.values())})
+        except PipelineCancelled:
+            pass
+        finally:
+            events.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield event
+    finally:
+        cancel.set()
+        thread.join()
+
+def make_upload(tmp: str) -> str:
+    path = os.path.join(tmp, "labs.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Hemoglobin 10.2 g/dL\nFasting glucose 142 mg/dL\nHbA1c 7.8 %\n")
+    return path
+
+def run_load(tmp: str, workers: int, users: int, per_user: int) -> dict:
+    q = job_queue.JobQueue(path=os.path.join(tmp, f"jobs_{workers}.sqlite"), workers=workers, runner=stub_runner,
+                           max_queued=10_000, max_per_user=10_000, max_running_per_user=max(1, workers // 2))
+    upload = make_upload(tmp)
+    t0 = time.perf_counter()
+    ids = {f"user{u}": [q.submit(f"user{u}", [upload], "load test") for _ in range(per_user)] for u in range(users)}
+    all_ids = [i for v in ids.values() for i in v]
+    while True:
+        infos = [q.status(i) for i in all_ids]
+        if all(info["status"] in job_queue.FINISHED for info in infos):
+            break
+        time.sleep(0.05)
+    wall = time.perf_counter() - t0
+    q.stop()
+    by_id = {info["id"]: info for info in infos}
+    latencies = sorted(by_id[i]["finished"] - by_id[i]["created"] for i in all_ids)
+    waits = {user: statistics.mean(by_id[i]["started"] - by_id[i]["created"] for i in job_ids)
+             for user, job_ids in ids.items()}
+    return {"workers": workers, "jobs": len(all_ids), "wall": wall, "throughput": len(all_ids) / wall * 60,
+            "p50": latencies[len(latencies) // 2], "p95": latencies[int(len(latencies) * 0.95) - 1],
+            "failed": sum(by_id[i]["status"] != "done" for i in all_ids), "waits": waits}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=6)
+    parser.add_argument("--jobs-per-user", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated seconds per LLM call")
+    parser.add_argument("--workers", default="1,2,4,8")
+    args = parser.parse_args()
+
+    data_analyze.get_async_client = lambda: types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=FakeCompletions(args.latency)))
+    crew_tasks.warm_up_kb = lambda: None
+    crew_tasks.retrieve_kb_hits = lambda query, top_k=4: [{"passage": "Metformin is first-line therapy.",
+                                                            "source": "stg.pdf", "page": 1}]
+    tpa.get_openfda_warnings_many = lambda names, **kw: [{"drug": n, "warnings": "none"} for n in names]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with tempfile.TemporaryDirectory() as warm:
+            run_load(warm, 1, 1, 1)  # warm-up, untimed
+        rows = [run_load(tmp, int(w), args.users, args.jobs_per_user) for w in args.workers.split(",")]
+
+        q = job_queue.JobQueue(path=os.path.join(tmp, "admission.sqlite"), workers=1, runner=stub_runner,
+                               max_queued=10, max_per_user=3)
+        accepted = rejected = 0
+        for n in range(30):
+            try:
+                q.submit(f"user{n % 5}", [make_upload(tmp)])
+                accepted += 1
+            except job_queue.AdmissionError:
+                rejected += 1
+        q.stop()
+
+    print(f"\n{'workers':>7} {'jobs':>5} {'wall s':>8} {'jobs/min':>9} {'p50 s':>7} {'p95 s':>7} {'failed':>7}  "
+          f"mean wait per user (submit order)")
+    for r in rows:
+        waits = " ".join(f"{w:5.1f}" for w in r["waits"].values())
+        print(f"{r['workers']:>7} {r['jobs']:>5} {r['wall']:>8.2f} {r['throughput']:>9.1f} {r['p50']:>7.2f} "
+              f"{r['p95']:>7.2f} {r['failed']:>7}  {waits}")
+    print(f"\nAdmission control (1 worker, max 10 queued, 3 active per user): {accepted} accepted, {rejected} rejected of 30")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_kb_ann.py - recall@k vs. latency for the KB index backends
+#
+# Embeds the bundled standard-treatment-guidelines.pdf once, uses the exact flat
+# index as ground truth, and sweeps every ANN backend over its search knob.
+#
+#   python benchmarks/bench_kb_ann.py
+#   python benchmarks/bench_kb_ann.py --scale 20 --k 4   # simulate a 20x larger multi-corpus KB
+#
+# --scale replicates the passage vectors with small Gaussian noise, which keeps
+# the neighbourhood structure realistic while making the linear scan expensive
+# enough for the trade-off to show.
+
+import os
+import re
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import build_faiss_index, search_parameters
+from data_analyze import STG_PDF, extract_text_from_pdf, chunk_text, get_embedder
+
+CLINICAL_QUERIES = [
+    "type 2 diabetes management", "hypertension stage 2 treatment", "community acquired pneumonia antibiotics",
+    "acute asthma exacerbation", "iron deficiency anaemia in pregnancy", "management of dehydration in children",
+    "malaria treatment artemisinin", "urinary tract infection first line", "acute myocardial infarction",
+    "tuberculosis regimen", "diabetic ketoacidosis fluids insulin", "peptic ulcer disease h pylori",
+    "severe acute malnutrition", "snake bite antivenom", "epilepsy status epilepticus", "hypoglycaemia",
+    "dengue fever warning signs", "chronic kidney disease", "heart failure diuretics", "anaphylaxis adrenaline",
+]
+
+# Search knob sweep per backend: (knob name, values)
+SWEEPS = {
+    "flat": (None, [None]),
+    "ivf_flat": ("nprobe", [1, 2, 4, 8, 16, 32]),
+    "hnsw": ("ef_search", [8, 16, 32, 64, 128]),
+    "ivf_pq": ("nprobe", [1, 4, 8, 16, 32]),
+}
+
+def load_vectors(pdf_path: str):
+    text = re.sub(r"\n{2,}", "\n", extract_text_from_pdf(pdf_path))
+    passages = chunk_text(text, chunk_size=300, overlap=50)
+    vecs = get_embedder().encode(passages, convert_to_numpy=True, batch_size=64)
+    return np.ascontiguousarray(vecs, dtype=np.float32)
+
+def scale_corpus(vecs: np.ndarray, scale: int, seed: int = 0) -> np.ndarray:
+    if scale <= 1:
+        return vecs
+    rng = np.random.default_rng(seed)
+    copies = [vecs] + [vecs + rng.normal(0, 0.02, vecs.shape).astype(np.float32) for _ in range(scale - 1)]
+    return np.ascontiguousarray(np.vstack(copies))
+
+def time_queries(index, queries: np.ndarray, k: int, params):
+    lat, ids = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, I = index.search(q[None, :], k, params=params)
+        lat.append((time.perf_counter() - t0) * 1000)
+        ids.append(I[0])
+    return np.array(lat), np.vstack(ids)
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+def main():
+    import faiss
+
+    ap = argparse.ArgumentParser(description="KB ANN recall/latency sweep")
+    ap.add_argument("--pdf", default=STG_PDF)
+    ap.add_argument("--k", type=int, default=4)
+    ap.add_argument("--scale", type=int, default=1)
+    ap.add_argument("--repeat", type=int, default=5, help="passes over the query set")
+    args = ap.parse_args()
+
+    corpus = scale_corpus(load_vectors(args.pdf), args.scale)
+    queries = get_embedder().encode(CLINICAL_QUERIES, convert_to_numpy=True).astype(np.float32)
+    # Also query with held-out-style perturbations of real passages.
+    rng = np.random.default_rng(1)
+    sample = corpus[rng.choice(len(corpus), size=min(200, len(corpus)), replace=False)]
+    queries = np.vstack([queries, sample + rng.normal(0, 0.05, sample.shape).astype(np.float32)])
+    queries = np.tile(queries, (args.repeat, 1))
+    print(f"corpus: {len(corpus)} passages x {corpus.shape[1]} dims, {len(queries)} queries, k={args.k}\n")
+
+    print(f"{'index':<10}{'knob':>14}{'recall@k':>10}{'p50 ms':>9}{'p95 ms':>9}{'build s':>9}{'size MB':>9}")
+    truth = None
+    for index_type, (knob, values) in SWEEPS.items():
+        t0 = time.perf_counter()
+        index, params = build_faiss_index(corpus, index_type)
+        build_s = time.perf_counter() - t0
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+        for v in values:
+            kw = {knob: v} if knob else {}
+            lat, found = time_queries(index, queries, args.k, search_parameters(params, **kw))
+            if truth is None:
+                truth = found
+            label = f"{knob}={v}" if knob else "exact"
+            print(f"{index_type:<10}{label:>14}{recall_at_k(found, truth):>10.3f}"
+                  f"{np.percentile(lat, 50):>9.3f}{np.percentile(lat, 95):>9.3f}{build_s:>9.2f}{size_mb:>9.1f}")
+
+if __name__ == "__main__":
+    main()
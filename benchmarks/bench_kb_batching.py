@@ -0,0 +1,131 @@
+# benchmarks/bench_kb_batching.py - KB MCP server under concurrent single-query searches, with and without coalescing
+#
+# Starts mcp_server_kb.py twice on a local KB store, once with
+# KB_BATCH_WINDOW_MS=0 (every search_medical_guidelines call encodes and
+# searches its own query, the previous behaviour) and once with the micro-
+# batching coalescer (kb_batcher.py), and drives each with 1/16/64 concurrent
+# MCP clients issuing distinct clinical queries (so the KB cache never answers).
+# Reports throughput, p50/p99 request latency and the number of encoder calls
+# (from the server's /metrics) per run.
+#
+#   python benchmarks/bench_kb_batching.py --clients 1,16,64 --requests 512
+#   EMBED_BACKEND=onnx python benchmarks/bench_kb_batching.py --model /path/to/local/model   # offline
+
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks", "e2e"))
+
+import requests
+from run_e2e import free_port, _wait_ready
+from bench_kb_ann import CLINICAL_QUERIES
+
+# The server with the embedding model swapped for --model (the name is a constant in data_analyze.py).
+_SERVER = r"""
+import os, sys, runpy
+sys.path.insert(0, os.getcwd())
+import data_analyze
+data_analyze.EMBED_MODEL_NAME = sys.argv[1]
+runpy.run_path("mcp_server_kb.py", run_name="__main__")
+"""
+
+def build_store(store: str, model: str):
+    import data_analyze
+    import kb_ingest
+    data_analyze.EMBED_MODEL_NAME = kb_ingest.EMBED_MODEL_NAME = model
+    kb_ingest.ingest_documents([os.path.join(ROOT, data_analyze.STG_PDF)], store, index_type="flat", rebuild=True)
+
+def encoder_calls(base_url: str) -> int:
+    text = requests.get(base_url + "/metrics", timeout=5).text
+    match = re.search(r'^carecrew_span_seconds_count\{span="embed"\} (\d+)', text, re.M)
+    return int(match.group(1)) if match else 0
+
+async def load(url: str, clients: int, total: int, tag: str):
+    from fastmcp import Client
+    latencies = []
+    counter = iter(range(total))
+
+    async def client():
+        async with Client(url) as session:
+            for i in counter:
+                query = f"{CLINICAL_QUERIES[i % len(CLINICAL_QUERIES)]} ({tag} case {i})"
+                start = time.perf_counter()
+                await session.call_tool("search_medical_guidelines", {"query": query})
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, time.perf_counter() - start
+
+def run_mode(args, store: str, window_ms: float):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, KB_STORE_DIR=store, MCP_KB_PORT=str(port), MCP_HOST="127.0.0.1",
+               KB_BATCH_WINDOW_MS=str(window_ms), KB_BATCH_MAX=str(args.max_batch), KB_WARMUP="1")
+    log = open(os.path.join(tempfile.gettempdir(), "bench_kb_batching_server.log"), "w")
+    server = subprocess.Popen([sys.executable, "-c", _SERVER, args.model], cwd=ROOT, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    rows = []
+    try:
+        _wait_ready(server, base_url + "/health", "mcp_server_kb", timeout=120)
+        url = base_url + "/mcp"
+        asyncio.run(load(url, 1, 8, "warm-up"))
+        for clients in args.clients:
+            calls = encoder_calls(base_url)
+            latencies, seconds = asyncio.run(load(url, clients, max(args.requests, clients), f"c{clients}"))
+            rows.append({"clients": clients, "requests": len(latencies), "req_per_s": len(latencies) / seconds,
+                         "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+                         "p99_ms": float(np.percentile(latencies, 99)) * 1000,
+                         "encoder_calls": encoder_calls(base_url) - calls})
+    finally:
+        server.terminate()
+        server.wait()
+        log.close()
+    return rows
+
+def main():
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    from data_analyze import EMBED_MODEL_NAME
+    from kb_batcher import KB_BATCH_WINDOW_MS, KB_BATCH_MAX
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default=EMBED_MODEL_NAME)
+    ap.add_argument("--store", default=None, help="existing KB store (default: build one from the STG PDF)")
+    ap.add_argument("--clients", default="1,16,64")
+    ap.add_argument("--requests", type=int, default=512, help="requests per client count")
+    ap.add_argument("--window-ms", type=float, default=KB_BATCH_WINDOW_MS or 2)
+    ap.add_argument("--max-batch", type=int, default=KB_BATCH_MAX)
+    args = ap.parse_args()
+    args.clients = [int(c) for c in args.clients.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = args.store
+        if store is None:
+            store = os.path.join(tmp, "kb_store")
+            build_store(store, args.model)
+        results = {"per query": run_mode(args, store, 0),
+                   f"batched {args.window_ms:g}ms": run_mode(args, store, args.window_ms)}
+
+    print(f"\nmodel {args.model}, max batch {args.max_batch}, {os.cpu_count()} CPU(s)")
+    print(f"{'mode':<14} {'clients':>8} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'encoder calls':>14}")
+    for mode, rows in results.items():
+        for r in rows:
+            print(f"{mode:<14} {r['clients']:>8} {r['requests']:>9} {r['req_per_s']:>8.1f} {r['p50_ms']:>8.1f} "
+                  f"{r['p99_ms']:>8.1f} {r['encoder_calls']:>14}")
+    old, new = results.values()
+    for a, b in zip(old, new):
+        print(f"{a['clients']} clients: {b['req_per_s'] / a['req_per_s']:.2f}x throughput, "
+              f"p99 {a['p99_ms']:.1f} -> {b['p99_ms']:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# benchmarks/bench_kb_build.py - KB build throughput vs. embedding workers, and resume after Ctrl-C
+#
+# Rebuilds a KB store from the guideline PDF(s) in a fresh interpreter per run
+# (kb_ingest.ingest_documents with rebuild=True, as build_kb_index does) and
+# reports passages/s and the speedup over one worker for --workers 1..N, plus
+# one run with --window equal to the batch size (no length sorting beyond the
+# batch, the previous behaviour). Then checks the checkpoint: a build (window =
+# batch size, so it appends often) is sent SIGINT once about half of the
+# passages are in its build directory (<store>.build; a rebuild only replaces
+# the store when it is complete), the same build is started again, and the resumed
+# store must hold exactly the passages of an uninterrupted build while
+# embedding only the ones that were missing.
+#
+#   python benchmarks/bench_kb_build.py --workers 1,2,4
+#   python benchmarks/bench_kb_build.py guidelines/ --passages 20000   # a larger corpus
+#   EMBED_BACKEND=onnx python benchmarks/bench_kb_build.py --model /path/to/local/model   # offline
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter: one (re)build of the store, stats as JSON on the last line.
+_WORKER = r"""
+import os, sys, json
+sys.path.insert(0, os.getcwd())
+import data_analyze, kb_ingest
+model, store, workers, batch_size, window, pdfs = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]), sys.argv[6:]
+data_analyze.EMBED_MODEL_NAME = kb_ingest.EMBED_MODEL_NAME = model
+stats = kb_ingest.ingest_documents(pdfs, store, index_type="flat", rebuild=True, embed_workers=workers,
+                                   batch_size=batch_size, window=window)
+print(json.dumps(stats))
+"""
+
+def corpus(tmp: str, paths, n_passages: int):
+    """The given PDFs, or the first pages of them holding about `n_passages` chunks."""
+    if not n_passages:
+        return paths
+    sys.path.insert(0, ROOT)
+    import fitz
+    from kb_ingest import _page_chunks
+    out, total = [], 0
+    for path in paths:
+        src = fitz.open(path)
+        last = 0
+        for last in range(len(src)):
+            total += len(_page_chunks(src[last].get_text()))
+            if total >= n_passages:
+                break
+        doc = fitz.open()
+        doc.insert_pdf(src, from_page=0, to_page=last)
+        out.append(os.path.join(tmp, os.path.basename(path)))
+        doc.save(out[-1])
+        if total >= n_passages:
+            break
+    return out
+
+def stored(store: str) -> int:
+    """Passages appended to the store so far (the offsets file has n + 1 entries)."""
+    try:
+        return max(os.path.getsize(os.path.join(store, "passages.idx")) // 8 - 1, 0)
+    except OSError:
+        return 0
+
+def build(args, store: str, workers: int, window: int, pdfs, interrupt_at: int = None, watch: str = None):
+    cmd = [sys.executable, "-c", _WORKER, args.model, store, str(workers), str(args.batch_size), str(window), *pdfs]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if interrupt_at is not None:
+        while proc.poll() is None and stored(watch or store) < interrupt_at:
+            time.sleep(0.02)
+        proc.send_signal(signal.SIGINT)
+        out, err = proc.communicate()
+        return proc.returncode, out + err
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(err.strip().splitlines()[-1] if err.strip() else "build failed")
+    return json.loads(out.strip().splitlines()[-1])
+
+def passages(store: str):
+    sys.path.insert(0, ROOT)
+    import kb_store
+    with open(os.path.join(store, kb_store.PASSAGES_FILE), encoding="utf-8") as f:
+        return sorted(json.loads(line)["hash"] for line in f)
+
+def main():
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    sys.path.insert(0, ROOT)
+    from data_analyze import STG_PDF, EMBED_MODEL_NAME
+    from kb_ingest import EMBED_BATCH_SIZE, KB_EMBED_WINDOW, BUILD_SUFFIX
+    ap = argparse.ArgumentParser()
+    ap.add_argument("paths", nargs="*", default=[os.path.join(ROOT, STG_PDF)])
+    ap.add_argument("--model", default=EMBED_MODEL_NAME)
+    ap.add_argument("--workers", default=",".join(str(w) for w in sorted({1, 2, os.cpu_count() or 1})))
+    ap.add_argument("--passages", type=int, default=0, help="truncate the corpus to about this many (0 = all)")
+    ap.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    ap.add_argument("--window", type=int, default=KB_EMBED_WINDOW)
+    args = ap.parse_args()
+
+    from embedder_backends import EMBED_BACKEND, prepare_model
+    if EMBED_BACKEND != "torch":
+        prepare_model(args.model, EMBED_BACKEND)  # download/export outside the timed builds
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdfs = corpus(tmp, args.paths, args.passages)
+        rows = []
+        for workers in [int(w) for w in args.workers.split(",")]:
+            rows.append((f"{workers} worker(s)", workers, build(args, os.path.join(tmp, f"w{workers}"), workers,
+                                                                args.window, pdfs)))
+        rows.append((f"window={args.batch_size}", 1, build(args, os.path.join(tmp, "unsorted"), 1,
+                                                            args.batch_size, pdfs)))
+
+        reference = os.path.join(tmp, f"w{rows[0][1]}")
+        store = os.path.join(tmp, "resume")
+        total = rows[0][2]["chunks_embedded"]
+        building = store + BUILD_SUFFIX
+        code, output = build(args, store, 1, args.batch_size, pdfs, interrupt_at=total // 2, watch=building)
+        interrupted_at = stored(building)
+        untouched = not os.path.exists(store)
+        saved = [line for line in output.splitlines() if "checkpoint saved" in line]
+        start = time.perf_counter()
+        resumed = build(args, store, 1, args.batch_size, pdfs)
+        resume_s = time.perf_counter() - start
+        same = passages(store) == passages(reference)
+
+    base = rows[0][2]["passages_per_s"]
+    print(f"\n{rows[0][2]['chunks_embedded']} passages, batch size {args.batch_size}, window {args.window}, "
+          f"model {args.model}, {os.cpu_count()} CPU(s)")
+    print(f"{'run':<16} {'workers':>8} {'seconds':>8} {'passages/s':>11} {'speedup':>8}")
+    for name, workers, stats in rows:
+        print(f"{name:<16} {stats['embed_workers']:>8} {stats['seconds']:>8.2f} {stats['passages_per_s']:>11.1f} "
+              f"{stats['passages_per_s'] / base:>7.2f}x")
+    print(f"resume: SIGINT at {interrupted_at}/{total} passages (exit {code}; "
+          f"{saved[0].strip() if saved else 'no checkpoint written'}); "
+          f"the rerun embedded {resumed['chunks_embedded']} passages in {resume_s:.1f}s; "
+          f"store {'matches' if same else 'DIFFERS FROM'} the uninterrupted build"
+          f"{'' if untouched else '; WARNING: the interrupted rebuild wrote to the store itself'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_llm_cache.py - Re-running a case with the LLM response cache
+#
+# Runs the full task pipeline (agents/crew_tasks.py) several times on the same
+# synthetic upload against a simulated Groq client (fixed latency per call,
+# output derived from the prompt so it is deterministic). KB retrieval and
+# OpenFDA are stubbed out, so the timings are the LLM stages only. The first
+# run fills the cache; later runs should be served from memory, and a fresh
+# LLMCache on the same SQLite file shows the cold-process (disk tier) case.
+#
+#   python benchmarks/bench_llm_cache.py --images 10 --pages 20 --latency 0.4 --runs 3
+
+import os
+import sys
+import time
+import types
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import asyncio
+import data_analyze
+import llm_cache
+import agents.crew_tasks as crew_tasks
+import agents.treatment_planner_agent as tpa
+
+class FakeCompletions:
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+        self.calls = 0
+
+    async def create(self, model, messages, temperature=0.2, stream=False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency_s)
+        digest = hashlib.sha256(repr(messages).encode()).hexdigest()[:12]
+        text = f"- Finding {digest}\n- Metformin 500 mg twice daily\n- Follow up in 4 weeks"
+        usage = types.SimpleNamespace(prompt_tokens=1000, completion_tokens=40, total_tokens=1040)
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+def make_upload(tmp: str, n_images: int, n_pages: int):
+    paths = []
+    for i in range(n_images):
+        path = os.path.join(tmp, f"scan_{i}.png")
+        with open(path, "wb") as f:
+            f.write(os.urandom(40_000))
+        paths.append(path)
+    path = os.path.join(tmp, "labs.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        for p in range(n_pages):
+            f.write(f"Page {p + 1}\n" + "Hemoglobin 10.2 g/dL, fasting glucose 142 mg/dL.\n" * 40)
+    paths.append(path)
+    return paths
+
+def run_case(file_paths) -> float:
+    t0 = time.perf_counter()
+    crew_tasks.sequential_executor(file_paths, "benchmark")
+    return time.perf_counter() - t0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.4, help="simulated seconds per LLM call")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    completions = FakeCompletions(args.latency)
+    fake_client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    data_analyze.get_async_client = lambda: fake_client
+    crew_tasks.warm_up_kb = lambda: None
+    crew_tasks.retrieve_kb_hits = lambda query, top_k=4: [{"passage": "Metformin is first-line therapy.", "source": "stg.pdf", "page": 1}]
+    tpa.get_openfda_warnings_many = lambda names, **kw: [{"drug": n, "warnings": "none"} for n in names]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_paths = make_upload(tmp, args.images, args.pages)
+        db_path = os.path.join(tmp, "llm.sqlite")
+        rows = []
+
+        llm_cache._cache = llm_cache.LLMCache(enabled=False, disk_path="")
+        calls = completions.calls
+        rows.append(("cache off", run_case(file_paths), completions.calls - calls))
+
+        llm_cache._cache = llm_cache.LLMCache(enabled=True, disk_path=db_path)
+        for run in range(args.runs):
+            calls = completions.calls
+            rows.append((f"cache on, run {run + 1}", run_case(file_paths), completions.calls - calls))
+        warm_stats = llm_cache._cache.stats()
+
+        llm_cache._cache = llm_cache.LLMCache(enabled=True, disk_path=db_path)  # new process, same disk tier
+        calls = completions.calls
+        rows.append(("cache on, cold memory", run_case(file_paths), completions.calls - calls))
+
+    print(f"\n{'case':<24} {'seconds':>9} {'LLM calls':>10}")
+    for name, seconds, calls in rows:
+        print(f"{name:<24} {seconds:>9.3f} {calls:>10}")
+    print(f"\nHit rate after {args.runs} warm runs: {warm_stats['hit_rate']:.0%}")
+    for stage, counts in sorted(warm_stats["per_stage"].items()):
+        print(f"  {stage:<12} hits={counts['hits']:<4} misses={counts['misses']:<4} hit_rate={counts['hit_rate']:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# benchmarks/bench_mcp_setup.py - Per-request MCP setup overhead: new adapter vs. registry
+#
+# Starts two stub MCP servers (same tool names as mcp_server_fda.py and
+# mcp_server_kb.py, plus the /health route) on free local ports and measures
+# the setup path that run_medical_crew() pays per request:
+#   per-request adapter   connect + handshake + tool discovery every time (old path)
+#   registry (warm)       cached tools/agents, health check every MCP_HEALTH_INTERVAL_S
+#   registry (check=0)    same, but with a /health probe on every request (worst case)
+# Finally one stub server is restarted to show the registry reconnecting.
+#
+#   python benchmarks/bench_mcp_setup.py --requests 20
+#
+# Uses crewai_tools.MCPServerAdapter and crewai Agents when installed, otherwise
+# mcpadapt directly (the library MCPServerAdapter wraps) and no agent objects.
+
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+from mcp_registry import MCPToolRegistry, fix_groq_url
+
+_STUB = r"""
+import sys
+sys.path.insert(0, sys.argv[1])
+from fastmcp import FastMCP
+from mcp_routes import add_health_route
+mcp = FastMCP(sys.argv[2])
+add_health_route(mcp, sys.argv[2])
+for name in sys.argv[4:]:
+    def tool(query: str) -> str:
+        return "ok"
+    mcp.tool(name=name)(tool)
+mcp.run(transport="streamable-http", host="127.0.0.1", port=int(sys.argv[3]), show_banner=False)
+"""
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_stub(name: str, port: int, tools):
+    proc = subprocess.Popen([sys.executable, "-c", _STUB, ROOT, name, str(port), *tools],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"stub MCP server {name} did not start")
+
+class _NamedTool:
+    def __init__(self, name):
+        self.name = name
+
+def adapter_factory():
+    try:
+        from crewai_tools import MCPServerAdapter
+        return (lambda params, timeout: MCPServerAdapter(params, connect_timeout=timeout)), "crewai_tools.MCPServerAdapter"
+    except ImportError:
+        from mcpadapt.core import MCPAdapt, ToolAdapter
+
+        class PassThrough(ToolAdapter):
+            def adapt(self, func, mcp_tool):
+                return _NamedTool(mcp_tool.name)
+
+        class Handle:
+            def __init__(self, params, timeout):
+                self._adapt = MCPAdapt(params, PassThrough(), timeout)
+                self.tools = self._adapt.__enter__()
+
+            def stop(self):
+                self._adapt.__exit__(None, None, None)
+
+        return Handle, "mcpadapt.MCPAdapt"
+
+def agent_builders():
+    try:
+        from agents import agent_definitions as ad
+    except Exception:
+        return None
+    return ad
+
+def old_request(factory, params, ad):
+    adapter = factory(params, 30)
+    tools = list(adapter.tools)
+    kb = fix_groq_url(next(t for t in tools if t.name == "search_medical_guidelines"))
+    fda = fix_groq_url(next(t for t in tools if t.name == "check_drug_safety"))
+    if ad is not None:
+        ad.get_document_analyzer_agent(); ad.get_medical_context_agent(); ad.get_reasoning_agent()
+        ad.get_kb_agent(tools=[kb]); ad.get_treatment_planner_agent(tools=[fda]); ad.get_advisory_agent()
+    return adapter
+
+def registry_request(registry: MCPToolRegistry, ad):
+    tools = registry.tools()
+    kb, fda = tools["search_medical_guidelines"], tools["check_drug_safety"]
+    if ad is not None:
+        registry.get_agent("document_analyzer", ad.get_document_analyzer_agent)
+        registry.get_agent("kb", lambda: ad.get_kb_agent(tools=[kb]))
+        registry.get_agent("treatment_planner", lambda: ad.get_treatment_planner_agent(tools=[fda]))
+
+def timed(fn, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+def main():
+    ap = argparse.ArgumentParser(description="MCP per-request setup overhead")
+    ap.add_argument("--requests", type=int, default=20)
+    args = ap.parse_args()
+
+    fda_port, kb_port = free_port(), free_port()
+    fda = start_stub("FDA_Safety_Checker", fda_port, ["check_drug_safety", "check_drug_safety_batch"])
+    kb = start_stub("STG_Knowledge_Base", kb_port, ["search_medical_guidelines", "search_medical_guidelines_batch"])
+    params = [{"url": f"http://127.0.0.1:{fda_port}/mcp", "transport": "streamable-http"},
+              {"url": f"http://127.0.0.1:{kb_port}/mcp", "transport": "streamable-http"}]
+    factory, factory_name = adapter_factory()
+    ad = agent_builders()
+    try:
+        old_adapters = []
+        old = timed(lambda: old_adapters.append(old_request(factory, params, ad)), args.requests)
+        for a in old_adapters:  # the old code never closed them; we do, to keep the run clean
+            a.stop()
+
+        registry = MCPToolRegistry(params, adapter_factory=factory)
+        cold = timed(lambda: registry_request(registry, ad), 1)
+        warm = timed(lambda: registry_request(registry, ad), args.requests)
+        registry.health_interval = 0
+        checked = timed(lambda: registry_request(registry, ad), args.requests)
+
+        print(f"adapter: {factory_name}; agents: {'crewai' if ad else 'not installed (skipped)'}; {args.requests} requests\n")
+        print(f"{'path':<24}{'median ms':>11}{'p95 ms':>9}")
+        for name, s in (("per-request adapter", old), ("registry (first)", cold),
+                        ("registry (warm)", warm), ("registry (check=0)", checked)):
+            p95 = sorted(s)[max(0, int(len(s) * 0.95) - 1)]
+            print(f"{name:<24}{statistics.median(s):>11.2f}{p95:>9.2f}")
+
+        # Restart one server: the boot id changes, so the next request reconnects.
+        kb.terminate(); kb.wait()
+        kb = start_stub("STG_Knowledge_Base", kb_port, ["search_medical_guidelines", "search_medical_guidelines_batch"])
+        t0 = time.perf_counter()
+        registry_request(registry, ad)
+        print(f"\nafter KB server restart: {(time.perf_counter() - t0) * 1000:.0f} ms, stats {registry.stats()}")
+        registry.close()
+    finally:
+        fda.terminate(); kb.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# benchmarks/bench_openfda.py - Serial vs. pooled/concurrent/cached OpenFDA lookups
+#
+# Runs against a local stub of https://api.fda.gov/drug/label.json that adds a
+# fixed latency per request, so no network access or API quota is needed:
+#
+#   python benchmarks/bench_openfda.py --drugs 10 --latency 0.2 --concurrency 8
+#
+# Checks (exit code 1 if any fails):
+#   - the batch API overlaps requests (peak in-flight > 1, wall time well below serial)
+#   - a repeated batch is served from the cache with zero HTTP requests
+#   - misses are negatively cached
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class StubOpenFDA(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, known: set):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency, self.known = latency, known
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is visible
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.requests += 1
+            srv.in_flight += 1
+            srv.peak_in_flight = max(srv.peak_in_flight, srv.in_flight)
+        try:
+            time.sleep(srv.latency)
+            search = parse_qs(urlparse(self.path).query).get("search", [""])[0]
+            field, _, name = search.partition(":")
+            name = name.strip('"').lower()
+            if name in srv.known and field.endswith("generic_name"):
+                body = {"results": [{"openfda": {"brand_name": [name.title() + "X"], "generic_name": [name]},
+                                     "warnings": [f"Stub warning for {name}."]}]}
+                status = 200
+            else:
+                body = {"error": {"code": "NOT_FOUND", "message": "No matches found!"}}
+                status = 404
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with srv.lock:
+                srv.in_flight -= 1
+
+def serial_baseline(base: str, drugs):
+    """The pre-change code path: a fresh requests.get per key, one drug after another."""
+    import requests
+    for d in drugs:
+        for key in ["brand_name", "generic_name"]:
+            resp = requests.get(base, params={"search": f"openfda.{key}:{d}", "limit": 1}, timeout=10)
+            if resp.status_code == 200 and resp.json().get("results"):
+                break
+
+def main():
+    ap = argparse.ArgumentParser(description="OpenFDA client benchmark against a local stub server")
+    ap.add_argument("--drugs", type=int, default=10)
+    ap.add_argument("--latency", type=float, default=0.2)
+    ap.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+
+    drugs = [f"drug{i}" for i in range(args.drugs)]
+    known = set(drugs[: max(1, args.drugs - 2)])  # the last two are misses
+    server = StubOpenFDA(args.latency, known)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}/drug/label.json"
+
+    cache_dir = tempfile.mkdtemp(prefix="openfda-cache-")
+    os.environ["OPENFDA_BASE"] = base
+    os.environ["OPENFDA_CACHE_PATH"] = os.path.join(cache_dir, "openfda.sqlite")
+    import openfda_client as fda
+
+    def timed(fn):
+        before = server.requests
+        server.peak_in_flight = 0
+        t0 = time.perf_counter()
+        out = fn()
+        return time.perf_counter() - t0, server.requests - before, server.peak_in_flight, out
+
+    rows = [
+        ("serial (old)", timed(lambda: serial_baseline(base, drugs))),
+        ("batch cold", timed(lambda: fda.get_openfda_warnings_many(drugs, max_concurrency=args.concurrency))),
+        ("batch warm", timed(lambda: fda.get_openfda_warnings_many(drugs, max_concurrency=args.concurrency))),
+    ]
+    print(f"{args.drugs} drugs, {args.latency * 1000:.0f} ms per request, concurrency {args.concurrency}\n")
+    print(f"{'run':<14}{'wall s':>9}{'requests':>10}{'peak in-flight':>16}")
+    for label, (wall, reqs, peak, _) in rows:
+        print(f"{label:<14}{wall:>9.2f}{reqs:>10}{peak:>16}")
+
+    serial, cold, warm = (r[1] for r in rows)
+    results = cold[3]
+    checks = {
+        "requests overlap (peak in-flight > 1)": cold[2] > 1,
+        "cold batch at least 2x faster than serial": cold[0] * 2 < serial[0],
+        "warm batch makes no HTTP requests": warm[1] == 0,
+        "misses are negatively cached": not any(r["found"] for r in results[-2:]) and warm[1] == 0,
+        "results keep input order": [r["drug_name"] for r in results] == drugs,
+    }
+    print()
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'}  {name}")
+    server.shutdown()
+    sys.exit(0 if all(checks.values()) else 1)
+
+if __name__ == "__main__":
+    main()
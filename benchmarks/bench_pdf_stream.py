@@ -0,0 +1,81 @@
+# benchmarks/bench_pdf_stream.py - Peak RSS and throughput of PDF extraction + chunking
+#
+# Generates synthetic guideline-like PDFs of increasing size and, for each one,
+# runs in a fresh interpreter:
+#   whole    the old path: one joined string, re.sub over it, chunk_text over it
+#   stream   iter_pdf_pages() page by page, chunking each page as it arrives
+#   stream/N the same with an N-process extraction pool
+#
+#   python benchmarks/bench_pdf_stream.py --pages 100 500 2000 --workers 4
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PARAGRAPH = (
+    "Hypertension stage 2 is defined as a systolic pressure of 140 mmHg or higher. Start amlodipine 5 mg once "
+    "daily and review in four weeks. Check serum creatinine, potassium and fasting glucose before adding an ACE "
+    "inhibitor such as lisinopril. Counsel on salt restriction, weight reduction and regular physical activity. "
+)
+
+_PROBE = r"""
+import sys, time, json, re, resource
+sys.path.insert(0, sys.argv[1])
+from pdf_extract import iter_pdf_pages
+from data_analyze import chunk_text
+mode, path, workers = sys.argv[2], sys.argv[3], int(sys.argv[4])
+t0 = time.perf_counter()
+n_chunks = 0
+if mode == "whole":
+    text = "\n".join(t for _, t in iter_pdf_pages(path, workers=1))
+    text = re.sub(r"\n{2,}", "\n", text)
+    n_chunks = len(chunk_text(text, chunk_size=300, overlap=50))
+else:
+    for _, page in iter_pdf_pages(path, workers=workers):
+        n_chunks += len(chunk_text(" ".join(page.split()), chunk_size=300, overlap=50))
+print(json.dumps({"seconds": time.perf_counter() - t0, "chunks": n_chunks,
+                  "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+def make_pdf(path: str, pages: int):
+    import fitz
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), f"Section {i + 1}\n" + PARAGRAPH * 8, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+def run(mode: str, path: str, workers: int):
+    env = {**os.environ, "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "benchmark")}
+    out = subprocess.run([sys.executable, "-c", _PROBE, ROOT, mode, path, str(workers)],
+                         capture_output=True, text=True, env=env)
+    lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+    if not lines:
+        raise RuntimeError(out.stderr)
+    return json.loads(lines[-1])
+
+def main():
+    ap = argparse.ArgumentParser(description="PDF extraction memory/throughput benchmark")
+    ap.add_argument("--pages", type=int, nargs="+", default=[100, 500, 2000])
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = ap.parse_args()
+
+    print(f"{'pages':>7}{'mode':>12}{'seconds':>10}{'pages/s':>10}{'chunks':>9}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            path = os.path.join(tmp, f"synthetic_{pages}.pdf")
+            make_pdf(path, pages)
+            for mode, workers in (("whole", 1), ("stream", 1), ("stream", args.workers)):
+                r = run(mode, path, workers)
+                label = mode if workers == 1 else f"{mode}/{workers}"
+                print(f"{pages:>7}{label:>12}{r['seconds']:>10.2f}{pages / r['seconds']:>10.0f}"
+                      f"{r['chunks']:>9}{r['peak_rss_mb']:>10.0f}")
+
+if __name__ == "__main__":
+    main()
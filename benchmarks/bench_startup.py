@@ -0,0 +1,102 @@
+# benchmarks/bench_startup.py - Import time and RSS for each CareCrew entry point
+#
+# Every entry point is imported in a fresh interpreter so results are not
+# skewed by modules another entry point already loaded.
+#
+#   python benchmarks/bench_startup.py                 # current working tree
+#   python benchmarks/bench_startup.py --rev baseline  # also measure a git revision, side by side
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = ["app", "mcp_server_fda", "mcp_server_kb", "crew_orchestrator"]
+
+# Runs inside the child interpreter: import one module and report wall time and memory.
+_PROBE = r"""
+import sys, time, json, resource, importlib, os
+sys.path.insert(0, os.getcwd())
+t0 = time.perf_counter()
+err = None
+try:
+    importlib.import_module(sys.argv[1])
+except BaseException as e:
+    err = f"{type(e).__name__}: {e}"
+elapsed = time.perf_counter() - t0
+with open("/proc/self/statm") as f:
+    rss_pages = int(f.read().split()[1])
+print(json.dumps({
+    "import_s": elapsed,
+    "rss_mb": rss_pages * os.sysconf("SC_PAGE_SIZE") / 2**20,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "error": err,
+}))
+"""
+
+def measure(root: str, module: str, repeat: int):
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _PROBE, module], cwd=root,
+                             capture_output=True, text=True)
+        lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+        if not lines:
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr else "no output"}
+        runs.append(json.loads(lines[-1]))
+    best = min(runs, key=lambda r: r["import_s"])
+    best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in runs)
+    return best
+
+def export_rev(rev: str) -> str:
+    """Extracts `rev` into a temp dir (with the working tree's data files) for an A/B run."""
+    dest = tempfile.mkdtemp(prefix="carecrew-startup-")
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", dest], input=archive.stdout, check=True)
+    for name in ("kb_index.pkl", "kb_store"):
+        src, dst = os.path.join(ROOT, name), os.path.join(dest, name)
+        if os.path.isdir(src) and not os.path.exists(dst):
+            shutil.copytree(src, dst)
+        elif os.path.isfile(src) and not os.path.exists(dst):
+            shutil.copy(src, dst)
+    return dest
+
+def main():
+    ap = argparse.ArgumentParser(description="Import time and RSS per entry point")
+    ap.add_argument("--rev", help="git revision to compare against (e.g. baseline)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", help="write raw results to this file")
+    args = ap.parse_args()
+
+    trees = {"working tree": ROOT}
+    if args.rev:
+        trees = {args.rev: export_rev(args.rev), **trees}
+
+    results = {label: {m: measure(path, m, args.repeat) for m in ENTRY_POINTS}
+               for label, path in trees.items()}
+
+    print(f"{'entry point':<20}" + "".join(f"{label:>36}" for label in results))
+    print(f"{'':<20}" + "".join(f"{'import s':>12}{'rss MB':>12}{'peak MB':>12}" for _ in results))
+    for m in ENTRY_POINTS:
+        row = f"{m:<20}"
+        for label in results:
+            r = results[label][m]
+            if r.get("error"):
+                row += f"{'ERROR':>36}"
+            else:
+                row += f"{r['import_s']:>12.2f}{r['rss_mb']:>12.0f}{r['peak_rss_mb']:>12.0f}"
+        print(row)
+    for label, per_module in results.items():
+        for m, r in per_module.items():
+            if r.get("error"):
+                print(f"  [{label}] {m}: {r['error']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# benchmarks/bench_token_budget.py - Stage-input compaction under token budgets
+#
+# Builds the advisory-stage input of a large case the way crew_tasks does it
+# (document findings + ICD codes + reasoning + treatment plan, where later stages
+# restate earlier findings) and compacts it to several budgets. Reports tokens
+# before/after, compaction time, and how many of the structured findings (lab
+# bullets with values) survived.
+#
+#   python benchmarks/bench_token_budget.py --findings 400 --budgets 8000,4000,2000
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import token_budget
+
+ANALYTES = ["Hemoglobin", "Glucose", "HbA1c", "Creatinine", "Sodium", "Potassium", "ALT", "AST", "TSH", "LDL"]
+PROSE = ["The patient reports intermittent fatigue and reduced exercise tolerance over several weeks.",
+         "These results should be interpreted in the context of the clinical presentation.",
+         "Lifestyle modification including diet and regular physical activity is recommended.",
+         "Renal function appears preserved, which permits standard dosing of most agents.",
+         "Further evaluation may be warranted if symptoms persist despite initial management.",
+         "The combination of findings raises the possibility of an underlying metabolic disorder."]
+
+def make_case(n_findings: int, seed: int = 0) -> (str, list):
+    rng = random.Random(seed)
+    findings = [f"- {rng.choice(ANALYTES)} {rng.uniform(1, 200):.1f} mg/dL (visit {i})" for i in range(n_findings)]
+    doc = "Findings:\n" + "\n".join(findings)
+    icd = "ICD-10:\n- E11.9 Type 2 diabetes mellitus without complications\n- D64.9 Anemia, unspecified"
+    reasoning = "Reasoning:\n" + "\n".join(rng.choice(PROSE) + " " + rng.choice(PROSE) for _ in range(n_findings // 2))
+    # Later stages restate part of the findings.
+    plan = "Plan:\n" + "\n".join(rng.sample(findings, n_findings // 3)) + "\n" + " ".join(rng.sample(PROSE, 4))
+    return "\n".join([doc, icd, reasoning, plan]), findings
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--findings", type=int, default=400)
+    parser.add_argument("--budgets", default="8000,4000,2000")
+    args = parser.parse_args()
+
+    text, findings = make_case(args.findings)
+    tokens = token_budget.count_tokens(text)
+    print(f"Tokenizer: {type(token_budget.get_tokenizer()).__name__}; input {tokens} tokens, {len(findings)} findings")
+    print(f"\n{'budget':>8} {'tokens out':>11} {'ms':>8} {'findings kept':>14}")
+    for budget in (int(b) for b in args.budgets.split(",")):
+        t0 = time.perf_counter()
+        out = token_budget.compact(text, budget)
+        ms = (time.perf_counter() - t0) * 1000
+        kept = sum(f in out for f in findings)
+        print(f"{budget:>8} {token_budget.count_tokens(out):>11} {ms:>8.1f} {kept:>9}/{len(findings)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/e2e/corpora.py - Input sets for the end-to-end benchmark
+#
+#   sample      the files in "sample data/" the document analyzer accepts
+#   docs-N      N synthetic lab reports (alternating .txt and small .pdf)
+#   large-pdf   one synthetic PDF of --pdf-pages pages
+#   images-N    N synthetic scans (.png)
+
+import os
+import random
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SAMPLE_DIR = os.path.join(ROOT, "sample data")
+SUPPORTED = (".pdf", ".txt", ".csv", ".tsv", ".png", ".jpg", ".jpeg", ".webp")
+
+ANALYTES = [("Hemoglobin", "g/dL", 9, 17), ("Fasting glucose", "mg/dL", 70, 220), ("HbA1c", "%", 4.5, 11),
+            ("Creatinine", "mg/dL", 0.5, 2.2), ("Sodium", "mmol/L", 128, 148), ("Potassium", "mmol/L", 3.0, 5.9),
+            ("ALT", "U/L", 10, 120), ("TSH", "mIU/L", 0.2, 8), ("LDL cholesterol", "mg/dL", 60, 210)]
+
+def lab_report(rng: random.Random, n_lines: int = 30) -> str:
+    lines = ["CITY HOSPITAL LABORATORY - CONFIDENTIAL PATIENT REPORT", f"Patient ID: {rng.randint(10000, 99999)}"]
+    for _ in range(n_lines):
+        name, unit, lo, hi = rng.choice(ANALYTES)
+        lines.append(f"{name}: {rng.uniform(lo, hi):.1f} {unit}")
+    lines.append("Clinical note: patient reports fatigue and increased thirst; currently on metformin.")
+    return "\n".join(lines)
+
+def write_pdf(path: str, pages: List[str]):
+    import fitz
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+def write_png(path: str, rng: random.Random, size: int = 768):
+    import numpy as np
+    from PIL import Image
+    noise = np.random.default_rng(rng.randint(0, 2**31)).integers(0, 255, (size, size), dtype=np.uint8)
+    Image.fromarray(noise, mode="L").save(path)
+
+def build(name: str, out_dir: str, pdf_pages: int = 300, seed: int = 0) -> List[str]:
+    """Creates the input files of scenario `name` in `out_dir`; returns their paths."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    if name == "sample":
+        return sorted(os.path.join(SAMPLE_DIR, f) for f in os.listdir(SAMPLE_DIR)
+                      if os.path.splitext(f)[1].lower() in SUPPORTED)
+    kind, _, count = name.partition("-")
+    paths = []
+    if kind == "docs":
+        for i in range(int(count)):
+            if i % 2:
+                path = os.path.join(out_dir, f"report_{i}.pdf")
+                write_pdf(path, [lab_report(rng)])
+            else:
+                path = os.path.join(out_dir, f"report_{i}.txt")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(lab_report(rng))
+            paths.append(path)
+    elif name == "large-pdf":
+        path = os.path.join(out_dir, "large.pdf")
+        write_pdf(path, [lab_report(rng, 45) for _ in range(pdf_pages)])
+        paths.append(path)
+    elif kind == "images":
+        for i in range(int(count)):
+            path = os.path.join(out_dir, f"scan_{i}.png")
+            write_png(path, rng)
+            paths.append(path)
+    else:
+        raise ValueError(f"Unknown scenario {name!r}")
+    return paths
+
+def describe(paths: List[str]) -> Dict[str, int]:
+    return {"files": len(paths), "bytes": sum(os.path.getsize(p) for p in paths)}
@@ -0,0 +1,159 @@
+# benchmarks/e2e/mock_groq.py - Local stand-in for the Groq (OpenAI-compatible) chat API
+#
+# POST /openai/v1/chat/completions, streaming (SSE, usage in x_groq on the last
+# chunk) and non-streaming, with:
+#   --latency      seconds before the first token (prefill)
+#   --tokens-per-s generation speed; the answer is --out-tokens long
+#   --fail-rate    fraction of requests answered with --fail-status (429 carries Retry-After)
+#   --upload-mbps  simulated client uplink: the request body is "received" at this rate
+# Prompt tokens are estimated (chars / 4; per image --image-tokens, or
+# --image-tokens-per-mpix times the decoded resolution). GET /stats
+# returns request, failure and token totals; GET /health answers when ready.
+# The Groq SDK is pointed here with GROQ_BASE_URL=http://127.0.0.1:<port>.
+#
+#   python benchmarks/e2e/mock_groq.py --port 8600 --latency 0.3 --tokens-per-s 400
+
+import io
+import json
+import time
+import base64
+import random
+import asyncio
+import argparse
+import threading
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# A plausible clinical answer; drug names and ICD codes keep the downstream stages busy.
+ANSWER_LINES = [
+    "- Fasting glucose 142 mg/dL and HbA1c 7.8 % are consistent with type 2 diabetes (E11.9).",
+    "- Hemoglobin 10.2 g/dL suggests mild anemia (D64.9); check ferritin and B12.",
+    "- Blood pressure 150/95 mmHg indicates stage 2 hypertension (I10).",
+    "- Start metformin 500 mg twice daily with meals; titrate as tolerated.",
+    "- Consider lisinopril 10 mg daily for blood pressure control.",
+    "- Atorvastatin 20 mg nightly for cardiovascular risk reduction.",
+    "- Recheck renal function and potassium in 2 weeks.",
+    "- Encourage regular exercise, weight loss and a low-sodium diet.",
+]
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "streamed": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                      "images": 0, "bytes_in": 0}
+
+    def count(self, **deltas):
+        with self.lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+def _image_tokens(url: str, args) -> int:
+    if args.image_tokens_per_mpix <= 0 or not url.startswith("data:"):
+        return args.image_tokens
+    from PIL import Image
+    with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as img:  # header only
+        return int(img.width * img.height / 1e6 * args.image_tokens_per_mpix)
+
+def _prompt_tokens(messages, args):
+    chars, images, image_tokens = 0, 0, 0
+    for m in messages:
+        content = m.get("content")
+        for part in (content if isinstance(content, list) else [content]):
+            if isinstance(part, str):
+                chars += len(part)
+            elif isinstance(part, dict) and part.get("type") == "image_url":
+                images += 1
+                image_tokens += _image_tokens(part.get("image_url", {}).get("url", ""), args)
+            elif isinstance(part, dict):
+                chars += len(part.get("text", ""))
+    return chars // 4 + image_tokens, images
+
+def _answer(out_tokens: int) -> str:
+    lines, tokens = [], 0
+    while tokens < out_tokens:
+        line = ANSWER_LINES[len(lines) % len(ANSWER_LINES)]
+        lines.append(line)
+        tokens += len(line) // 4
+    return "\n".join(lines)
+
+def build_app(state: MockState) -> Starlette:
+    args = state.args
+
+    async def completions(request: Request):
+        body = await request.body()
+        payload = json.loads(body)
+        prompt_tokens, images = _prompt_tokens(payload.get("messages", []), args)
+        state.count(requests=1, bytes_in=len(body))
+        if args.upload_mbps > 0:
+            await asyncio.sleep(len(body) * 8 / (args.upload_mbps * 1e6))
+        if state.rng.random() < args.fail_rate:
+            state.count(failures=1)
+            headers = {"retry-after": "0.1"} if args.fail_status == 429 else {}
+            return JSONResponse({"error": {"message": "injected failure", "type": "mock"}},
+                                status_code=args.fail_status, headers=headers)
+        text = _answer(args.out_tokens)
+        completion_tokens = len(text) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        state.count(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, images=images)
+        base = {"id": f"chatcmpl-{state.stats['requests']}", "created": int(time.time()), "model": payload.get("model")}
+        await asyncio.sleep(args.latency + prompt_tokens / args.prefill_tokens_per_s)
+
+        if not payload.get("stream"):
+            await asyncio.sleep(completion_tokens / args.tokens_per_s)
+            return JSONResponse({**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]})
+
+        state.count(streamed=1)
+        words = text.split(" ")
+
+        async def events():
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else " " + word}
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(max(1, len(word) // 4) / args.tokens_per_s)
+            last = {**base, "object": "chat.completion.chunk", "x_groq": {"id": base["id"], "usage": usage},
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(last)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def stats(request: Request):
+        with state.lock:
+            return JSONResponse(dict(state.stats))
+
+    async def health(request: Request):
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(routes=[
+        Route("/openai/v1/chat/completions", completions, methods=["POST"]),
+        Route("/stats", stats), Route("/health", health),
+    ])
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Mock Groq chat completions server")
+    ap.add_argument("--port", type=int, default=8600)
+    ap.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    ap.add_argument("--prefill-tokens-per-s", type=float, default=20000, help="extra delay per prompt token")
+    ap.add_argument("--tokens-per-s", type=float, default=400)
+    ap.add_argument("--out-tokens", type=int, default=200)
+    ap.add_argument("--image-tokens", type=int, default=1000)
+    ap.add_argument("--image-tokens-per-mpix", type=float, default=0, help="0 = --image-tokens per image")
+    ap.add_argument("--upload-mbps", type=float, default=0, help="0 = no upload delay")
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--fail-status", type=int, default=429)
+    ap.add_argument("--seed", type=int, default=0)
+    return ap.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    uvicorn.run(build_app(MockState(args)), host="127.0.0.1", port=args.port, log_level="warning")
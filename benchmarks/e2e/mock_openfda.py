@@ -0,0 +1,62 @@
+# benchmarks/e2e/mock_openfda.py - Local stand-in for api.fda.gov/drug/label.json
+#
+# Answers openfda.brand_name / openfda.generic_name searches the way the live API
+# does: a label for known drugs, 404 NOT_FOUND otherwise, after --latency seconds.
+# GET /stats returns request counts. openfda_client.py is pointed here with
+# OPENFDA_BASE=http://127.0.0.1:<port>/drug/label.json.
+#
+#   python benchmarks/e2e/mock_openfda.py --port 8601 --latency 0.15
+
+import re
+import asyncio
+import argparse
+import threading
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+KNOWN = {
+    "metformin": "Glucophage", "lisinopril": "Zestril", "atorvastatin": "Lipitor", "amlodipine": "Norvasc",
+    "insulin glargine": "Lantus", "aspirin": "Bayer", "omeprazole": "Prilosec", "levothyroxine": "Synthroid",
+    "ferrous sulfate": "Feosol", "losartan": "Cozaar", "hydrochlorothiazide": "Microzide", "sertraline": "Zoloft",
+}
+_BRANDS = {brand.lower(): generic for generic, brand in KNOWN.items()}
+_SEARCH = re.compile(r'openfda\.(brand_name|generic_name):"?([^"]+)"?')
+
+def build_app(latency: float) -> Starlette:
+    stats = {"requests": 0, "found": 0, "not_found": 0}
+    lock = threading.Lock()
+
+    async def label(request: Request):
+        await asyncio.sleep(latency)
+        match = _SEARCH.search(request.query_params.get("search", ""))
+        field, name = (match.group(1), match.group(2).lower().strip()) if match else ("", "")
+        generic = (_BRANDS.get(name) if field == "brand_name" else name if name in KNOWN else None)
+        with lock:
+            stats["requests"] += 1
+            stats["found" if generic else "not_found"] += 1
+        if not generic:
+            return JSONResponse({"error": {"code": "NOT_FOUND", "message": "No matches found!"}}, status_code=404)
+        return JSONResponse({"meta": {"results": {"skip": 0, "limit": 1, "total": 1}}, "results": [{
+            "openfda": {"brand_name": [KNOWN[generic]], "generic_name": [generic.upper()]},
+            "warnings": [f"WARNINGS: {generic.title()} may cause adverse reactions. " * 20],
+        }]})
+
+    async def get_stats(request: Request):
+        with lock:
+            return JSONResponse(dict(stats))
+
+    async def health(request: Request):
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(routes=[Route("/drug/label.json", label), Route("/stats", get_stats), Route("/health", health)])
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Mock OpenFDA drug label server")
+    ap.add_argument("--port", type=int, default=8601)
+    ap.add_argument("--latency", type=float, default=0.15)
+    args = ap.parse_args()
+    uvicorn.run(build_app(args.latency), host="127.0.0.1", port=args.port, log_level="warning")
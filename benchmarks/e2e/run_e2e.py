@@ -0,0 +1,384 @@
+# benchmarks/e2e/run_e2e.py - Offline end-to-end benchmark of the diagnostic pipeline
+#
+# Starts, on free local ports:
+#   - mock_groq.py      OpenAI/Groq-compatible chat API (latency, tokens/s, failure injection)
+#   - mock_openfda.py   OpenFDA drug label API
+#   - mcp_server_fda.py and mcp_server_kb.py, the real MCP servers
+# then drives the real pipeline DAG over each scenario (see corpora.py) with N
+# concurrent cases. The DAG gets one extra stage, mcp_tools, which calls both
+# MCP servers' batch tools the way an agent would. Reported per scenario and
+# concurrency level: per-stage latency (p50/p95), time to first streamed token,
+# end-to-end latency and throughput, peak RSS, LLM requests, tokens sent and
+# received, and failed stages. Results are written as JSON (benchmarks/results/)
+# and can be compared across commits:
+#
+#   python benchmarks/e2e/run_e2e.py run --scenarios sample,docs-1,docs-10,docs-100,large-pdf,images-20 --concurrency 1,4
+#   python benchmarks/e2e/run_e2e.py compare benchmarks/results/e2e_<old>.json benchmarks/results/e2e_<new>.json
+#
+# The pipeline is crew_orchestrator's when crewai is installed, else the
+# crewai-free agents/crew_tasks.py stages. The KB needs the MiniLM model in the
+# local Hugging Face cache; --kb auto stubs KB retrieval when it is missing.
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+import requests
+import corpora
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# -------------------------
+# Servers
+# -------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_ready(proc, url: str, name: str, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {proc.returncode}")
+        try:
+            requests.get(url, timeout=0.5)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{name} did not start within {timeout:.0f}s")
+
+class Servers:
+    """The mock APIs and both MCP servers as subprocesses; stopped on exit."""
+
+    def __init__(self, args):
+        self.args = args
+        self.procs = []
+        self.ports = {name: free_port() for name in ("groq", "openfda", "mcp_fda", "mcp_kb")}
+        self.urls = {
+            "groq": f"http://127.0.0.1:{self.ports['groq']}",
+            "openfda": f"http://127.0.0.1:{self.ports['openfda']}/drug/label.json",
+            "mcp_fda": f"http://127.0.0.1:{self.ports['mcp_fda']}/mcp",
+            "mcp_kb": f"http://127.0.0.1:{self.ports['mcp_kb']}/mcp",
+        }
+
+    def _start(self, name: str, cmd: List[str], health_url: str, env: Dict[str, str] = None):
+        log = open(os.path.join(tempfile.gettempdir(), f"e2e_{name}.log"), "w")
+        proc = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **(env or {})}, stdout=log, stderr=subprocess.STDOUT)
+        self.procs.append(proc)
+        _wait_ready(proc, health_url, name)
+
+    def __enter__(self):
+        a = self.args
+        py = sys.executable
+        self._start("mock_groq", [py, os.path.join(HERE, "mock_groq.py"), "--port", str(self.ports["groq"]),
+                                  "--latency", str(a.latency), "--tokens-per-s", str(a.tokens_per_s),
+                                  "--out-tokens", str(a.out_tokens), "--fail-rate", str(a.fail_rate),
+                                  "--fail-status", str(a.fail_status)],
+                    self.urls["groq"] + "/health")
+        self._start("mock_openfda", [py, os.path.join(HERE, "mock_openfda.py"), "--port", str(self.ports["openfda"]),
+                                     "--latency", str(a.fda_latency)],
+                    self.urls["openfda"].replace("/drug/label.json", "/health"))
+        server_env = {**pipeline_env(self, a), "MCP_HOST": "127.0.0.1"}
+        self._start("mcp_fda", [py, "mcp_server_fda.py"], self.urls["mcp_fda"].replace("/mcp", "/health"),
+                    {**server_env, "MCP_FDA_PORT": str(self.ports["mcp_fda"])})
+        self._start("mcp_kb", [py, "mcp_server_kb.py"], self.urls["mcp_kb"].replace("/mcp", "/health"),
+                    {**server_env, "MCP_KB_PORT": str(self.ports["mcp_kb"]), "KB_WARMUP": "0"})
+        return self
+
+    def __exit__(self, *exc):
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    def mock_stats(self) -> Dict[str, int]:
+        return requests.get(self.urls["groq"] + "/stats", timeout=5).json()
+
+def pipeline_env(servers: Servers, args) -> Dict[str, str]:
+    """Environment that points the pipeline (and the MCP servers) at the local stand-ins."""
+    return {
+        "GROQ_API_KEY": "benchmark",
+        "GROQ_BASE_URL": servers.urls["groq"],
+        "OPENFDA_BASE": servers.urls["openfda"],
+        "OPENFDA_CACHE_PATH": "" if not args.fda_cache else os.path.join(tempfile.gettempdir(), "e2e_openfda.sqlite"),
+        "OPENFDA_MIRROR_PATH": "",
+        "MCP_FDA_URL": servers.urls["mcp_fda"],
+        "MCP_KB_URL": servers.urls["mcp_kb"],
+        "LLM_CACHE": "1" if args.llm_cache else "0",
+        "HF_HUB_OFFLINE": os.environ.get("HF_HUB_OFFLINE", "1"),
+    }
+
+# -------------------------
+# Measurement
+# -------------------------
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource  # not Linux: fall back to the process-lifetime peak
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+class RssSampler:
+    """Peak resident set size of this process while active (sampled every 50 ms)."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval, self.peak = interval, 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50": round(pick(0.5), 4), "p95": round(pick(0.95), 4), "max": round(ordered[-1], 4),
+            "mean": round(statistics.mean(ordered), 4)}
+
+# -------------------------
+# Pipeline
+# -------------------------
+class Pipeline:
+    def __init__(self, servers: Servers, kb_mode: str):
+        from pipeline_dag import Stage
+        self.Stage = Stage
+        self.servers = servers
+        try:
+            import crew_orchestrator
+            error = crew_orchestrator._prepare_crew()
+            if error:
+                raise RuntimeError(error)
+            self.mode, self.build = "crew", crew_orchestrator.build_crew_stages
+            modules = [crew_orchestrator]
+        except ImportError:
+            import agents.crew_tasks as crew_tasks
+            self.mode, self.build = "tasks", crew_tasks.build_task_stages
+            modules = [crew_tasks]
+        self.kb = self._setup_kb(kb_mode, modules)
+
+    def _setup_kb(self, kb_mode: str, modules) -> str:
+        if kb_mode == "auto":
+            try:
+                import data_analyze
+                data_analyze.get_embedder()
+                data_analyze.ensure_kb_index()
+                kb_mode = "real"
+            except Exception as e:
+                print(f"WARNING: KB unavailable offline ({type(e).__name__}); KB retrieval is stubbed.")
+                kb_mode = "stub"
+        if kb_mode == "stub":
+            hits = [{"passage": "Metformin is the first-line agent for type 2 diabetes; review renal function.",
+                     "score": 0.8, "source": "STG", "page": 1}]
+            for module in modules:
+                module.warm_up_kb = lambda: None
+                if hasattr(module, "retrieve_kb_hits"):
+                    module.retrieve_kb_hits = lambda query, top_k=4: hits
+        return kb_mode
+
+    async def _mcp_tools(self, treatment: str) -> str:
+        """What an agent does with the MCP servers: one FDA batch check and one KB batch search."""
+        from fastmcp import Client
+        from drug_lexicon import extract_drugs
+        drugs = extract_drugs(treatment)[:8] or ["metformin"]
+        queries = [line.strip("-• ") for line in treatment.splitlines() if line.strip()][:3] or ["diabetes"]
+        async with Client(self.servers.urls["mcp_fda"]) as fda:
+            await fda.call_tool("check_drug_safety_batch", {"drug_names": drugs})
+        if self.kb == "real":
+            async with Client(self.servers.urls["mcp_kb"]) as kb:
+                await kb.call_tool("search_medical_guidelines_batch", {"queries": queries})
+        return f"checked {len(drugs)} drugs"
+
+    def run_case(self, file_paths: List[str], stream: bool) -> Dict:
+        from pipeline_dag import run_dag
+        stages = self.build(file_paths, "benchmark case") + [
+            self.Stage("mcp_tools", self._mcp_tools, ["treatment"], label="MCP tool calls", timeout=120)]
+        timings: Dict[str, Dict] = {}
+        started: Dict[str, float] = {}
+        ttft: Dict[str, float] = {}
+
+        def on_event(event):
+            if event["type"] == "stage_start":
+                started[event["stage"]] = time.perf_counter()
+            elif event["type"] == "delta" and event["stage"] not in ttft:
+                ttft[event["stage"]] = time.perf_counter() - started[event["stage"]]
+
+        t0 = time.perf_counter()
+        run_dag(stages, on_event=on_event if stream else None, timings=timings)
+        return {"seconds": time.perf_counter() - t0, "timings": timings, "ttft": ttft,
+                "failed": [name for name, t in timings.items() if not t.get("ok")]}
+
+def run_scenario(pipeline: Pipeline, servers: Servers, name: str, paths: List[str], concurrency: int,
+                 cases: int, stream: bool) -> Dict:
+    before = servers.mock_stats()
+    t0 = time.perf_counter()
+    with RssSampler() as rss, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: pipeline.run_case(paths, stream), range(cases)))
+    wall = time.perf_counter() - t0
+    after = servers.mock_stats()
+    stage_names = sorted({s for r in results for s in r["timings"]})
+    tokens_in = sum(t.get("tokens_in", 0) for r in results for t in r["timings"].values())
+    return {
+        "scenario": name, **corpora.describe(paths), "concurrency": concurrency, "cases": cases,
+        "wall_s": round(wall, 3), "throughput_cases_per_min": round(cases / wall * 60, 2),
+        "e2e_latency_s": summarize([r["seconds"] for r in results]),
+        "stages": {s: summarize([r["timings"][s]["seconds"] for r in results if s in r["timings"]]) for s in stage_names},
+        "ttft_s": {s: summarize([r["ttft"][s] for r in results if s in r["ttft"]])
+                   for s in stage_names if any(s in r["ttft"] for r in results)},
+        "peak_rss_mb": round(rss.peak, 1),
+        "llm": {key: after[key] - before[key] for key in after},
+        "tokens_in_per_case": round(tokens_in / cases),
+        "failed_stages": sum(len(r["failed"]) for r in results),
+    }
+
+def print_result(r: Dict):
+    lat = r["e2e_latency_s"]
+    print(f"\n=== {r['scenario']} ({r['files']} files, {r['bytes'] / 1e6:.1f} MB) x{r['concurrency']} concurrent, "
+          f"{r['cases']} cases ===")
+    print(f"wall {r['wall_s']:.2f}s | {r['throughput_cases_per_min']:.1f} cases/min | e2e p50 {lat['p50']:.2f}s "
+          f"p95 {lat['p95']:.2f}s | peak RSS {r['peak_rss_mb']:.0f} MB | LLM {r['llm']['requests']} requests, "
+          f"{r['llm']['prompt_tokens']} tokens sent, {r['llm']['failures']} injected failures | "
+          f"failed stages {r['failed_stages']}")
+    for stage, s in sorted(r["stages"].items(), key=lambda kv: -kv[1].get("p50", 0)):
+        ttft = r["ttft_s"].get(stage)
+        extra = f"  first token p50 {ttft['p50']:.2f}s" if ttft else ""
+        print(f"  {stage:<14} p50 {s['p50']:>7.2f}s  p95 {s['p95']:>7.2f}s{extra}")
+
+def git_commit() -> Dict[str, object]:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True).strip())
+    except Exception:
+        sha, dirty = "unknown", False
+    return {"commit": sha, "dirty": dirty}
+
+def cmd_run(args):
+    with Servers(args) as servers:
+        os.environ.update(pipeline_env(servers, args))
+        pipeline = Pipeline(servers, args.kb)
+        print(f"✅ Mock servers and MCP servers up; pipeline: {pipeline.mode}, KB: {pipeline.kb}")
+        results = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in args.scenarios.split(","):
+                paths = corpora.build(name, os.path.join(tmp, name), pdf_pages=args.pdf_pages)
+                for concurrency in (int(c) for c in args.concurrency.split(",")):
+                    result = run_scenario(pipeline, servers, name, paths, concurrency,
+                                          concurrency * args.cases_per_slot, not args.no_stream)
+                    print_result(result)
+                    results.append(result)
+    report = {"suite": "e2e", **git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(),
+              "pipeline": pipeline.mode, "kb": pipeline.kb, "config": vars(args), "results": results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)) if args.out else RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(RESULTS_DIR, f"e2e_{report['commit']}_{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\n📊 Results written to {out}")
+
+# -------------------------
+# Compare
+# -------------------------
+# (metric, getter, higher is better)
+_METRICS = [
+    ("e2e p50 s", lambda r: r["e2e_latency_s"].get("p50"), False),
+    ("e2e p95 s", lambda r: r["e2e_latency_s"].get("p95"), False),
+    ("cases/min", lambda r: r["throughput_cases_per_min"], True),
+    ("peak RSS MB", lambda r: r["peak_rss_mb"], False),
+    ("tokens sent", lambda r: r["llm"].get("prompt_tokens"), False),
+]
+
+def cmd_compare(args) -> int:
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    old_by_key = {(r["scenario"], r["concurrency"]): r for r in old["results"]}
+    print(f"{old['commit']} -> {new['commit']} (regression threshold {args.threshold:.0%})")
+    regressions = 0
+    for r in new["results"]:
+        base = old_by_key.get((r["scenario"], r["concurrency"]))
+        if base is None:
+            continue
+        print(f"\n{r['scenario']} x{r['concurrency']}")
+        metrics = _METRICS + [(f"stage {s} p50 s", (lambda s: lambda x: x["stages"].get(s, {}).get("p50"))(s), False)
+                              for s in r["stages"]]
+        for name, get, higher_better in metrics:
+            a, b = get(base), get(r)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            worse = -change if higher_better else change
+            flag = "  ▲ regression" if worse > args.threshold else ("  ▼ improved" if worse < -args.threshold else "")
+            regressions += worse > args.threshold
+            print(f"  {name:<26} {a:>10.2f} -> {b:>10.2f}  ({change:+.1%}){flag}")
+    print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="run the benchmark and write a JSON result file")
+    run.add_argument("--scenarios", default="sample,docs-1,docs-10,docs-100,large-pdf,images-20")
+    run.add_argument("--concurrency", default="1,4", help="concurrent cases, one run per value")
+    run.add_argument("--cases-per-slot", type=int, default=1, help="cases per concurrent slot")
+    run.add_argument("--pdf-pages", type=int, default=300)
+    run.add_argument("--latency", type=float, default=0.3, help="mock LLM seconds to first token")
+    run.add_argument("--tokens-per-s", type=float, default=400)
+    run.add_argument("--out-tokens", type=int, default=200)
+    run.add_argument("--fail-rate", type=float, default=0.0)
+    run.add_argument("--fail-status", type=int, default=429)
+    run.add_argument("--fda-latency", type=float, default=0.15)
+    run.add_argument("--fda-cache", action="store_true", help="keep the OpenFDA SQLite cache on")
+    run.add_argument("--llm-cache", action="store_true", help="turn the LLM response cache on")
+    run.add_argument("--kb", choices=("auto", "real", "stub"), default="auto")
+    run.add_argument("--no-stream", action="store_true", help="run stages without streaming")
+    run.add_argument("--out", help="result file (default benchmarks/results/e2e_<commit>_<time>.json)")
+    compare = sub.add_parser("compare", help="compare two result files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.10)
+    args = ap.parse_args(argv)
+    if args.cmd == "run":
+        cmd_run(args)
+        return 0
+    return cmd_compare(args)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
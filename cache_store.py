@@ -0,0 +1,188 @@
+# cache_store.py - Small cache building blocks shared by the KB, OpenFDA and LLM caches
+#
+#   ByteLRUCache   thread-safe in-memory LRU bounded by (approximate) bytes
+#   SqliteCache    persistent key/value tier in one SQLite file, with TTL and a size cap
+
+import os
+import sys
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+# SqliteCache hits update their access time in batches of this many, or after this many seconds.
+CACHE_TOUCH_BATCH = int(os.getenv("CACHE_TOUCH_BATCH", "256"))
+CACHE_TOUCH_S = float(os.getenv("CACHE_TOUCH_S", "30"))
+
+def approx_size(value: Any) -> int:
+    """Cheap, recursive size estimate used for byte-bounded eviction."""
+    nbytes = getattr(value, "nbytes", None)  # numpy arrays
+    if nbytes is not None:
+        return int(nbytes) + 96
+    if isinstance(value, (str, bytes)):
+        return len(value) + 49
+    if isinstance(value, dict):
+        return 232 + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(approx_size(v) for v in value)
+    return sys.getsizeof(value)
+
+class ByteLRUCache:
+    """In-memory LRU cache that evicts least-recently-used entries beyond `max_bytes`."""
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = approx_size):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._data:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class SqliteCache:
+    """
+    Persistent cache tier. Values are pickled (the file is local and trusted).
+    Entries past their TTL are ignored and purged; when the file grows past
+    `max_bytes` the least recently used entries are deleted. The byte total is
+    kept in memory (re-summed before evicting, as other processes may share the
+    file), and hits record their access time in batches rather than with one
+    commit per read.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 2**20, default_ttl: Optional[float] = None):
+        self.path, self.max_bytes, self.default_ttl = path, max_bytes, default_ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, size INTEGER, "
+            "expires REAL, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._conn.commit()
+        self._bytes = self._total()
+        self._touched: Dict[str, float] = {}  # key -> last hit, not yet written
+        self._touched_at = time.monotonic()
+        self.hits = self.misses = 0
+
+    def _total(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _write_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE cache SET accessed = ? WHERE key = ?",
+                                   [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+        self._touched_at = time.monotonic()
+
+    def get(self, key: str, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires, size FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self._bytes -= row[2]
+                    self._touched.pop(key, None)
+                self.misses += 1
+                return default
+            self._touched[key] = now
+            if len(self._touched) >= CACHE_TOUCH_BATCH or time.monotonic() - self._touched_at >= CACHE_TOUCH_S:
+                self._write_touched()
+                self._conn.commit()
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now + ttl if ttl else None, now),
+            )
+            self._touched.pop(key, None)
+            self._bytes += len(blob) - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._write_touched()
+                self._conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (now,))
+                self._bytes = self._total()
+                # Drop the oldest ~10% by last access until back under the cap.
+                while self._bytes > self.max_bytes:
+                    victims = self._conn.execute(
+                        "SELECT key, size FROM cache ORDER BY accessed LIMIT (SELECT MAX(1, COUNT(*) / 10) FROM cache)"
+                    ).fetchall()
+                    if not victims:
+                        break
+                    self._conn.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k, _ in victims])
+                    self._bytes -= sum(size for _, size in victims)
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+            self._touched.pop(key, None)
+            self._bytes -= old[0] if old else 0
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+            self._touched.clear()
+            self._bytes = 0
+
+    def flush(self):
+        """Writes the access times of recent hits (otherwise batched, see CACHE_TOUCH_BATCH)."""
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
@@ -1,124 +1,177 @@
 from crewai import Crew, Process, Task, Agent
-from crewai_tools import MCPServerAdapter
-from data_analyze import client, ensure_kb_index
-from agents.document_analyzer import document_analyzer as doc_analyzer_logic
-from agents.medical_context_agent import medical_context_icd as icd_logic
-from agents.reasoning_agent import reasoning_agent as reasoning_logic 
-from agents.kb_agent import kb_agent as kb_logic
-from agents.treatment_planner_agent import treatment_planner_agent as planner_logic
-from agents.advisory_agent import advisory_agent as advisory_logic
+import os
+import queue
+import threading
+from typing import Iterator
+from data_analyze import client, ensure_kb_index, warm_up_kb
+from pipeline_dag import Stage, run_dag, is_failure, PipelineCancelled
+from agents.document_analyzer import adocument_analyzer as doc_analyzer_logic
+from agents.medical_context_agent import amedical_context_icd as icd_logic
+from agents.reasoning_agent import areasoning_agent as reasoning_logic
+from agents.kb_agent import retrieve_kb_hits, aformat_kb_hits
+from agents.treatment_planner_agent import aplan_treatment, prefetch_drug_warnings, add_safety_notes
+from agents.advisory_agent import aadvisory_agent as advisory_logic
 from agents.agent_definitions import ( 
     get_document_analyzer_agent, get_medical_context_agent, get_reasoning_agent, 
     get_kb_agent, get_treatment_planner_agent, get_advisory_agent
 )
-import groq
-from yarl import URL
 
-# --- MCP Client Setup ---
-MCP_SERVER_PARAMS = [
-    {"url": "http://127.0.0.1:8001/mcp", "transport": "streamable-http"},
-    {"url": "http://127.0.0.1:8002/mcp", "transport": "streamable-http"},
-]
+# Per-attempt timeout (seconds) and extra attempts for each LLM stage of the pipeline.
+LLM_STAGE_TIMEOUT = float(os.getenv("LLM_STAGE_TIMEOUT", "120"))
+LLM_STAGE_RETRIES = int(os.getenv("LLM_STAGE_RETRIES", "1"))
+
+# --- MCP Client Setup (one long-lived registry per process, see mcp_registry.py) ---
+from mcp_registry import get_registry
 
 def get_mcp_tools():
-    try:
-        adapter = MCPServerAdapter(MCP_SERVER_PARAMS)
-        return adapter.tools
-    except Exception as e:
-        raise RuntimeError(
-            f"MCP Connection Failure: Ensure servers on 8001 & 8002 are running. Error: {e}"
-        )
-
-def fix_groq_url(tool):
-    """Ensure Groq models inside tools use string URLs, not URL objects."""
-    if hasattr(tool, 'model') and isinstance(tool.model, groq.Groq):
-        tool.model = groq.Groq(url=str(tool.model.url))
-    return tool
-
-def safe_task(callback, task_name):
-    """Execute a task safely and log success/failure in terminal."""
-    try:
-        output = callback(None)
-        print(f"✅ {task_name} succeeded.")
-        return output
-    except Exception as e:
-        print(f"❌ {task_name} failed: {e}")
-        return f"❌ Task failed: {task_name} | Error: {e}"
+    return list(get_registry().tools().values())
+
+def build_crew_stages(file_paths: list, user_note: str = None) -> list:
+    """
+    The report pipeline as a DAG. Besides the six report stages it runs:
+      - KB warm-up (embedder + index load) alongside document analysis and ICD mapping
+      - OpenFDA lookups for drugs already named in the inputs while the plan is being written
+    Each stage gets the same inputs as the old sequential run, so the report is unchanged.
+    """
+    llm = dict(timeout=LLM_STAGE_TIMEOUT, retries=LLM_STAGE_RETRIES)
+
+    def findings(doc, icd, reasoning):
+        return doc + icd + reasoning
+
+    async def analyze_documents():
+        return await doc_analyzer_logic(file_paths, user_note)
+
+    async def kb_format(hits):
+        return hits if is_failure(hits) else await aformat_kb_hits(hits)
+
+    async def plan(doc, icd, reasoning, kb):
+        return await aplan_treatment(findings(doc, icd, reasoning), kb_snippets=kb)
+
+    def fda_prefetch(doc, icd, reasoning, kb):
+        return prefetch_drug_warnings(findings(doc, icd, reasoning), kb_snippets=kb)
+
+    def treatment(plan_text, prefetched, doc, icd, reasoning, kb):
+        if is_failure(plan_text):
+            return plan_text
+        known = None if is_failure(prefetched) else prefetched
+        return add_safety_notes(plan_text, findings(doc, icd, reasoning), kb_snippets=kb, known=known)
+
+    return [
+        Stage("kb_warmup", warm_up_kb, label="KB Warm-up", timeout=600),
+        # Map batches retry on their own (see document_analyzer.py); the stage only bounds the total.
+        Stage("doc", analyze_documents, label="Document Analysis", timeout=LLM_STAGE_TIMEOUT * 4),
+        Stage("icd", icd_logic, ["doc"], label="ICD Mapping", **llm),
+        Stage("reasoning", reasoning_logic, ["icd"], label="Clinical Reasoning", **llm),
+        Stage("kb_hits", lambda reasoning, _warm: retrieve_kb_hits(reasoning), ["reasoning", "kb_warmup"],
+              label="KB Retrieval", timeout=120, retries=1),
+        Stage("kb", kb_format, ["kb_hits"], label="KB Lookup", **llm),
+        Stage("plan", plan, ["doc", "icd", "reasoning", "kb"], label="Treatment Planning", **llm),
+        Stage("fda_prefetch", fda_prefetch, ["doc", "icd", "reasoning", "kb"], label="FDA Prefetch", timeout=60),
+        Stage("treatment", treatment, ["plan", "fda_prefetch", "doc", "icd", "reasoning", "kb"],
+              label="FDA Safety Checks", timeout=60, retries=1),
+        Stage("advisory", advisory_logic, ["treatment"], label="Patient Advisory", **llm),
+    ]
 
-def run_medical_crew(file_paths: list, user_note: str = None) -> str:
-    # --- MCP tools ---
+# Report sections in order: (key, heading, stages whose streamed text fills the section).
+# The section's final text is the result of the last stage listed.
+REPORT_SECTIONS = [
+    ("doc", "### 📄 Document Analysis", ["doc"]),
+    ("icd", "### 🏷️ Medical Context (ICD)", ["icd"]),
+    ("reasoning", "### 🧠 Clinical Reasoning", ["reasoning"]),
+    ("kb", "### 🗂️ KB Guidelines", ["kb"]),
+    ("treatment", "### 🩺 Treatment Plan", ["plan", "treatment"]),
+    ("advisory", "### 💡 Patient Advisory", ["advisory"]),
+]
+
+def _prepare_crew():
+    """Connects the MCP tools and builds the agents. Returns an error message, or None when ready."""
+    registry = get_registry()
+    # --- MCP tools (connected once, health-checked, reused across requests) ---
     try:
-        all_mcp_tools = get_mcp_tools()
+        all_mcp_tools = registry.tools()
     except Exception as e:
         return f"❌ Failed to initialize MCP tools: {e}"
 
-    try:
-        kb_search_tool = next((t for t in all_mcp_tools if t.name == 'search_medical_guidelines'), None)
-        fda_checker_tool = next((t for t in all_mcp_tools if t.name == 'check_drug_safety'), None)
-        if not kb_search_tool or not fda_checker_tool:
-            return "❌ Required MCP tools not found."
+    kb_search_tool = all_mcp_tools.get('search_medical_guidelines')
+    fda_checker_tool = all_mcp_tools.get('check_drug_safety')
+    if not kb_search_tool or not fda_checker_tool:
+        return "❌ Required MCP tools not found."
 
-        kb_search_tool = fix_groq_url(kb_search_tool)
-        fda_checker_tool = fix_groq_url(fda_checker_tool)
-    except Exception as e:
-        return f"❌ Error fetching or fixing MCP tools: {e}"
-
-    # --- Agents ---
+    # --- Agents (built once per connection and cached by the registry) ---
     try:
-        document_analyzer_a = get_document_analyzer_agent()
-        medical_context_agent = get_medical_context_agent()
-        reasoning_agent_a = get_reasoning_agent() 
-        kb_agent = get_kb_agent(tools=[kb_search_tool]) 
-        treatment_planner_agent = get_treatment_planner_agent(tools=[fda_checker_tool]) 
-        advisory_agent = get_advisory_agent()
+        registry.get_agent("document_analyzer", get_document_analyzer_agent)
+        registry.get_agent("medical_context", get_medical_context_agent)
+        registry.get_agent("reasoning", get_reasoning_agent)
+        registry.get_agent("kb", lambda: get_kb_agent(tools=[kb_search_tool]))
+        registry.get_agent("treatment_planner", lambda: get_treatment_planner_agent(tools=[fda_checker_tool]))
+        registry.get_agent("advisory", get_advisory_agent)
     except Exception as e:
         return f"❌ Failed to initialize agents: {e}"
+    return None
 
-    # --- Execute tasks safely ---
-    doc_analysis_output = safe_task(
-        lambda _: doc_analyzer_logic(file_paths, user_note),
-        "Document Analysis"
-    )
-
-    icd_mapping_output = safe_task(
-        lambda _: icd_logic(doc_analysis_output),
-        "ICD Mapping"
-    )
-
-    reasoning_output = safe_task(
-        lambda _: reasoning_logic(icd_mapping_output),
-        "Clinical Reasoning"
-    )
-
-    kb_lookup_output = safe_task(
-        lambda _: kb_logic(reasoning_output),  # Use logic function, not Agent.call()
-        "KB Lookup"
-    )
-
-    treatment_output = safe_task(
-        lambda _: planner_logic(
-            doc_analysis_output + icd_mapping_output + reasoning_output,
-            kb_snippets=kb_lookup_output
-        ),
-        "Treatment Planning"
-    )
-
-    advisory_output = safe_task(
-        lambda _: advisory_logic(treatment_output),
-        "Patient Advisory"
-    )
+def format_report(results: dict) -> str:
+    final_report_parts = [f"{heading}\n{results[stages[-1]]}" for _, heading, stages in REPORT_SECTIONS]
+    return "\n\n---\n\n".join(final_report_parts)
 
-    # --- Final report ---
-    final_report_parts = [
-        f"### 📄 Document Analysis\n{doc_analysis_output}",
-        f"### 🏷️ Medical Context (ICD)\n{icd_mapping_output}",
-        f"### 🧠 Clinical Reasoning\n{reasoning_output}",
-        f"### 🗂️ KB Guidelines\n{kb_lookup_output}",
-        f"### 🩺 Treatment Plan\n{treatment_output}",
-        f"### 💡 Patient Advisory\n{advisory_output}",
-    ]
+def run_medical_crew(file_paths: list, user_note: str = None) -> str:
+    error = _prepare_crew()
+    if error:
+        return error
 
-    return "\n\n---\n\n".join(final_report_parts)
+    # --- Execute tasks (DAG: independent stages overlap) ---
+    results = run_dag(build_crew_stages(file_paths, user_note))
+
+    # --- Final report ---
+    return format_report(results)
+
+def stream_medical_crew(file_paths: list, user_note: str = None, cancel: threading.Event = None) -> Iterator[dict]:
+    """
+    Same pipeline as run_medical_crew(), as a stream of events:
+      {"type": "stage_start", "stage", "label"}
+      {"type": "delta", "stage", "text"}             streamed LLM tokens of a running stage
+      {"type": "stage_retry", "stage", "label", "attempt"}   drop that stage's streamed text
+      {"type": "stage_complete", "stage", "label", "ok", "seconds", "result"}
+      {"type": "report", "text"}                      last event: the full report, as run_medical_crew returns it
+    Setting `cancel`, or closing the generator, stops the pipeline; the stream
+    then ends without a report once the running stages have stopped.
+    """
+    error = _prepare_crew()
+    if error:
+        yield {"type": "report", "text": error}
+        return
+
+    events: "queue.Queue" = queue.Queue()
+    box = {}
+    cancel = cancel or threading.Event()
+
+    def runner():
+        try:
+            box["results"] = run_dag(build_crew_stages(file_paths, user_note), on_event=events.put, cancel=cancel)
+        except BaseException as e:
+            box["error"] = e
+        finally:
+            events.put(None)
+
+    thread = threading.Thread(target=runner, name="medical-crew-stream", daemon=True)
+    thread.start()
+    finished = False
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                finished = True
+                break
+            yield event
+    finally:
+        # A closed stream must not leave the pipeline making LLM/FDA calls in the background.
+        if not finished:
+            cancel.set()
+        thread.join()
+    if isinstance(box.get("error"), PipelineCancelled):
+        return
+    if "error" in box:
+        raise box["error"]
+    yield {"type": "report", "text": format_report(box["results"])}
 
 
 if __name__ == '__main__':
@@ -1,16 +1,17 @@
 # data_analyze.py: The central utility file (Updated fallback for MCP compatibility)
 
 import os
-import re
-import pickle
 import base64
-import fitz
-import requests
+import time
+import threading
+import weakref
+import asyncio
 import numpy as np
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer
-import faiss
-from groq import Groq
+from typing import List, Dict, Callable, Any
+from groq import Groq, AsyncGroq
+from pdf_extract import iter_pdf_pages
+import llm_cache
+import tracing
 
 # -------------------------
 # Groq credentials
@@ -22,36 +23,212 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL = "meta-llama/llama-4-maverick-17b-128e-instruct"
 client = Groq(api_key=GROQ_API_KEY) 
 
+# -------------------------
+# LLM calls
+# -------------------------
+# Agents call chat_completion() (blocking) or achat_completion() (asyncio, used
+# by the pipeline DAG) instead of the Groq clients directly. When the caller
+# passes on_delta, or a pipeline stage is being streamed to the UI (see
+# pipeline_dag.current_delta_sink), the completion is requested with
+# stream=True and every text delta is forwarded as it arrives.
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+def _is_messages(value) -> bool:
+    return isinstance(value, list) and bool(value) and isinstance(value[0], dict) and "role" in value[0]
+
+def _as_messages(prompt) -> List[Dict[str, Any]]:
+    return prompt if _is_messages(prompt) else [{"role": "user", "content": prompt}]
+
+def _add_usage(source, usage: Dict[str, int] = None):
+    """Adds a response's token counts to `usage` and to the running pipeline stage's tally."""
+    if source is None:
+        return
+    from pipeline_dag import record_stage_usage
+    counts = {key: getattr(source, key, 0) or 0 for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    if usage is not None:
+        for key, value in counts.items():
+            usage[key] = usage.get(key, 0) + value
+    record_stage_usage(counts)
+    span = tracing.current_span()
+    if span is not None and span.name == "llm.chat":
+        span.add("tokens_in", counts["prompt_tokens"])
+        span.add("tokens_out", counts["completion_tokens"])
+
+def _chunk_delta(chunk, usage: Dict[str, int] = None) -> str:
+    x_groq = getattr(chunk, "x_groq", None)
+    if x_groq is not None:  # Groq reports usage on the last chunk of a stream
+        _add_usage(getattr(x_groq, "usage", None), usage)
+    return (chunk.choices[0].delta.content or "") if chunk.choices else ""
+
+def _delta_sink(on_delta):
+    from pipeline_dag import current_delta_sink
+    return on_delta or current_delta_sink()
+
+def _cache_lookup(model, messages, temperature, kwargs, sink):
+    """(cache key or None, cached text or None); see llm_cache.py (off unless LLM_CACHE=1)."""
+    from pipeline_dag import current_stage
+    stage = current_stage()
+    key = llm_cache.lookup_key(stage, model, messages, {"temperature": temperature, **kwargs})
+    if key is None:
+        return None, None
+    cached = llm_cache.get_llm_cache().get(key, stage)
+    tracing.current_span().set(cache="miss" if cached is None else "hit")
+    if cached is not None and sink is not None:
+        sink(cached)  # a hit streams as one delta
+    return key, cached
+
+def _cache_store(key, text):
+    if key is not None:
+        from pipeline_dag import current_stage
+        llm_cache.get_llm_cache().put(key, text, current_stage())
+    return text
+
+def _llm_attrs(model: str, messages, sink) -> Dict[str, Any]:
+    """Span attributes of one LLM request: stage, model, payload bytes (text + base64 images)."""
+    from pipeline_dag import current_stage
+    size, images = 0, 0
+    for m in messages:
+        content = m.get("content")
+        for part in (content if isinstance(content, list) else [content]):
+            if isinstance(part, str):
+                size += len(part)
+            elif isinstance(part, dict):
+                if part.get("type") == "image_url":
+                    images += 1
+                    size += len(part.get("image_url", {}).get("url", ""))
+                else:
+                    size += len(part.get("text", ""))
+    return {"stage": current_stage() or "", "model": model, "bytes": size, "images": images, "stream": sink is not None}
+
+def chat_completion(prompt, temperature: float = 0.2, model: str = None, usage: Dict[str, int] = None,
+                    on_delta: Callable[[str], None] = None, **kwargs) -> str:
+    """
+    One chat completion; `prompt` is a string, a multimodal content list, or a
+    messages list. Pass a dict as `usage` to have token counts added to it.
+    """
+    sink = _delta_sink(on_delta)
+    model, messages = model or GROQ_MODEL, _as_messages(prompt)
+    with tracing.span("llm.chat", **_llm_attrs(model, messages, sink)):
+        key, cached = _cache_lookup(model, messages, temperature, kwargs, sink)
+        if cached is not None:
+            return cached
+        resp = client.chat.completions.create(model=model, messages=messages,
+                                              temperature=temperature, stream=sink is not None, **kwargs)
+        if sink is None:
+            _add_usage(resp.usage, usage)
+            return _cache_store(key, resp.choices[0].message.content)
+        parts = []
+        for chunk in resp:
+            delta = _chunk_delta(chunk, usage)
+            if delta:
+                parts.append(delta)
+                sink(delta)
+        return _cache_store(key, "".join(parts))
+
+def get_async_client() -> AsyncGroq:
+    """One AsyncGroq client per event loop (its connection pool is bound to the loop)."""
+    loop = asyncio.get_running_loop()
+    aclient = _ASYNC_CLIENTS.get(loop)
+    if aclient is None:
+        aclient = AsyncGroq(api_key=GROQ_API_KEY)
+        _ASYNC_CLIENTS[loop] = aclient
+    return aclient
+
+async def achat_completion(prompt, temperature: float = 0.2, model: str = None, usage: Dict[str, int] = None,
+                           on_delta: Callable[[str], None] = None, **kwargs) -> str:
+    """Async twin of chat_completion()."""
+    sink = _delta_sink(on_delta)
+    model, messages = model or GROQ_MODEL, _as_messages(prompt)
+    with tracing.span("llm.chat", **_llm_attrs(model, messages, sink)):
+        key, cached = _cache_lookup(model, messages, temperature, kwargs, sink)
+        if cached is not None:
+            return cached
+        resp = await get_async_client().chat.completions.create(model=model, messages=messages,
+                                                                temperature=temperature, stream=sink is not None, **kwargs)
+        if sink is None:
+            _add_usage(resp.usage, usage)
+            return _cache_store(key, resp.choices[0].message.content)
+        parts = []
+        async for chunk in resp:
+            delta = _chunk_delta(chunk, usage)
+            if delta:
+                parts.append(delta)
+                sink(delta)
+        return _cache_store(key, "".join(parts))
+
 # -------------------------
 # KB settings
 # -------------------------
 STG_PDF = "standard-treatment-guidelines.pdf"
-KB_INDEX_PICKLE = "kb_index.pkl"
+KB_INDEX_PICKLE = "kb_index.pkl"  # legacy format, converted to KB_STORE_DIR on first load
+KB_STORE_DIR = os.getenv("KB_STORE_DIR", "kb_store")
+KB_CHUNK_SIZE = 300
+KB_CHUNK_OVERLAP = 50
 EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
-KB_EMBEDDER = SentenceTransformer(EMBED_MODEL_NAME)
-RAG_EMBEDDER = SentenceTransformer(EMBED_MODEL_NAME)
+# FAISS backend for the KB: flat | ivf_flat | hnsw | ivf_pq (see ann_index.py)
+KB_INDEX_TYPE = os.getenv("KB_INDEX_TYPE", "flat")
+# How often (seconds) a loaded KB checks its manifest for a newer ingest.
+KB_RELOAD_CHECK_S = float(os.getenv("KB_RELOAD_CHECK_S", "2"))
 kb_index_data = None
+_kb_checked_at = 0.0
+
+# -------------------------
+# Lazy resource registry
+# -------------------------
+# Heavy resources (torch/MiniLM, the FAISS index) are created on first use and
+# shared by every caller in the process, so importing this module stays cheap
+# for entry points that never touch the KB (e.g. the FDA MCP server).
+_RESOURCES: Dict[str, Any] = {}
+_RESOURCE_LOCK = threading.RLock()
+
+def get_resource(name: str, factory: Callable[[], Any]):
+    """Returns the process-wide resource `name`, creating it with `factory` on first use."""
+    res = _RESOURCES.get(name)
+    if res is None:
+        with _RESOURCE_LOCK:
+            res = _RESOURCES.get(name)
+            if res is None:
+                res = factory()
+                _RESOURCES[name] = res
+    return res
+
+def _load_embedder():
+    # torch SentenceTransformer or ONNX Runtime, per EMBED_BACKEND (see embedder_backends.py)
+    from embedder_backends import load_embedder
+    return load_embedder(EMBED_MODEL_NAME)
+
+def get_embedder():
+    """The process-wide embedder for the configured backend (embedder_backends.py), used for both KB building and queries."""
+    return get_resource("embedder", _load_embedder)
+
+def __getattr__(name):
+    # Backwards compatibility for callers that still import the old module-level embedders.
+    if name in ("KB_EMBEDDER", "RAG_EMBEDDER"):
+        return get_embedder()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # -------------------------
-# OpenFDA
+# OpenFDA (pooled session, concurrent batch lookups and TTL cache: see openfda_client.py)
 # -------------------------
-OPENFDA_BASE = "https://api.fda.gov/drug/label.json"
+from openfda_client import OPENFDA_BASE, get_openfda_warnings, get_openfda_warnings_many
 
 # -------------------------
 # Utilities
 # -------------------------
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Helper to safely extract text from a PDF file."""
-    if not os.path.exists(pdf_path):
-        raise FileNotFoundError(f"{pdf_path} not found")
-    doc = fitz.open(pdf_path)
-    return "\n".join([page.get_text("text") for page in doc])
+def extract_text_from_pdf(pdf_path: str, workers: int = None) -> str:
+    """
+    Helper to safely extract text from a PDF file. Prefer iter_pdf_pages() for
+    large documents: it yields one page at a time instead of one big string.
+    """
+    return "\n".join(text for _, text in iter_pdf_pages(pdf_path, workers=workers))
 
 def file_to_base64(file_path: str):
     """Helper to convert a file to a Base64 string for multimodal input."""
-    with open(file_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+    with tracing.span("image.base64") as span, open(file_path, "rb") as f:
+        data = f.read()
+        span.set(bytes=len(data))
+        return base64.b64encode(data).decode("utf-8")
 
 def chunk_text(text: str, chunk_size: int = 400, overlap: int = 50) -> List[str]:
     """Helper to split long text into manageable chunks for RAG indexing."""
@@ -64,100 +241,163 @@ def chunk_text(text: str, chunk_size: int = 400, overlap: int = 50) -> List[str]
         i += chunk_size - overlap
     return chunks
 
-def get_openfda_warnings(drug_name: str):
-    """
-    Searches the OpenFDA database for safety warnings. Returns a structured dictionary.
-    FIXED to return ALL Pydantic fields on failure.
-    """
-    try:
-        for key in ["brand_name", "generic_name"]:
-            params = {"search": f"openfda.{key}:{drug_name}", "limit": 1}
-            resp = requests.get(OPENFDA_BASE, params=params, timeout=10)
-            if resp.status_code == 200:
-                data = resp.json().get("results", [])
-                if data:
-                    entry = data[0]
-                    return {
-                        "drug_name": drug_name,
-                        "brand": entry.get("openfda", {}).get("brand_name", ["N/A"])[0],
-                        "generic": entry.get("openfda", {}).get("generic_name", ["N/A"])[0],
-                        "warnings": entry.get("warnings", ["No warnings available"])[0],
-                        "found": True # Indicate success
-                    }
-    except Exception:
-        pass
-    
-    # --- FIX: Ensure ALL required Pydantic fields are returned on failure ---
-    return {
-        "drug_name": drug_name, 
-        "brand": "N/A",
-        "generic": "N/A",
-        "warnings": "No data found due to search or network error.", 
-        "found": False # Indicate failure
-    }
-    # -----------------------------------------------------------------------
-
 # -------------------------
 # KB RAG
 # -------------------------
-def build_kb_index(pdf_path: str = STG_PDF, out_pickle: str = KB_INDEX_PICKLE):
-    # ... (RAG/FAISS logic remains the same)
-    print(f"Building KB (STG) index from PDF: {pdf_path}...")
+def build_kb_index(pdf_path: str = STG_PDF, out_dir: str = KB_STORE_DIR,
+                   index_type: str = None, embed_workers: int = None, **index_params):
+    """
+    (Re)builds the KB store from scratch from one PDF or a directory of PDFs.
+    `index_type` selects the FAISS backend (defaults to KB_INDEX_TYPE); extra
+    keyword arguments are build/search parameters for that backend (e.g.
+    nlist=64, nprobe=8, M=32, ef_search=64). `embed_workers` encoder processes
+    embed the passages (default KB_EMBED_WORKERS); an interrupted build resumes
+    from its checkpoint. For incremental updates use kb_ingest.py instead.
+    """
+    from kb_ingest import ingest_documents
+    index_type = index_type or KB_INDEX_TYPE
+    print(f"Building KB (STG) index ({index_type}) from: {pdf_path}...")
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"Cannot build KB index. PDF file not found at: {pdf_path}")
-        
-    text = extract_text_from_pdf(pdf_path)
-    text = re.sub(r"\n{2,}", "\n", text)
-    passages = chunk_text(text, chunk_size=300, overlap=50)
-    embeddings = KB_EMBEDDER.encode(passages, convert_to_numpy=True, show_progress_bar=True)
-    if embeddings.dtype != np.float32:
-        embeddings = embeddings.astype(np.float32)
-        
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
-    
-    with open(out_pickle, "wb") as f:
-        pickle.dump({"index": index, "passages": passages}, f)
-    print(f"✅ Built KB index with {len(passages)} passages and saved to {out_pickle}")
-    return {"index": index, "passages": passages}
-
-def load_kb_index(pickle_path: str = KB_INDEX_PICKLE):
-    if not os.path.exists(pickle_path):
+
+    stats = ingest_documents([pdf_path], out_dir, index_type=index_type, rebuild=True,
+                             embed_workers=embed_workers, **index_params)
+    print(f"✅ Built KB index with {stats['chunks_embedded']} passages and saved to {out_dir}")
+    return load_kb_index(out_dir)
+
+def _manifest_mtime(store_dir: str):
+    try:
+        return os.stat(os.path.join(store_dir, "manifest.json")).st_mtime_ns
+    except OSError:
         return None
-    with open(pickle_path, "rb") as f:
-        return pickle.load(f)
+
+def load_kb_index(store_dir: str = KB_STORE_DIR):
+    """Opens the KB store (mmap'd index, on-demand passages); refuses a model/version mismatch."""
+    from kb_store import is_store, open_store
+    from kb_cache import kb_version
+    if not is_store(store_dir):
+        return None
+    mtime = _manifest_mtime(store_dir)
+    from embedder_backends import EMBED_BACKEND
+    data = open_store(store_dir, embed_model=EMBED_MODEL_NAME, embed_backend=EMBED_BACKEND)
+    data["version"] = kb_version(data["manifest"])
+    data["manifest_mtime"] = mtime
+    return data
+
+def _kb_store_changed() -> bool:
+    """True when kb_ingest.py has rewritten the manifest since the KB was loaded (checked at most every KB_RELOAD_CHECK_S)."""
+    global _kb_checked_at
+    now = time.monotonic()
+    if kb_index_data is None or now - _kb_checked_at < KB_RELOAD_CHECK_S:
+        return False
+    _kb_checked_at = now
+    mtime = _manifest_mtime(KB_STORE_DIR)
+    return mtime is not None and mtime != kb_index_data.get("manifest_mtime")
 
 def ensure_kb_index():
+    """Loads (or builds) the KB index on first use; later calls return the cached copy, reloaded after a new ingest."""
     global kb_index_data
+    if kb_index_data is not None and _kb_store_changed():
+        with _RESOURCE_LOCK:
+            print(f"KB store {KB_STORE_DIR} changed on disk; reloading.")
+            kb_index_data = load_kb_index(KB_STORE_DIR)
     if kb_index_data is None:
-        data = load_kb_index(KB_INDEX_PICKLE)
-        if data is None:
-            if os.path.exists(STG_PDF):
-                data = build_kb_index(STG_PDF, KB_INDEX_PICKLE)
-            else:
-                print(f"WARNING: Standard Treatment Guidelines PDF ({STG_PDF}) not found. RAG will not work.")
-                return None
-        kb_index_data = data
+        with _RESOURCE_LOCK:
+            if kb_index_data is not None:
+                return kb_index_data
+            data = load_kb_index(KB_STORE_DIR)
+            if data is None and os.path.exists(KB_INDEX_PICKLE):
+                from kb_store import convert_pickle
+                # The legacy pickle was always embedded with torch.
+                convert_pickle(KB_INDEX_PICKLE, KB_STORE_DIR, EMBED_MODEL_NAME, source_pdf=STG_PDF,
+                               chunk_size=KB_CHUNK_SIZE, overlap=KB_CHUNK_OVERLAP)
+                data = load_kb_index(KB_STORE_DIR)
+            if data is None:
+                if os.path.exists(STG_PDF):
+                    data = build_kb_index(STG_PDF, KB_STORE_DIR)
+                else:
+                    print(f"WARNING: Standard Treatment Guidelines PDF ({STG_PDF}) not found. RAG will not work.")
+                    return None
+            kb_index_data = data
     return kb_index_data
 
-def rag_lookup_kb(query: str, top_k: int = 4) -> List[Dict[str,str]]:
-    """Performs semantic search against the FAISS index."""
+def get_kb_cache():
+    """Process-wide query-embedding / retrieval-result cache (see kb_cache.py)."""
+    from kb_cache import KBQueryCache
+    return get_resource("kb_cache", KBQueryCache)
+
+def warm_up_kb():
+    """Optional warm-up hook: loads the embedder and KB index ahead of the first query."""
+    ensure_kb_index()
+    get_embedder().encode(["warm-up"], convert_to_numpy=True)
+
+def rag_lookup_kb_batch(queries: List[str], top_k: int = 4, nprobe: int = None,
+                        ef_search: int = None) -> List[List[Dict[str, Any]]]:
+    """
+    Semantic search for several queries at once: one encoder call and one FAISS
+    search over the whole query matrix. Returns one hit list per query, in order.
+    `nprobe` (IVF indexes) and `ef_search` (HNSW) trade recall for latency; by
+    default the values saved with the index are used. Repeated queries are
+    answered from the KB cache without touching the encoder or the index.
+    """
+    from ann_index import search_parameters
+    from kb_cache import normalize_query
+    queries = list(queries)
     kb_data = ensure_kb_index()
-    if kb_data is None:
-        return []
-        
-    emb = RAG_EMBEDDER.encode([query], convert_to_numpy=True)
-    if emb.dtype != np.float32:
-        emb = emb.astype(np.float32)
-    
-    D, I = kb_data["index"].search(emb, top_k)
-    results = []
-    for idx in I[0]:
-        if idx >= 0 and idx < len(kb_index_data["passages"]):
-            results.append({"passage": kb_index_data["passages"][idx], "score": float(D[0][list(I[0]).index(idx)])})
+    if kb_data is None or not queries:
+        return [[] for _ in queries]
+
+    cache = get_kb_cache()
+    cache.set_version(kb_data["version"])
+    knobs = (nprobe, ef_search)
+    norm = [normalize_query(q) for q in queries]
+    results: List[Any] = [cache.get_hits(n, top_k, knobs) for n in norm]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if not missing:
+        return results
+
+    # --- Embeddings: cached ones are reused, the rest are encoded in one call ---
+    embs = {}
+    to_encode = []
+    for i in missing:
+        if norm[i] in embs:
+            continue
+        cached = cache.get_embedding(norm[i])
+        if cached is None:
+            to_encode.append(norm[i])
+            embs[norm[i]] = None
+        else:
+            embs[norm[i]] = cached
+    if to_encode:
+        with tracing.span("embed", texts=len(to_encode)):
+            encoded = get_embedder().encode(to_encode, convert_to_numpy=True)
+        for text, vec in zip(to_encode, np.asarray(encoded, dtype=np.float32)):
+            embs[text] = vec
+            cache.put_embedding(text, vec)
+    emb = np.ascontiguousarray(np.vstack([embs[norm[i]] for i in missing]), dtype=np.float32)
+
+    params = search_parameters(kb_data.get("index_params"), nprobe=nprobe, ef_search=ef_search)
+    with tracing.span("kb.search", queries=len(missing), top_k=top_k):
+        D, I = kb_data["index"].search(emb, top_k, params=params)
+    passages = kb_data["passages"]
+    valid = (I >= 0) & (I < len(passages))
+    # Each distinct passage is read from the store once, however many queries hit it.
+    records = {int(i): passages.record(int(i)) for i in np.unique(I[valid])}
+
+    for q, row_ids, row_scores in zip(missing, np.where(valid, I, -1).tolist(), D.tolist()):
+        hits = []
+        for idx, score in zip(row_ids, row_scores):
+            if idx < 0:
+                continue
+            rec = records[idx]
+            hits.append({"passage": rec["text"], "score": score, "source": rec.get("source"), "page": rec.get("page")})
+        cache.put_hits(norm[q], top_k, knobs, hits)
+        results[q] = hits
     return results
 
-ensure_kb_index()
+def rag_lookup_kb(query: str, top_k: int = 4, nprobe: int = None, ef_search: int = None) -> List[Dict[str,str]]:
+    """Performs semantic search against the FAISS index (single-query form of rag_lookup_kb_batch)."""
+    return rag_lookup_kb_batch([query], top_k=top_k, nprobe=nprobe, ef_search=ef_search)[0]
 
 # -------------------------
 # OLD ORCHESTRATOR REMOVED
@@ -0,0 +1,163 @@
+# drug_lexicon.py - Dictionary-backed drug-name extraction
+#
+# A word-level Aho-Corasick automaton over a drug lexicon (generic + brand
+# names, data/drug_lexicon.tsv, optionally extended with the generic/substance
+# names of the offline OpenFDA mirror). extract() tokenizes once and walks the
+# automaton in a single linear pass; because states advance per whole word,
+# every match is on word boundaries ("insulin" never fires inside "insulinoma",
+# "protein" or "routine" never fire at all). Brand names map to their generic
+# (canonical) name, so "Glucophage" and "metformin" give one OpenFDA lookup.
+
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DRUG_LEXICON_PATH = os.getenv("DRUG_LEXICON_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 "data", "drug_lexicon.tsv"))
+# Also learn generic/substance names from the OpenFDA mirror when it exists (0 disables).
+DRUG_LEXICON_USE_MIRROR = os.getenv("DRUG_LEXICON_USE_MIRROR", "1") != "0"
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Mirror substance names that are everyday words in clinical text.
+_MIRROR_STOPWORDS = {
+    "water", "oxygen", "nitrogen", "air", "alcohol", "salt", "sugar", "honey", "sodium", "potassium",
+    "calcium", "iron", "zinc", "glucose", "dextrose", "protein", "cotton", "ethanol", "glycerin",
+    "petrolatum", "menthol", "camphor", "sulfur", "carbon dioxide", "sodium chloride",
+}
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+class DrugLexicon:
+    """Word-level Aho-Corasick matcher mapping drug names to canonical names."""
+
+    def __init__(self, entries: Dict[str, str]):
+        # State 0 is the root. goto[s] maps a word to the next state.
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, str]]] = [[]]  # (name length in words, canonical)
+        self.n_names = 0
+        for name, canonical in entries.items():
+            self._add(tokenize(name), canonical)
+        self._build_failure_links()
+
+    def _add(self, words: List[str], canonical: str):
+        if not words:
+            return
+        state = 0
+        for w in words:
+            nxt = self.goto[state].get(w)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][w] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            state = nxt
+        if not self.out[state]:
+            self.out[state].append((len(words), canonical))
+            self.n_names += 1
+
+    def _build_failure_links(self):
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for w, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and w not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(w, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def __len__(self):
+        return self.n_names
+
+    def matches(self, text: str) -> List[Tuple[int, int, str]]:
+        """Leftmost-longest, non-overlapping matches as (first word, end word, canonical)."""
+        goto, fail, out = self.goto, self.fail, self.out
+        root = goto[0]
+        found = []
+        state = 0
+        for i, w in enumerate(tokenize(text)):
+            if state == 0:
+                state = root.get(w, 0)
+            else:
+                nxt = goto[state].get(w)
+                while nxt is None and state:
+                    state = fail[state]
+                    nxt = goto[state].get(w)
+                state = nxt or 0
+            if state and out[state]:
+                for length, canonical in out[state]:
+                    found.append((i + 1 - length, i + 1, canonical))
+        if not found:
+            return []
+        found.sort(key=lambda m: (m[0], m[0] - m[1]))
+        result, last_end = [], -1
+        for m in found:
+            if m[0] >= last_end:
+                result.append(m)
+                last_end = m[1]
+        return result
+
+    def extract(self, text: str) -> List[str]:
+        """De-duplicated canonical drug names in order of first mention."""
+        seen = {}
+        for _, _, canonical in self.matches(text):
+            seen.setdefault(canonical, None)
+        return list(seen)
+
+def read_lexicon_file(path: str = DRUG_LEXICON_PATH) -> Dict[str, str]:
+    entries: Dict[str, str] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            canonical, _, synonyms = line.partition("\t")
+            canonical = " ".join(canonical.lower().split())
+            entries.setdefault(canonical, canonical)
+            for syn in synonyms.split(","):
+                syn = " ".join(syn.lower().split())
+                if syn:
+                    entries.setdefault(syn, canonical)
+    return entries
+
+def _mirror_names() -> Iterable[str]:
+    import fda_mirror
+    mirror = fda_mirror.get_mirror()
+    if mirror is None:
+        return []
+    return mirror.drug_names(kinds=(1, 2), max_words=4)
+
+def load_lexicon(path: str = DRUG_LEXICON_PATH, use_mirror: bool = DRUG_LEXICON_USE_MIRROR) -> DrugLexicon:
+    entries = read_lexicon_file(path)
+    if use_mirror:
+        try:
+            for name in _mirror_names():
+                if len(name) >= 4 and name not in _MIRROR_STOPWORDS and all(t.isalpha() for t in name.split()):
+                    entries.setdefault(name, name)
+        except Exception as e:
+            print(f"WARNING: could not read drug names from the OpenFDA mirror ({e}); using the bundled lexicon only.")
+    return DrugLexicon(entries)
+
+_lexicon: Optional[DrugLexicon] = None
+_lock = threading.Lock()
+
+def get_lexicon() -> DrugLexicon:
+    """Process-wide lexicon, built on first use."""
+    global _lexicon
+    if _lexicon is None:
+        with _lock:
+            if _lexicon is None:
+                _lexicon = load_lexicon()
+    return _lexicon
+
+def extract_drugs(text: str) -> List[str]:
+    return get_lexicon().extract(text)
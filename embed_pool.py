@@ -0,0 +1,63 @@
+# embed_pool.py - Process pool for batched passage embedding
+#
+# kb_ingest.py hands batches of passage texts to an EmbedPool and gets futures of
+# float32 vectors back. With workers > 1 every worker process loads its own
+# encoder once (EMBED_BACKEND, see embedder_backends.py) and runs with
+# cpu_count // workers intra-op threads, so N workers use the cores without
+# oversubscribing them; with workers <= 1 batches are encoded in-process with
+# the shared get_embedder() instance.
+#
+# Kept free of heavy imports: spawned workers import only this module and the
+# encoder backend, not data_analyze.
+
+import os
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+KB_EMBED_WORKERS = int(os.getenv("KB_EMBED_WORKERS", "1"))
+
+_embedder = None
+
+def _init_worker(model_name: str, threads: int):
+    global _embedder
+    import embedder_backends
+    embedder_backends.EMBED_THREADS = threads
+    if embedder_backends.EMBED_BACKEND == "torch":
+        import torch
+        torch.set_num_threads(threads)
+    _embedder = embedder_backends.load_embedder(model_name)
+
+def _encode(texts: List[str], batch_size: int) -> np.ndarray:
+    return np.asarray(_embedder.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+
+class EmbedPool:
+    """encode() returns a Future of the (len(texts), dim) float32 matrix."""
+
+    def __init__(self, model_name: str, workers: int = None, threads: Optional[int] = None):
+        self.workers = max(1, KB_EMBED_WORKERS if workers is None else workers)
+        self._pool = None
+        if self.workers > 1:
+            threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+            # spawn, not fork: the parent may already run torch/FAISS threads.
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(model_name, threads))
+
+    def encode(self, texts: List[str], batch_size: int) -> Future:
+        if self._pool is not None:
+            return self._pool.submit(_encode, texts, batch_size)
+        from data_analyze import get_embedder
+        future = Future()
+        try:
+            future.set_result(np.asarray(get_embedder().encode(texts, batch_size=batch_size, convert_to_numpy=True),
+                                         dtype=np.float32))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, cancel: bool = False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=not cancel, cancel_futures=cancel)
+            self._pool = None
@@ -0,0 +1,214 @@
+# embedder_backends.py - Interchangeable inference backends for the MiniLM embedder
+#
+# EMBED_BACKEND selects how get_embedder() (data_analyze.py) runs the sentence
+# encoder:
+#   torch      SentenceTransformer on PyTorch (the original path)
+#   onnx       ONNX Runtime with the fp32 export of the same model, tokenized by
+#              the Rust fast tokenizer; torch and sentence-transformers are never
+#              imported, which keeps startup time and RSS down
+#   onnx-int8  the same with dynamically quantized int8 weights (~4x smaller,
+#              faster on CPU, cosine agreement with fp32 around 0.99)
+# Every backend exposes the SentenceTransformer encode() arguments the code base
+# uses (batch_size, convert_to_numpy, normalize_embeddings). torch and onnx
+# produce the same vectors; onnx-int8 vectors are slightly different, so the
+# backend is recorded in the KB manifest and kb_store.validate_manifest()
+# refuses to query an fp32 index with int8 vectors or the other way round.
+#
+# ONNX files come from the model repo on the Hugging Face hub (onnx/model.onnx
+# and the pre-quantized variant for this CPU); when the repo has none they are
+# exported with torch and quantized locally into EMBED_ONNX_DIR.
+#
+#   python embedder_backends.py prepare --backend onnx-int8   # download/convert ahead of time
+
+import os
+import json
+import platform
+import argparse
+import numpy as np
+from typing import Any, Dict, List, Optional, Union
+
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()  # torch | onnx | onnx-int8
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", os.path.join(".cache", "onnx"))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))  # ONNX Runtime intra-op threads; 0 = one per core
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+_CONFIG_FILES = ["tokenizer.json", "config.json", "modules.json", "sentence_bert_config.json", "1_Pooling/config.json"]
+
+def vector_space(backend: str) -> str:
+    """Backends whose vectors can be mixed in one index share a vector space."""
+    return "int8" if backend.endswith("-int8") else "fp32"
+
+def _repo_id(model_name: str) -> str:
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+def _quantized_variant() -> str:
+    """The pre-quantized ONNX file the sentence-transformers repos ship for this CPU."""
+    machine = platform.machine().lower()
+    if machine in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+# -------------------------
+# Model files
+# -------------------------
+def _export_onnx(model_dir: str, out_path: str):
+    """Exports the transformer to ONNX with torch (only needed when the hub repo has no ONNX file)."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    model = AutoModel.from_pretrained(model_dir).eval()
+    sample = AutoTokenizer.from_pretrained(model_dir)(["warm-up"], return_tensors="pt")
+    # Positional inputs in forward() order (the tokenizer returns token_type_ids before attention_mask).
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[n] for n in names), out_path, input_names=names,
+                          output_names=["last_hidden_state"], dynamic_axes=axes, opset_version=17)
+
+def _quantize(fp32_path: str, out_path: str):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    quantize_dynamic(fp32_path, out_path, weight_type=QuantType.QInt8)
+
+def prepare_model(model_name: str, backend: str) -> Dict[str, str]:
+    """
+    Downloads (or reuses from the hub cache) the tokenizer/config files and the
+    ONNX graph for `backend`; returns {"dir", "onnx"}. Works offline once cached.
+    `model_name` may also be a local sentence-transformers model directory.
+    """
+    local = os.path.isdir(model_name)
+    if local:
+        repo = model_dir = os.path.abspath(model_name)
+    else:
+        from huggingface_hub import snapshot_download
+        repo = _repo_id(model_name)
+        model_dir = snapshot_download(repo, allow_patterns=_CONFIG_FILES + ["onnx/model.onnx", _quantized_variant()])
+    out_dir = os.path.join(EMBED_ONNX_DIR, repo.strip("/").replace("/", "__"))
+    fp32 = os.path.join(model_dir, "onnx", "model.onnx")
+    if not os.path.exists(fp32):
+        fp32 = os.path.join(out_dir, "model.onnx")
+        if not os.path.exists(fp32):
+            print(f"Exporting {repo} to ONNX (no ONNX file in the model repo)...")
+            _export_onnx(model_dir if local else snapshot_download(repo), fp32)
+    if backend != "onnx-int8":
+        return {"dir": model_dir, "onnx": fp32}
+    shipped = os.path.join(model_dir, *_quantized_variant().split("/"))
+    if os.path.exists(shipped):
+        return {"dir": model_dir, "onnx": shipped}
+    int8 = os.path.join(out_dir, "model_int8.onnx")
+    if not os.path.exists(int8):
+        print(f"Quantizing {os.path.basename(fp32)} to int8...")
+        _quantize(fp32, int8)
+    return {"dir": model_dir, "onnx": int8}
+
+# -------------------------
+# ONNX Runtime embedder
+# -------------------------
+def _read_json(path: str, default: Any) -> Any:
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class OnnxEmbedder:
+    """Sentence encoder on ONNX Runtime: fast tokenizer, transformer graph, pooling and optional L2 norm."""
+
+    def __init__(self, model_name: str, backend: str = "onnx", threads: int = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        files = prepare_model(model_name, backend)
+        self.backend = backend
+        self.model_path = files["onnx"]
+        st_config = _read_json(os.path.join(files["dir"], "sentence_bert_config.json"), {})
+        pooling = _read_json(os.path.join(files["dir"], "1_Pooling", "config.json"), {})
+        modules = _read_json(os.path.join(files["dir"], "modules.json"), [])
+        self.max_seq_length = int(st_config.get("max_seq_length", 256))
+        self.cls_pooling = bool(pooling.get("pooling_mode_cls_token")) and not pooling.get("pooling_mode_mean_tokens")
+        # all-MiniLM-L6-v2 ends in a Normalize module, so its SentenceTransformer output is unit length.
+        self.normalize = any(m.get("type", "").endswith("Normalize") for m in modules)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(files["dir"], "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.no_padding()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = EMBED_THREADS if threads is None else threads
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(self.model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def get_sentence_embedding_dimension(self) -> Optional[int]:
+        return self.dim if isinstance(self.dim, int) else None
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        width = max(len(e.ids) for e in encodings)
+        ids = np.zeros((len(texts), width), dtype=np.int64)
+        mask = np.zeros((len(texts), width), dtype=np.int64)
+        types = np.zeros((len(texts), width), dtype=np.int64)
+        for row, e in enumerate(encodings):
+            n = len(e.ids)
+            ids[row, :n], mask[row, :n], types[row, :n] = e.ids, e.attention_mask, e.type_ids
+        feeds = {"input_ids": ids, "attention_mask": mask, "token_type_ids": types}
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        if self.cls_pooling:
+            return hidden[:, 0]
+        weights = mask[..., None].astype(hidden.dtype)
+        return (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = None, **kwargs) -> np.ndarray:
+        """SentenceTransformer.encode() equivalent: float32 vectors in input order."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension() or 0), dtype=np.float32)
+        # Longest first, so each batch is padded to similar lengths (as sentence-transformers does).
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        out = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            vecs = self._encode_batch([texts[i] for i in idx])
+            if out.shape[1] == 0:
+                out = np.empty((len(texts), vecs.shape[1]), dtype=np.float32)
+            out[idx] = vecs
+        if self.normalize or normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+# -------------------------
+# Selection
+# -------------------------
+def load_embedder(model_name: str, backend: str = None):
+    """The encoder for `backend` (default EMBED_BACKEND); raises when that backend cannot be loaded."""
+    backend = (backend or EMBED_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBED_BACKEND '{backend}' (expected one of {', '.join(BACKENDS)})")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        embedder = SentenceTransformer(model_name)
+        embedder.backend = "torch"
+        return embedder
+    try:
+        return OnnxEmbedder(model_name, backend)
+    except ImportError as e:
+        raise RuntimeError(f"EMBED_BACKEND={backend} needs onnxruntime and tokenizers ({e}); "
+                           "pip install onnxruntime tokenizers, or set EMBED_BACKEND=torch.") from e
+
+def main(argv=None):
+    from data_analyze import EMBED_MODEL_NAME
+    parser = argparse.ArgumentParser(description="MiniLM embedder backends")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    prep = sub.add_parser("prepare", help="download/convert the ONNX model so later runs work offline")
+    prep.add_argument("--backend", default=EMBED_BACKEND if EMBED_BACKEND != "torch" else "onnx-int8",
+                      choices=[b for b in BACKENDS if b != "torch"])
+    prep.add_argument("--model", default=EMBED_MODEL_NAME)
+    args = parser.parse_args(argv)
+    files = prepare_model(args.model, args.backend)
+    print(f"✅ {args.backend}: {files['onnx']} ({os.path.getsize(files['onnx']) / 2**20:.1f} MB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+# fda_mirror.py - Offline OpenFDA drug-label mirror (SQLite)
+#
+# Ingests the OpenFDA bulk drug-label download (https://open.fda.gov/apis/downloads/)
+# into one compact SQLite file that keeps only what get_openfda_warnings() returns,
+# plus indexed brand / generic / substance names. A lookup is a single indexed
+# query, so openfda_client consults the mirror first and goes to the live API
+# only when the mirror has no label for a name. Like the live search (which is
+# tokenized: openfda.generic_name:metformin finds "METFORMIN HYDROCHLORIDE",
+# "ferrous sulfate" finds "FERROUS SULFATE HEPTAHYDRATE"), a name also matches
+# the word runs of longer names; exact names win, then the shortest name
+# containing the words.
+#
+#   python fda_mirror.py refresh                 # download changed partitions only
+#   python fda_mirror.py ingest drug-label-0001-of-0013.json.zip ...   # local files
+#   python fda_mirror.py lookup metformin
+#   python fda_mirror.py info
+#
+# Bulk files are parsed as a stream, one label at a time, so a 1+ GB partition
+# never has to be held in memory.
+
+import os
+import re
+import io
+import sys
+import json
+import time
+import sqlite3
+import zipfile
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Empty string disables the mirror.
+OPENFDA_MIRROR_PATH = os.getenv("OPENFDA_MIRROR_PATH", "openfda_mirror.sqlite")
+OPENFDA_DOWNLOAD_INDEX = os.getenv("OPENFDA_DOWNLOAD_INDEX", "https://api.fda.gov/download.json")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    set_id TEXT PRIMARY KEY,
+    label_id TEXT,
+    effective_time TEXT,
+    brand TEXT,
+    generic TEXT,
+    warnings TEXT,
+    source TEXT,
+    seen_gen INTEGER
+);
+CREATE TABLE IF NOT EXISTS names (
+    name TEXT NOT NULL,
+    kind INTEGER NOT NULL,      -- 0 brand, 1 generic, 2 substance (same order the live lookup tries);
+                                -- 3-5 the same for word runs of longer names (see _name_phrases)
+    set_id TEXT NOT NULL,
+    PRIMARY KEY (name, kind, set_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS names_set_id ON names (set_id);
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    n_labels INTEGER,
+    gen INTEGER,
+    ingested_at REAL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_NAME_FIELDS = (("brand_name", 0), ("generic_name", 1), ("substance_name", 2))
+PHRASE_KIND = 3  # added to the kind of the name a word run comes from
+PHRASE_MAX_WORDS = 4
+_WORD = re.compile(r"[a-z0-9]+")
+_PHRASE_STOPWORDS = {"and", "with", "for", "the", "usp"}
+
+def normalize_drug_name(drug_name: str) -> str:
+    return " ".join(drug_name.lower().split())
+
+def _phrase(name: str) -> str:
+    return " ".join(_WORD.findall(name))
+
+def _name_phrases(name: str) -> List[str]:
+    """
+    Word runs of a longer name that a lookup should find, as the live phrase
+    search would ("ferrous sulfate heptahydrate" -> ferrous, ferrous sulfate, ...).
+    """
+    words = _WORD.findall(name)
+    phrases = set()
+    for n in range(1, min(len(words) - 1, PHRASE_MAX_WORDS) + 1):
+        for i in range(len(words) - n + 1):
+            run = words[i:i + n]
+            if run[0] in _PHRASE_STOPWORDS or run[-1] in _PHRASE_STOPWORDS:
+                continue
+            if n == 1 and (len(run[0]) < 3 or run[0].isdigit()):
+                continue
+            phrases.add(" ".join(run))
+    phrases.discard(_phrase(name))
+    return sorted(phrases)
+
+# -------------------------
+# Streaming bulk-file parser
+# -------------------------
+_SKIP = re.compile(r"[\s,]*")
+
+def iter_label_records(fp, chunk_size: int = 1 << 20) -> Iterator[Dict]:
+    """
+    Yields the entries of the top-level "results" array of an OpenFDA JSON file
+    (bulk partition or API response) without loading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf, pos = buf[pos:] + chunk, 0
+
+    def decode():
+        nonlocal pos
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                pos = end
+                return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+
+    def expect(chars: str) -> str:
+        nonlocal pos
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            if pos < len(buf):
+                if buf[pos] not in chars:
+                    raise ValueError(f"Unexpected {buf[pos]!r} in OpenFDA file (wanted {chars!r})")
+                pos += 1
+                return buf[pos - 1]
+            if eof:
+                raise ValueError("Truncated OpenFDA file")
+            fill()
+
+    expect("{")
+    while True:
+        if expect('"}') == "}":
+            return
+        pos -= 1
+        key = decode()
+        expect(":")
+        if key != "results":
+            decode()  # "meta" and anything else: small, skip
+            continue
+        expect("[")
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            while pos >= len(buf) and not eof:
+                fill()
+                pos = _SKIP.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == "]":
+                pos += 1
+                break
+            yield decode()
+
+def _open_json(path: str) -> Iterator[io.TextIOBase]:
+    """Opens a .json file, or every .json member of a .json.zip, as text streams."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            for member in zf.namelist():
+                if member.endswith(".json"):
+                    with zf.open(member) as raw:
+                        yield io.TextIOWrapper(raw, encoding="utf-8")
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield f
+
+def compact_label(record: Dict) -> Optional[Dict]:
+    """Reduces one OpenFDA label to the fields the mirror stores (None if it has no names)."""
+    openfda = record.get("openfda") or {}
+    names = []
+    for field, kind in _NAME_FIELDS:
+        for name in openfda.get(field) or []:
+            norm = normalize_drug_name(name)
+            if norm:
+                names.append((norm, kind))
+                names.extend((phrase, kind + PHRASE_KIND) for phrase in _name_phrases(norm))
+    set_id = record.get("set_id") or record.get("id")
+    if not names or not set_id:
+        return None  # the live API searches openfda.* fields, so such labels are unreachable anyway
+    warnings = record.get("warnings")
+    return {
+        "set_id": set_id,
+        "label_id": record.get("id"),
+        "effective_time": record.get("effective_time") or "",
+        "brand": (openfda.get("brand_name") or ["N/A"])[0],
+        "generic": (openfda.get("generic_name") or ["N/A"])[0],
+        "warnings": warnings[0] if warnings else None,
+        "names": sorted(set(names)),
+    }
+
+# -------------------------
+# Store
+# -------------------------
+class FdaMirror:
+    """
+    SQLite mirror of OpenFDA drug labels. Lookups use one read connection per
+    thread, so get_openfda_warnings_many() can query it concurrently.
+    """
+
+    def __init__(self, path: str = OPENFDA_MIRROR_PATH, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        if not readonly:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = self._conn()
+            conn.executescript(_SCHEMA)
+            conn.commit()
+            self._index_name_phrases()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+                conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _index_name_phrases(self):
+        """Adds the word-run rows to a mirror built before they existed (no re-download needed)."""
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'name_phrases'").fetchone():
+            return
+        rows = conn.execute("SELECT name, kind, set_id FROM names WHERE kind < ?", (PHRASE_KIND,)).fetchall()
+        conn.executemany("INSERT OR IGNORE INTO names (name, kind, set_id) VALUES (?, ?, ?)",
+                         [(phrase, kind + PHRASE_KIND, set_id) for name, kind, set_id in rows
+                          for phrase in _name_phrases(name)])
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('name_phrases', '1')")
+        conn.commit()
+
+    def lookup(self, drug_name: str) -> Optional[Dict]:
+        """
+        Brand match first, then generic, then substance, then the same for a word
+        run of a longer name (shortest name first); prefers labels with warnings, then the newest.
+        """
+        name = normalize_drug_name(drug_name)
+        row = self._conn().execute(
+            "SELECT l.brand, l.generic, l.warnings FROM names n JOIN labels l ON l.set_id = n.set_id "
+            f"WHERE (n.name = ? AND n.kind < {PHRASE_KIND}) OR (n.name = ? AND n.kind >= {PHRASE_KIND}) "
+            f"ORDER BY n.kind, CASE WHEN n.kind < {PHRASE_KIND} THEN 0 WHEN n.kind = {PHRASE_KIND} "
+            "THEN LENGTH(l.brand) ELSE LENGTH(l.generic) END, l.warnings IS NULL, l.effective_time DESC LIMIT 1",
+            (name, _phrase(name)),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "drug_name": drug_name,
+            "brand": row[0],
+            "generic": row[1],
+            "warnings": row[2] if row[2] is not None else "No warnings available",
+            "found": True,
+        }
+
+    def drug_names(self, kinds=(0, 1, 2), max_words: int = 4) -> List[str]:
+        """Distinct normalized names of the given kinds (used to extend the drug lexicon)."""
+        marks = ",".join("?" * len(kinds))
+        rows = self._conn().execute(f"SELECT DISTINCT name FROM names WHERE kind IN ({marks})", tuple(kinds))
+        return [r[0] for r in rows if len(r[0].split()) <= max_words]
+
+    def source_fingerprint(self, source: str) -> Optional[str]:
+        row = self._conn().execute("SELECT fingerprint FROM sources WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def ingest_records(self, records: Iterable[Dict], source: str, fingerprint: str = "",
+                       batch_size: int = 2000) -> Dict[str, int]:
+        """
+        Upserts labels from one source (bulk partition or file). Labels whose
+        label id is unchanged are only touched, not rewritten; labels that were in
+        an earlier version of this source but are gone now are removed.
+        """
+        conn = self._conn()
+        gen = conn.execute("SELECT COALESCE(MAX(gen), 0) + 1 FROM sources").fetchone()[0]
+        stats = {"seen": 0, "added": 0, "updated": 0, "unchanged": 0, "skipped": 0, "removed": 0}
+
+        def flush(batch: List[Dict]):
+            for label in batch:
+                row = conn.execute("SELECT label_id, effective_time FROM labels WHERE set_id = ?",
+                                   (label["set_id"],)).fetchone()
+                if row is not None and (row[0] == label["label_id"] or row[1] > label["effective_time"]):
+                    conn.execute("UPDATE labels SET seen_gen = ?, source = ? WHERE set_id = ?",
+                                 (gen, source, label["set_id"]))
+                    stats["unchanged"] += 1
+                    continue
+                stats["updated" if row is not None else "added"] += 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO labels (set_id, label_id, effective_time, brand, generic, warnings, "
+                    "source, seen_gen) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (label["set_id"], label["label_id"], label["effective_time"], label["brand"],
+                     label["generic"], label["warnings"], source, gen),
+                )
+                conn.execute("DELETE FROM names WHERE set_id = ?", (label["set_id"],))
+                conn.executemany("INSERT OR IGNORE INTO names (name, kind, set_id) VALUES (?, ?, ?)",
+                                 [(name, kind, label["set_id"]) for name, kind in label["names"]])
+            conn.commit()
+
+        batch = []
+        for record in records:
+            stats["seen"] += 1
+            label = compact_label(record)
+            if label is None:
+                stats["skipped"] += 1
+                continue
+            batch.append(label)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        flush(batch)
+
+        stale = [r[0] for r in conn.execute("SELECT set_id FROM labels WHERE source = ? AND seen_gen < ?",
+                                            (source, gen))]
+        for set_id in stale:
+            conn.execute("DELETE FROM names WHERE set_id = ?", (set_id,))
+            conn.execute("DELETE FROM labels WHERE set_id = ?", (set_id,))
+        stats["removed"] = len(stale)
+        conn.execute(
+            "INSERT OR REPLACE INTO sources (source, fingerprint, n_labels, gen, ingested_at) VALUES (?, ?, ?, ?, ?)",
+            (source, fingerprint, stats["seen"] - stats["skipped"], gen, time.time()),
+        )
+        conn.commit()
+        return stats
+
+    def ingest_file(self, path: str, source: str = None, fingerprint: str = "") -> Dict[str, int]:
+        source = source or os.path.basename(path)
+        fingerprint = fingerprint or f"{os.path.getsize(path)}:{int(os.path.getmtime(path))}"
+        if fingerprint == self.source_fingerprint(source):
+            return {"seen": 0, "unchanged_source": 1}
+        records = (r for stream in _open_json(path) for r in iter_label_records(stream))
+        return self.ingest_records(records, source, fingerprint)
+
+    def set_meta(self, key: str, value: str):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        conn.commit()
+
+    def info(self) -> Dict:
+        conn = self._conn()
+        return {
+            "path": self.path,
+            "labels": conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0],
+            "names": conn.execute("SELECT COUNT(*) FROM names").fetchone()[0],
+            "sources": conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0],
+            "size_mb": round(os.path.getsize(self.path) / 2**20, 1) if os.path.exists(self.path) else 0,
+            "meta": dict(conn.execute("SELECT key, value FROM meta").fetchall()),
+        }
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+# -------------------------
+# Reader used by openfda_client
+# -------------------------
+_reader: Optional[FdaMirror] = None
+_reader_lock = threading.Lock()
+
+def get_mirror() -> Optional[FdaMirror]:
+    """Shared read-only mirror, or None when OPENFDA_MIRROR_PATH is unset or not built yet."""
+    global _reader
+    if _reader is None and OPENFDA_MIRROR_PATH and os.path.exists(OPENFDA_MIRROR_PATH):
+        with _reader_lock:
+            if _reader is None:
+                _reader = FdaMirror(OPENFDA_MIRROR_PATH, readonly=True)
+    return _reader
+
+def lookup(drug_name: str) -> Optional[Dict]:
+    mirror = get_mirror()
+    if mirror is None:
+        return None
+    try:
+        return mirror.lookup(drug_name)
+    except sqlite3.Error as e:  # mirror mid-rebuild or damaged: behave as a miss
+        print(f"WARNING: OpenFDA mirror lookup failed ({e}); using live API.")
+        return None
+
+# -------------------------
+# Incremental refresh from the bulk download
+# -------------------------
+def list_label_partitions(session=None) -> List[Dict]:
+    from openfda_client import get_session
+    session = session or get_session()
+    resp = session.get(OPENFDA_DOWNLOAD_INDEX, timeout=60)
+    resp.raise_for_status()
+    label = resp.json()["results"]["drug"]["label"]
+    return [{**p, "export_date": label.get("export_date", "")} for p in label["partitions"]]
+
+def _partition_fingerprint(session, partition: Dict) -> str:
+    """ETag of the partition file when the server gives one, else its advertised size/record count."""
+    try:
+        head = session.head(partition["file"], timeout=30, allow_redirects=True)
+        etag = head.headers.get("ETag")
+        if head.ok and etag:
+            return etag.strip('"')
+    except Exception:
+        pass
+    return f"{partition.get('size_mb')}:{partition.get('records')}"
+
+def refresh(mirror: FdaMirror = None, partitions: List[Dict] = None) -> Dict[str, int]:
+    """Downloads and ingests only the bulk partitions whose fingerprint changed."""
+    from openfda_client import get_session
+    session = get_session()
+    mirror = mirror or FdaMirror(OPENFDA_MIRROR_PATH)
+    partitions = partitions if partitions is not None else list_label_partitions(session)
+    totals = {"partitions": len(partitions), "downloaded": 0, "added": 0, "updated": 0, "removed": 0}
+
+    for part in partitions:
+        source = part["file"].rsplit("/", 1)[-1]
+        fingerprint = _partition_fingerprint(session, part)
+        if fingerprint == mirror.source_fingerprint(source):
+            print(f"✅ {source}: unchanged")
+            continue
+        t0 = time.time()
+        with tempfile.NamedTemporaryFile(suffix=".json.zip", delete=False) as tmp:
+            try:
+                with session.get(part["file"], stream=True, timeout=300) as resp:
+                    resp.raise_for_status()
+                    for block in resp.iter_content(chunk_size=1 << 20):
+                        tmp.write(block)
+                tmp.close()
+                stats = mirror.ingest_file(tmp.name, source=source, fingerprint=fingerprint)
+            finally:
+                tmp.close()
+                os.remove(tmp.name)
+        totals["downloaded"] += 1
+        for k in ("added", "updated", "removed"):
+            totals[k] += stats.get(k, 0)
+        print(f"✅ {source}: +{stats['added']} ~{stats['updated']} -{stats['removed']} ({time.time() - t0:.0f}s)")
+
+    if partitions:
+        mirror.set_meta("export_date", partitions[0].get("export_date", ""))
+    mirror.set_meta("refreshed_at", time.strftime("%Y-%m-%dT%H:%M:%S"))
+    return totals
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Offline OpenFDA drug-label mirror")
+    ap.add_argument("--db", default=OPENFDA_MIRROR_PATH or "openfda_mirror.sqlite")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("refresh", help="download changed bulk partitions from open.fda.gov")
+    p_ingest = sub.add_parser("ingest", help="ingest local bulk files (.json or .json.zip)")
+    p_ingest.add_argument("files", nargs="+")
+    p_lookup = sub.add_parser("lookup", help="look up drug names in the mirror")
+    p_lookup.add_argument("names", nargs="+")
+    sub.add_parser("info", help="show mirror statistics")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "lookup":
+        mirror = FdaMirror(args.db, readonly=True)
+        for name in args.names:
+            t0 = time.perf_counter()
+            result = mirror.lookup(name)
+            print(f"{name} ({(time.perf_counter() - t0) * 1000:.2f} ms): {json.dumps(result, indent=2) if result else 'not in mirror'}")
+        return
+    mirror = FdaMirror(args.db)
+    if args.cmd == "refresh":
+        print(refresh(mirror))
+    elif args.cmd == "ingest":
+        for path in args.files:
+            print(f"{path}: {mirror.ingest_file(path)}")
+        mirror.set_meta("refreshed_at", time.strftime("%Y-%m-%dT%H:%M:%S"))
+    print(json.dumps(mirror.info(), indent=2))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,362 @@
+# icd_index.py - Local ICD-10 catalogue backing the ICD mapping stage
+#
+# Maps the findings of a document report to candidate ICD-10-CM codes without an
+# LLM call. The catalogue (data/icd10_subset.tsv, or the CMS code table via
+# ICD10_PATH) is indexed three ways:
+#   - exact and prefix code lookup over the sorted, dot-less codes, for codes the
+#     document analyzer already wrote ("type 2 diabetes (E11.9)")
+#   - a word-set synonym matcher: a synonym matches a finding line when all of
+#     its words occur in the line ("glucose high" matches "Glucose: 155 mg/dL
+#     (70-110) HIGH"), after mapping elevated/raised -> high, haem -> hem, ...
+#   - a MiniLM embedding index over "description (synonyms)", searched for the
+#     lines the matcher could not code confidently; the matrix is cached in
+#     .cache/ keyed on the catalogue contents
+# match() returns up to ICD_TOP_K scored candidates per finding line. Scores are
+# 1.0 for an exact code, 0.95/0.9 for multi-word synonyms, 0.9 for specific and
+# 0.6 for vague single words ("pain", "mass"), the cosine similarity for
+# embedding hits, and at most 0.5 for a negated match. Negation is scoped the
+# NegEx way: a trigger ("no", "denies", "negative for") covers up to
+# ICD_NEGATION_WINDOW words after it and a postfix trigger ("negative",
+# "non-reactive", "not detected") as many before it, never past the end of the
+# clause (, ; . but however ...). So in "History of heart failure; denies
+# smoking" only smoking is negated, and in "Hepatitis B surface antigen
+# negative" the hepatitis B match is. A finding is resolved when its best score
+# reaches ICD_CONFIDENT_SCORE and nothing in it is negated; see
+# agents/medical_context_agent.py for how resolved and unresolved findings are used.
+
+import os
+import re
+import bisect
+import hashlib
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+ICD10_PATH = os.getenv("ICD10_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "icd10_subset.tsv"))
+ICD_TOP_K = int(os.getenv("ICD_TOP_K", "5"))
+ICD_MIN_SCORE = float(os.getenv("ICD_MIN_SCORE", "0.45"))  # embedding hits below this are dropped
+ICD_CONFIDENT_SCORE = float(os.getenv("ICD_CONFIDENT_SCORE", "0.9"))
+ICD_MAX_FINDINGS = int(os.getenv("ICD_MAX_FINDINGS", "40"))
+ICD_EMBED = os.getenv("ICD_EMBED", "1") == "1"
+ICD_EMBED_CACHE_DIR = os.getenv("ICD_EMBED_CACHE_DIR", ".cache")
+ICD_NEGATION_WINDOW = int(os.getenv("ICD_NEGATION_WINDOW", "5"))  # words a negation trigger reaches
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_CODE = re.compile(r"\b([A-Z]\d{2}(?:\.[0-9A-Z]{1,4})?)\b")
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+# Negation triggers by direction: "pre" negates the words after it, "post" the words before it.
+# "pseudo" phrases contain a trigger word but negate nothing ("no change", "gram negative").
+_NEG_TRIGGERS = {
+    "pre": ("no", "not", "without", "negative for", "denies", "denied", "deny", "absence of", "free of", "never",
+            "no evidence of", "no signs of"),
+    "post": ("negative", "non reactive", "nonreactive", "not detected", "not seen", "not found", "excluded",
+             "within normal limits", "unremarkable"),
+    "both": ("ruled out", "rules out", "absent", "resolved"),
+    "pseudo": ("no change", "no significant change", "not only", "gram negative", "no increase", "not certain"),
+}
+# Longest phrases first, so "not detected" wins over "not" and "negative for" over "negative".
+_NEG_LIST = sorted(((phrase, kind) for kind, phrases in _NEG_TRIGGERS.items() for phrase in phrases),
+                   key=lambda t: -len(t[0]))
+_NEGATION = re.compile(r"\b(?:" + "|".join("(" + r"[\s-]+".join(map(re.escape, phrase.split())) + ")"
+                                             for phrase, _ in _NEG_LIST) + r")\b", re.I)
+# Negation scope ends at punctuation between clauses and at these words.
+_CLAUSE_BREAK = re.compile(r"[;,:!?]|\.(?!\d)")
+_CLAUSE_WORDS = {"but", "however", "although", "though", "except", "yet", "whereas", "while"}
+# Words that carry no finding of their own (for deciding whether a line says more than what it negates).
+_FILLER = {"patient", "pt", "history", "hx", "evidence", "signs", "sign", "any", "is", "was", "are", "were", "has",
+           "had", "reports", "reported", "shows", "showed", "seen", "noted", "on", "at", "as", "a", "an", "by"}
+# Bullets that recommend rather than report ("Start metformin", "Encourage weight loss").
+_ADVICE = re.compile(r"^(?:start|begin|continue|consider|recommend|advise|encourage|recheck|repeat|monitor|"
+                     r"follow[- ]up|refer|schedule|stop|avoid|increase|reduce|titrate|prescribe|take)\b", re.I)
+# Unmatched lines with these words still report something abnormal.
+_ABNORMAL = re.compile(r"\b(?:high|low|abnormal|positive|elevated|decreased|raised|reduced|deficien\w*|"
+                       r"suggest\w*|consistent with|indicat\w*|diagnos\w*|impression|finding)\b", re.I)
+# Report headers that count rows rather than describe the patient (structured_labs.summarize).
+_SUMMARY = re.compile(r"^(?:Structured lab results from|All \d+ )")
+_BOILERPLATE = {"unspecified", "other", "not", "elsewhere", "classified", "specified", "of", "site", "initial",
+                "encounter", "without", "complications", "with", "for", "in", "the", "and", "or", "due", "to"}
+_NORMALIZE = {"elevated": "high", "raised": "high", "increased": "high", "hi": "high",
+              "decreased": "low", "reduced": "low", "lo": "low", "diminished": "low",
+              "haemoglobin": "hemoglobin", "anaemia": "anemia", "oedema": "edema", "diarrhoea": "diarrhea",
+              "leukaemia": "leukemia", "tumour": "tumor", "haematuria": "hematuria", "oesophageal": "esophageal",
+              "ischaemic": "ischemic", "dyspnoea": "dyspnea", "coeliac": "celiac", "haemorrhoids": "hemorrhoids"}
+# Single-word synonyms too broad to code a finding on their own.
+_VAGUE = {"pain", "infection", "mass", "tumor", "neoplasm", "cancer", "malignancy", "carcinoma", "injury", "trauma",
+          "fracture", "swelling", "edema", "allergy", "cold", "flu", "reflux", "weakness", "tired", "pale", "rash",
+          "fits", "diabetes", "diabetic", "arthritis", "hernia", "cough", "infiltrate", "consolidation"}
+
+def tokenize(text: str) -> List[str]:
+    return [_NORMALIZE.get(t, t) for t in _TOKEN.findall(text.lower())]
+
+def negation_scope(text: str) -> Tuple[List[str], set, set]:
+    """
+    (tokens of `text` as tokenize() returns them, indices of the tokens inside a
+    negation scope, indices of the trigger tokens themselves).
+    """
+    spans = [m.span() for m in _TOKEN.finditer(text.lower())]
+    tokens = [_NORMALIZE.get(text[a:b].lower(), text[a:b].lower()) for a, b in spans]
+    clause, clauses = 0, []
+    for i, (a, _) in enumerate(spans):
+        if i and (_CLAUSE_BREAK.search(text, spans[i - 1][1], a) or tokens[i] in _CLAUSE_WORDS):
+            clause += 1
+        clauses.append(clause)
+    scoped, triggers = set(), set()
+    for m in _NEGATION.finditer(text):
+        kind = _NEG_LIST[m.lastindex - 1][1]
+        inside = [i for i, (a, b) in enumerate(spans) if a >= m.start() and b <= m.end()]
+        if kind == "pseudo" or not inside:
+            continue
+        triggers.update(inside)
+        first, last = inside[0], inside[-1]
+        if kind in ("pre", "both"):
+            scoped.update(i for i in range(last + 1, min(last + 1 + ICD_NEGATION_WINDOW, len(tokens)))
+                          if clauses[i] == clauses[last])
+        if kind in ("post", "both"):
+            scoped.update(i for i in range(max(0, first - ICD_NEGATION_WINDOW), first) if clauses[i] == clauses[first])
+    return tokens, scoped - triggers, triggers
+
+def normalize_code(code: str) -> str:
+    return code.replace(".", "").strip().upper()
+
+def display_code(code: str) -> str:
+    code = normalize_code(code)
+    return code if len(code) <= 3 else f"{code[:3]}.{code[3:]}"
+
+def read_catalogue(path: str = ICD10_PATH) -> List[Tuple[str, str, List[str]]]:
+    """
+    (code, description, synonyms) rows from the bundled TSV (code TAB description
+    TAB synonyms) or the CMS icd10cm_codes_<year>.txt layout (code, spaces, description).
+    """
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            if "\t" in line:
+                code, description, synonyms = (line.split("\t") + ["", ""])[:3]
+            else:
+                code, _, description = line.strip().partition(" ")
+                synonyms = ""
+            rows.append((normalize_code(code), description.strip(),
+                         [" ".join(s.split()) for s in synonyms.split(",") if s.strip()]))
+    return rows
+
+class ICDIndex:
+    """Code lookup, synonym matcher and (optional) embedding search over one catalogue."""
+
+    def __init__(self, rows: List[Tuple[str, str, List[str]]], embed: bool = ICD_EMBED):
+        self.codes = sorted({code for code, _, _ in rows})
+        self.descriptions: Dict[str, str] = {}
+        self.synonyms: Dict[str, List[str]] = {}
+        for code, description, synonyms in rows:
+            self.descriptions.setdefault(code, description)
+            self.synonyms.setdefault(code, []).extend(synonyms)
+        # Synonym phrases as word sets; the core of each description counts as one more synonym.
+        self.phrases: List[Tuple[frozenset, str, str, float]] = []  # (words, code, text, score)
+        self.by_word: Dict[str, List[int]] = {}
+        for code in self.codes:
+            core = [w for w in tokenize(self.descriptions[code].split(",")[0]) if w not in _BOILERPLATE]
+            seen = set()
+            for text in self.synonyms[code] + ([" ".join(core)] if core else []):
+                words = frozenset(tokenize(text))
+                if not words or words in seen:
+                    continue
+                seen.add(words)
+                score = 0.95 if len(words) >= 3 else 0.9 if len(words) == 2 or next(iter(words)) not in _VAGUE else 0.6
+                for w in words:
+                    self.by_word.setdefault(w, []).append(len(self.phrases))
+                self.phrases.append((words, code, text, score))
+        self._embed = embed
+        self._embeddings: Optional[np.ndarray] = None
+        self._embed_lock = threading.Lock()
+        self.fingerprint = hashlib.sha1("\n".join(f"{c}\t{self.descriptions[c]}\t{','.join(self.synonyms[c])}"
+                                                  for c in self.codes).encode("utf-8")).hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.codes)
+
+    # -------------------------
+    # Code lookup
+    # -------------------------
+    def lookup(self, code: str) -> Optional[str]:
+        """Description of an exact code, or None."""
+        return self.descriptions.get(normalize_code(code))
+
+    def prefix(self, prefix: str, limit: int = 50) -> List[str]:
+        """Catalogue codes starting with `prefix` (dots ignored), in code order."""
+        prefix = normalize_code(prefix)
+        start = bisect.bisect_left(self.codes, prefix)
+        found = []
+        for code in self.codes[start:start + limit]:
+            if not code.startswith(prefix):
+                break
+            found.append(code)
+        return found
+
+    def _code_candidates(self, text: str) -> List[Dict]:
+        found = []
+        for raw in _CODE.findall(text):
+            code = normalize_code(raw)
+            if code in self.descriptions:
+                found.append(self._candidate(code, 1.0, "code"))
+            elif "." in raw:
+                # Written as a full code but missing from the catalogue (e.g. a subset build): let the LLM judge it.
+                found.append({"code": display_code(code), "description": "(not in the local catalogue)",
+                              "score": ICD_MIN_SCORE, "via": "code"})
+            else:
+                found.extend(self._candidate(c, 0.8, "code prefix") for c in self.prefix(code, ICD_TOP_K))
+        return found
+
+    # -------------------------
+    # Synonym matcher
+    # -------------------------
+    def _synonym_candidates(self, words: List[str]) -> List[Tuple[Dict, frozenset]]:
+        """(candidate, words of the matched phrase) pairs."""
+        present = set(words)
+        hits: Dict[int, int] = {}
+        for w in present:
+            for i in self.by_word.get(w, ()):
+                hits[i] = hits.get(i, 0) + 1
+        matched = [self.phrases[i] for i, n in hits.items() if n == len(self.phrases[i][0])]
+        # A phrase contained in a longer matched phrase of another code is the less specific reading
+        # ("neuropathy" inside "diabetic neuropathy").
+        matched = [m for m in matched if not any(m[0] < other[0] and m[1] != other[1] for other in matched)]
+        return [(self._candidate(code, score, f'"{text}"'), words) for words, code, text, score in matched]
+
+    # -------------------------
+    # Embedding index
+    # -------------------------
+    def embeddings(self) -> Optional[np.ndarray]:
+        """Normalized MiniLM vectors of the catalogue entries (None when the embedder is unavailable)."""
+        if not self._embed:
+            return None
+        if self._embeddings is None:
+            with self._embed_lock:
+                if self._embeddings is None and self._embed:
+                    self._embeddings = self._load_embeddings()
+        return self._embeddings
+
+    def _load_embeddings(self) -> Optional[np.ndarray]:
+        from data_analyze import EMBED_MODEL_NAME
+        from embedder_backends import EMBED_BACKEND
+        path = os.path.join(ICD_EMBED_CACHE_DIR, f"icd10_{self.fingerprint}_{EMBED_MODEL_NAME}_{EMBED_BACKEND}.npy")
+        if os.path.exists(path):
+            return np.load(path)
+        try:
+            from data_analyze import get_embedder
+            texts = [f"{self.descriptions[c]} ({', '.join(self.synonyms[c])})" if self.synonyms[c]
+                     else self.descriptions[c] for c in self.codes]
+            vecs = np.asarray(get_embedder().encode(texts, batch_size=64, normalize_embeddings=True), dtype=np.float32)
+        except Exception as e:
+            print(f"WARNING: ICD embedding index unavailable ({type(e).__name__}: {e}); using code and synonym matching only.")
+            self._embed = False
+            return None
+        os.makedirs(ICD_EMBED_CACHE_DIR, exist_ok=True)
+        np.save(path, vecs)
+        print(f"✅ ICD embedding index built: {len(self.codes)} codes")
+        return vecs
+
+    def _embedding_candidates(self, texts: List[str], top_k: int) -> List[List[Dict]]:
+        matrix = self.embeddings()
+        if matrix is None or not texts:
+            return [[] for _ in texts]
+        from data_analyze import get_embedder
+        queries = np.asarray(get_embedder().encode(texts, normalize_embeddings=True), dtype=np.float32)
+        scores = queries @ matrix.T
+        k = min(top_k, scores.shape[1])
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            results.append([self._candidate(self.codes[i], round(float(row[i]), 3), "embedding")
+                            for i in top[np.argsort(-row[top])] if row[i] >= ICD_MIN_SCORE])
+        return results
+
+    # -------------------------
+    # Matching
+    # -------------------------
+    def _candidate(self, code: str, score: float, via: str) -> Dict:
+        return {"code": display_code(code), "description": self.descriptions[code], "score": score, "via": via}
+
+    def match(self, findings: List[str], top_k: int = None) -> List[Dict]:
+        """
+        One {"finding", "candidates", "negated", "mixed", "resolved"} dict per finding
+        line: `negated` when part of the line is in a negation scope, `mixed` when
+        the line also says something outside it. Candidates are sorted by score
+        (best first), de-duplicated by code and carry their own "negated" flag.
+        """
+        top_k = top_k or ICD_TOP_K
+        results = []
+        for finding in findings:
+            tokens, scoped, triggers = negation_scope(finding)
+            # Words with at least one occurrence outside every negation scope.
+            affirmed = {t for i, t in enumerate(tokens) if i not in scoped and i not in triggers}
+            candidates = []
+            for c in self._code_candidates(finding):
+                candidates.append(dict(c, negated=normalize_code(c["code"])[:3].lower() not in affirmed))
+            for c, words in self._synonym_candidates(tokens):
+                candidates.append(dict(c, negated=not words <= affirmed))
+            candidates = [dict(c, score=min(c["score"], 0.5)) if c["negated"] else c for c in candidates]
+            mixed = bool(scoped) and any(t not in _BOILERPLATE and t not in _FILLER and not t.isdigit()
+                                         for t in affirmed)
+            results.append({"finding": finding, "candidates": candidates, "negated": bool(scoped), "mixed": mixed})
+        pending = [r for r in results if not r["candidates"] or max(c["score"] for c in r["candidates"]) < ICD_CONFIDENT_SCORE]
+        if pending and self._embed:
+            for r, extra in zip(pending, self._embedding_candidates([r["finding"] for r in pending], top_k)):
+                # The whole line embeds as one query, so its hits are only known to be affirmed when nothing is negated.
+                negated = r["negated"] and not r["mixed"]
+                r["candidates"].extend(dict(c, score=min(c["score"], 0.5) if negated else c["score"],
+                                            negated=negated) for c in extra)
+        for r in results:
+            best: Dict[str, Dict] = {}
+            for c in sorted(r["candidates"], key=lambda c: -c["score"]):
+                best.setdefault(c["code"], c)
+            r["candidates"] = list(best.values())[:top_k]
+            r["resolved"] = (bool(r["candidates"]) and r["candidates"][0]["score"] >= ICD_CONFIDENT_SCORE
+                             and not r["negated"])
+        return results
+
+def finding_lines(report: str, limit: int = None) -> List[str]:
+    """
+    The lines of a report that can carry a diagnosis: bullets and plain sentences,
+    without headings, markdown, recommendations and separators.
+    """
+    limit = limit or ICD_MAX_FINDINGS
+    lines = []
+    for line in report.splitlines():
+        if line.lstrip().startswith("#"):
+            continue
+        text = _BULLET.sub("", line).replace("**", "").replace("__", "").strip(" >|\t")
+        if len(text) < 4 or set(text) <= set("-=_*") or (text.endswith(":") and len(text) <= 60):
+            continue
+        if _ADVICE.match(text) or _SUMMARY.match(text):
+            continue
+        lines.append(text[:300])
+        if len(lines) >= limit:
+            break
+    return lines
+
+def is_abnormal(line: str) -> bool:
+    """Whether an uncoded finding line still reports something abnormal (and so needs the LLM)."""
+    _, scoped, _ = negation_scope(line)
+    if not scoped:
+        return bool(_ABNORMAL.search(line))
+    spans = [m.span() for m in _TOKEN.finditer(line.lower())]
+    return any(not any(spans[i][0] <= m.start() < spans[i][1] for i in scoped) for m in _ABNORMAL.finditer(line))
+
+def load_index(path: str = ICD10_PATH) -> ICDIndex:
+    index = ICDIndex(read_catalogue(path))
+    print(f"✅ ICD-10 catalogue loaded: {len(index)} codes, {len(index.phrases)} synonym phrases")
+    return index
+
+_index: Optional[ICDIndex] = None
+_lock = threading.Lock()
+
+def get_icd_index() -> ICDIndex:
+    """Process-wide ICD index, built on first use."""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = load_index()
+    return _index
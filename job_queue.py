@@ -0,0 +1,331 @@
+# job_queue.py - Persistent analysis job queue with a bounded worker pool
+#
+# The Streamlit handler used to run the whole pipeline inside the script thread:
+# a rerun or a closed tab threw the work away, and any number of analyses could
+# run at once. Now:
+#   - submit() stores the job in SQLite and returns its id immediately
+#   - JOB_WORKERS threads run jobs; each job's stage progress and partial stage
+#     text (streamed deltas, flushed every JOB_FLUSH_INTERVAL_S) are stored, so
+#     any UI session can poll status() and reattach to a running job
+#   - admission control: submit() raises AdmissionError when the queue holds
+#     JOB_MAX_QUEUED jobs or the user already has JOB_MAX_PER_USER active jobs
+#   - fairness: the next job goes to the user with the fewest running jobs (at
+#     most JOB_MAX_RUNNING_PER_USER each), then the one served least recently,
+#     so one user's burst of uploads cannot starve everybody else
+#   - jobs left "running" by a dead process are re-queued on start (up to
+#     JOB_MAX_ATTEMPTS) instead of being lost
+
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(".cache", "jobs.sqlite"))
+JOB_UPLOAD_DIR = os.getenv("JOB_UPLOAD_DIR", os.path.join(".cache", "uploads"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "50"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "3"))
+JOB_MAX_RUNNING_PER_USER = int(os.getenv("JOB_MAX_RUNNING_PER_USER", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_FLUSH_INTERVAL_S = float(os.getenv("JOB_FLUSH_INTERVAL_S", "0.3"))
+JOB_RETENTION_S = float(os.getenv("JOB_RETENTION_S", str(7 * 24 * 3600)))
+
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "failed", "cancelled")
+
+class AdmissionError(RuntimeError):
+    """The job was rejected because the queue or the user's quota is full."""
+
+def _default_runner(file_paths: List[str], user_note: str = None,
+                    cancel: threading.Event = None) -> Iterator[dict]:
+    from crew_orchestrator import stream_medical_crew
+    return stream_medical_crew(file_paths, user_note, cancel=cancel)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY, user TEXT NOT NULL, status TEXT NOT NULL,
+    created REAL, started REAL, finished REAL, attempts INTEGER DEFAULT 0,
+    file_paths TEXT, user_note TEXT, upload_dir TEXT,
+    current_label TEXT, report TEXT, error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user, status);
+CREATE TABLE IF NOT EXISTS job_stages (
+    job_id TEXT, stage TEXT, label TEXT, status TEXT, text TEXT, seconds REAL, updated REAL,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+
+# Next job: users with fewer running jobs first, then the user served least recently, then FIFO.
+_CLAIM_SQL = """
+SELECT q.id FROM jobs q
+WHERE q.status = 'queued'
+  AND (SELECT COUNT(*) FROM jobs r WHERE r.user = q.user AND r.status = 'running') < ?
+ORDER BY (SELECT COUNT(*) FROM jobs r WHERE r.user = q.user AND r.status = 'running'),
+         COALESCE((SELECT MAX(s.started) FROM jobs s WHERE s.user = q.user), 0),
+         q.created
+LIMIT 1
+"""
+
+class JobQueue:
+    def __init__(self, path: str = JOB_QUEUE_PATH, workers: int = JOB_WORKERS,
+                 runner: Callable[..., Iterator[dict]] = None, max_queued: int = JOB_MAX_QUEUED,
+                 max_per_user: int = JOB_MAX_PER_USER, max_running_per_user: int = JOB_MAX_RUNNING_PER_USER):
+        self.path = path
+        self.workers = max(1, workers)
+        self.runner = runner or _default_runner
+        self.max_queued, self.max_per_user = max_queued, max_per_user
+        self.max_running_per_user = max(1, max_running_per_user)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._wakeup = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._running: Dict[str, threading.Event] = {}  # job id -> cancel event handed to the runner
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._recover()
+
+    # -------------------------
+    # Storage helpers
+    # -------------------------
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cur
+
+    def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _recover(self):
+        """Re-queues jobs a previous process left running, and purges old finished jobs."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'failed', finished = ?, error = 'Interrupted too often' "
+                               "WHERE status = 'running' AND attempts >= ?", (now, JOB_MAX_ATTEMPTS))
+            requeued = self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+            old = [r["id"] for r in self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished < ?",
+                (now - JOB_RETENTION_S,))]
+            self._conn.executemany("DELETE FROM job_stages WHERE job_id = ?", [(i,) for i in old])
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in old])
+            self._conn.commit()
+        if requeued:
+            print(f"WARNING: re-queued {requeued} job(s) interrupted by a restart.")
+
+    # -------------------------
+    # Client API
+    # -------------------------
+    def submit(self, user: str, file_paths: List[str], user_note: str = None, upload_dir: str = None) -> str:
+        """
+        Queues an analysis and returns its job id. `upload_dir`, if given, holds the
+        job's files and is deleted when the job finishes. Raises AdmissionError.
+        """
+        with self._lock:
+            queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise AdmissionError(f"The analysis queue is full ({queued} jobs waiting). Please try again later.")
+            mine = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE user = ? AND status IN ('queued', 'running')",
+                                      (user,)).fetchone()[0]
+            if mine >= self.max_per_user:
+                raise AdmissionError(f"You already have {mine} analyses in progress (limit {self.max_per_user}).")
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, user, status, created, file_paths, user_note, upload_dir) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, user, time.time(), json.dumps(list(file_paths)), user_note, upload_dir),
+            )
+            self._conn.commit()
+            self._wakeup.notify()
+        self.start()
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job state with its stages ({stage: {label, status, text, seconds}}), or None if unknown."""
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["file_paths"] = json.loads(job["file_paths"] or "[]")
+        job["stages"] = {r["stage"]: {"label": r["label"], "status": r["status"], "text": r["text"] or "",
+                                      "seconds": r["seconds"]}
+                         for r in self._query("SELECT * FROM job_stages WHERE job_id = ?", (job_id,))}
+        if job["status"] == "queued":
+            job["position"] = 1 + self._query("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?",
+                                              (job["created"],))[0][0]
+        return job
+
+    def list_jobs(self, user: str = None, limit: int = 20) -> List[Dict[str, Any]]:
+        sql = "SELECT id, user, status, created, started, finished, current_label, error FROM jobs"
+        params: tuple = ()
+        if user is not None:
+            sql, params = sql + " WHERE user = ?", (user,)
+        return [dict(r) for r in self._query(sql + " ORDER BY created DESC LIMIT ?", params + (limit,))]
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a queued job, or stops a running one: its pipeline starts no
+        further stage and the worker is freed once the running stages have stopped.
+        """
+        with self._lock:
+            cur = self._conn.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                                     (time.time(), job_id))
+            self._conn.commit()
+            if cur.rowcount:
+                self._cleanup(job_id)
+                return True
+            if job_id in self._running:
+                self._running[job_id].set()
+                return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        counts = {r["status"]: r["n"] for r in self._query("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+        row = self._query("SELECT AVG(started - created), AVG(finished - started) FROM jobs "
+                          "WHERE status = 'done' AND finished > ?", (time.time() - 3600,))[0]
+        return {"counts": counts, "workers": self.workers, "avg_wait_s": row[0], "avg_run_s": row[1]}
+
+    # -------------------------
+    # Workers
+    # -------------------------
+    def start(self):
+        """Starts the worker threads (idempotent; submit() calls it)."""
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            self._stopping = False
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._worker, name=f"job-worker-{len(self._threads) + 1}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, wait: bool = True):
+        """Workers exit after their current job."""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        with self._lock:
+            row = self._conn.execute(_CLAIM_SQL, (self.max_running_per_user,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1 WHERE id = ?",
+                               (time.time(), row["id"]))
+            self._conn.commit()
+            return self._conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                job = None
+                while not self._stopping:
+                    job = self._claim()
+                    if job is not None:
+                        self._running[job["id"]] = threading.Event()
+                        break
+                    self._wakeup.wait(timeout=1.0)
+                if self._stopping and job is None:
+                    return
+            self._run(job)
+            with self._lock:
+                self._wakeup.notify_all()  # a per-user slot may have opened up
+
+    def _save_stage(self, job_id: str, stage: str, label: str, status: str, text: str, seconds: float = None):
+        self._execute(
+            "INSERT OR REPLACE INTO job_stages (job_id, stage, label, status, text, seconds, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", (job_id, stage, label, status, text, seconds, time.time()))
+
+    def _run(self, job: sqlite3.Row):
+        job_id = job["id"]
+        texts: Dict[str, str] = {}
+        labels: Dict[str, str] = {}
+        dirty: set = set()
+        last_flush = time.monotonic()
+        report, error, status = None, None, "done"
+        cancel = self._running[job_id]
+        events = None
+        print(f"📊 Job {job_id[:8]} started (user {job['user']}, attempt {job['attempts']})")
+        try:
+            events = self.runner(json.loads(job["file_paths"]), job["user_note"], cancel=cancel)
+            for event in events:
+                if cancel.is_set():
+                    break
+                kind, stage = event.get("type"), event.get("stage")
+                if kind == "stage_start":
+                    labels[stage], texts[stage] = event.get("label", stage), ""
+                    self._save_stage(job_id, stage, labels[stage], "running", "")
+                    self._execute("UPDATE jobs SET current_label = ? WHERE id = ?", (labels[stage], job_id))
+                elif kind == "delta":
+                    texts[stage] = texts.get(stage, "") + event["text"]
+                    dirty.add(stage)
+                elif kind == "stage_retry":
+                    texts[stage] = ""
+                    dirty.add(stage)
+                elif kind == "stage_complete":
+                    dirty.discard(stage)
+                    self._save_stage(job_id, stage, event.get("label", stage), "done" if event.get("ok") else "failed",
+                                     str(event.get("result")), event.get("seconds"))
+                elif kind == "report":
+                    report = event["text"]
+                if dirty and time.monotonic() - last_flush >= JOB_FLUSH_INTERVAL_S:
+                    for s in dirty:
+                        self._save_stage(job_id, s, labels.get(s, s), "running", texts[s])
+                    dirty.clear()
+                    last_flush = time.monotonic()
+        except Exception as e:
+            status, error = "failed", str(e)
+            print(f"❌ Job {job_id[:8]} failed: {e}")
+        finally:
+            # Closing the stream stops the pipeline and waits for its running stages,
+            # so a cancelled job keeps its worker slot until it no longer does any work.
+            close = getattr(events, "close", None)
+            if close is not None:
+                close()
+            with self._lock:
+                self._running.pop(job_id, None)
+        if cancel.is_set() and report is None:
+            status, error = "cancelled", None
+        elif status == "done" and report is None:
+            status, error = "failed", "The pipeline ended without a report."
+        self._execute("UPDATE jobs SET status = ?, finished = ?, report = ?, error = ?, current_label = NULL WHERE id = ?",
+                      (status, time.time(), report, error, job_id))
+        self._cleanup(job_id)
+        if status == "done":
+            print(f"✅ Job {job_id[:8]} finished in {time.time() - job['started']:.1f}s")
+
+    def _cleanup(self, job_id: str):
+        rows = self._query("SELECT upload_dir FROM jobs WHERE id = ?", (job_id,))
+        if rows and rows[0]["upload_dir"]:
+            shutil.rmtree(rows[0]["upload_dir"], ignore_errors=True)
+
+def new_upload_dir() -> str:
+    """A fresh directory for one job's uploaded files (removed when the job finishes)."""
+    path = os.path.join(JOB_UPLOAD_DIR, uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Process-wide queue; its workers start on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+                _queue.start()
+    return _queue
@@ -0,0 +1,89 @@
+# kb_batcher.py - Coalesces concurrent KB searches into batched encoder/FAISS calls
+#
+# When several pipeline runs hit the KB MCP server at once, each single-query
+# search used to pay for its own encoder forward pass and FAISS call, one after
+# the other. KBQueryBatcher.search() instead queues the query; a worker task
+# takes the first waiting query, collects more for up to KB_BATCH_WINDOW_MS (or
+# until KB_BATCH_MAX are waiting) and answers them with one
+# rag_lookup_kb_batch() call in a worker thread: one encoder call and one FAISS
+# search over the whole query matrix. The hits are fanned back out to the
+# waiting callers. Queries arriving while a batch runs are picked up by the next
+# one, so batches grow with load while a lone query waits at most one window.
+
+import os
+import asyncio
+import contextvars
+from typing import Any, Callable, Dict, List, Optional
+
+import tracing
+
+KB_BATCH_WINDOW_MS = float(os.getenv("KB_BATCH_WINDOW_MS", "2"))  # 0 disables coalescing (mcp_server_kb.py)
+KB_BATCH_MAX = int(os.getenv("KB_BATCH_MAX", "32"))
+
+Hits = List[Dict[str, Any]]
+
+class KBQueryBatcher:
+    """
+    Async front end for `search_batch(queries, top_k) -> hit lists` (by default
+    data_analyze.rag_lookup_kb_batch). Bound to the event loop it is first used on.
+    """
+
+    def __init__(self, search_batch: Callable[..., List[Hits]] = None, window_ms: float = None,
+                 max_batch: int = None):
+        if search_batch is None:
+            from data_analyze import rag_lookup_kb_batch as search_batch
+        self.search_batch = search_batch
+        self.window = (KB_BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000
+        self.max_batch = max(1, KB_BATCH_MAX if max_batch is None else max_batch)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.queries = 0
+
+    async def search(self, query: str, top_k: int = 4) -> Hits:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            # Empty context: batch spans must not become children of whichever request started the worker.
+            self._worker = contextvars.Context().run(asyncio.ensure_future, self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((query, top_k, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._dispatch(batch)
+
+    async def _dispatch(self, batch):
+        groups: Dict[int, list] = {}
+        for item in batch:
+            if not item[2].done():  # the caller may have been cancelled while waiting
+                groups.setdefault(item[1], []).append(item)
+        for top_k, items in groups.items():
+            queries = [q for q, _, _ in items]
+            try:
+                with tracing.span("kb.batch", queries=len(queries), top_k=top_k):
+                    results = await asyncio.to_thread(self.search_batch, queries, top_k=top_k)
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(queries)
+            for (_, _, future), hits in zip(items, results):
+                if not future.done():
+                    future.set_result(hits)
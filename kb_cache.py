@@ -0,0 +1,91 @@
+# kb_cache.py - Query-embedding and retrieval-result cache for the KB path
+#
+# Clinical queries repeat across patients ("type 2 diabetes management", ...),
+# so rag_lookup_kb_batch() consults this cache before running the MiniLM
+# encoder and the FAISS search:
+#   - query embeddings, keyed on the normalized query text
+#   - hit lists, keyed on normalized text + top_k + search knobs
+# Both live in one byte-bounded LRU. Every key carries the KB version (derived
+# from the store manifest), so ingesting new guidelines invalidates the cache
+# automatically. Set KB_CACHE_DISK to a file path to add a persistent SQLite
+# tier that lets a restarted KB server come up warm.
+
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+from cache_store import ByteLRUCache, SqliteCache
+
+KB_CACHE_MAX_BYTES = int(os.getenv("KB_CACHE_MAX_BYTES", str(64 * 2**20)))
+KB_CACHE_DISK = os.getenv("KB_CACHE_DISK", "")
+KB_CACHE_DISK_MAX_BYTES = int(os.getenv("KB_CACHE_DISK_MAX_BYTES", str(512 * 2**20)))
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def kb_version(manifest: Dict[str, Any]) -> str:
+    """Short fingerprint of everything in the manifest that changes search results."""
+    keys = ("format_version", "embed_model", "embed_backend", "index_params", "n_passages", "generation", "created_at",
+            "sources")
+    blob = json.dumps({k: manifest.get(k) for k in keys}, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+class KBQueryCache:
+    def __init__(self, max_bytes: int = KB_CACHE_MAX_BYTES, disk_path: str = KB_CACHE_DISK):
+        self.memory = ByteLRUCache(max_bytes)
+        self.disk = SqliteCache(disk_path, max_bytes=KB_CACHE_DISK_MAX_BYTES) if disk_path else None
+        self.version = None
+        self._lock = threading.Lock()
+        self.counters = {"embedding_hits": 0, "embedding_misses": 0, "result_hits": 0, "result_misses": 0}
+
+    def set_version(self, version: str):
+        """Drops in-memory entries when the KB changes (disk entries are keyed by version)."""
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self.memory.clear()
+                    self.version = version
+
+    def _get(self, key: str):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def _put(self, key: str, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def _count(self, name: str, hit: bool):
+        self.counters[f"{name}_{'hits' if hit else 'misses'}"] += 1
+
+    def get_embedding(self, norm_query: str) -> Optional[np.ndarray]:
+        value = self._get(f"{self.version}|emb|{norm_query}")
+        self._count("embedding", value is not None)
+        return value
+
+    def put_embedding(self, norm_query: str, embedding: np.ndarray):
+        self._put(f"{self.version}|emb|{norm_query}", np.array(embedding, dtype=np.float32))
+
+    def _hits_key(self, norm_query: str, top_k: int, knobs) -> str:
+        return f"{self.version}|hits|{top_k}|{knobs}|{norm_query}"
+
+    def get_hits(self, norm_query: str, top_k: int, knobs=None) -> Optional[List[Dict[str, Any]]]:
+        value = self._get(self._hits_key(norm_query, top_k, knobs))
+        self._count("result", value is not None)
+        return None if value is None else [dict(h) for h in value]
+
+    def put_hits(self, norm_query: str, top_k: int, knobs, hits: List[Dict[str, Any]]):
+        self._put(self._hits_key(norm_query, top_k, knobs), [dict(h) for h in hits])
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {**self.counters, "version": self.version, "memory": self.memory.stats()}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
@@ -0,0 +1,399 @@
+# kb_ingest.py - Incremental, multi-document ingestion into the KB store
+#
+#   python kb_ingest.py guidelines/                 # ingest every PDF in a directory
+#   python kb_ingest.py a.pdf b.pdf --prune         # also drop documents no longer listed
+#   python kb_ingest.py guidelines/ --rebuild       # re-embed everything from scratch
+#
+# Documents are tracked in the store's docs.json. An unchanged file (same
+# sha256) is skipped without being opened; for a changed file every page is
+# hashed, unchanged pages reuse their chunk ids, and only new chunks are
+# embedded and appended. Chunks are content-addressed, so identical passages
+# shared by several guidelines are stored once, and chunks that no document
+# references any more are removed from the FAISS index.
+#
+# New chunks are embedded by an EmbedPool (embed_pool.py; --embed-workers
+# encoder processes) in length-sorted windows and appended to the store as they
+# finish. The index is checkpointed every KB_CHECKPOINT_S seconds and on Ctrl-C
+# or an error; running the same command again resumes after the last
+# checkpoint instead of re-embedding (--no-resume discards it).
+#
+# Only incremental updates append to the live store. A full build (--rebuild,
+# a new store, or one converted from the legacy pickle) is written and
+# checkpointed in the sibling directory <store>.build and swapped in once it is
+# complete, so running servers keep answering from the old KB meanwhile and a
+# crashed rebuild leaves it untouched.
+
+import os
+import glob
+import time
+import shutil
+import hashlib
+import datetime
+import argparse
+import numpy as np
+from collections import deque
+from typing import List, Dict, Any, Iterable, Tuple
+
+from data_analyze import (
+    STG_PDF, KB_STORE_DIR, KB_INDEX_TYPE, KB_CHUNK_SIZE, KB_CHUNK_OVERLAP, EMBED_MODEL_NAME,
+    chunk_text,
+)
+from embedder_backends import EMBED_BACKEND
+from embed_pool import EmbedPool
+from pdf_extract import iter_pdf_pages
+import kb_store
+
+EMBED_BATCH_SIZE = 64
+# Chunks buffered to train the coarse quantizer when a new IVF store is created.
+KB_TRAIN_SIZE = int(os.getenv("KB_TRAIN_SIZE", "4096"))
+# Chunks sorted by length together before being cut into encoder batches.
+KB_EMBED_WINDOW = int(os.getenv("KB_EMBED_WINDOW", "1024"))
+KB_CHECKPOINT_S = float(os.getenv("KB_CHECKPOINT_S", "60"))
+BUILD_SUFFIX = ".build"  # full builds happen in <store>.build
+
+def _sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _page_chunks(text: str) -> List[str]:
+    text = " ".join(text.split())
+    return chunk_text(text, chunk_size=KB_CHUNK_SIZE, overlap=KB_CHUNK_OVERLAP) if text else []
+
+def collect_pdfs(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """(path, document name) pairs; names are relative to the directory they were found in."""
+    found = []
+    for p in paths:
+        if os.path.isdir(p):
+            for f in sorted(glob.glob(os.path.join(p, "**", "*.pdf"), recursive=True)):
+                found.append((f, os.path.relpath(f, p).replace(os.sep, "/")))
+        elif p.lower().endswith(".pdf"):
+            found.append((p, os.path.basename(p)))
+    return found
+
+# -------------------------
+# FAISS id handling
+# -------------------------
+
+def _is_ivf(index) -> bool:
+    import faiss
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except Exception:
+        return False
+
+def _with_id_map(index):
+    """IVF indexes take explicit ids natively; flat/HNSW ones are wrapped in IndexIDMap2."""
+    import faiss
+    if _is_ivf(index) or isinstance(index, faiss.IndexIDMap):
+        return index
+    wrapped = faiss.IndexIDMap2(index)
+    if index.ntotal:
+        # Legacy store: ids were implicit positions, which are also the passage line numbers.
+        vecs = index.reconstruct_n(0, index.ntotal)
+        index.reset()
+        wrapped.add_with_ids(vecs, np.arange(len(vecs), dtype=np.int64))
+    return wrapped
+
+def _remove_ids(index, ids: List[int]):
+    import faiss
+    if not ids:
+        return index
+    ids = np.asarray(sorted(ids), dtype=np.int64)
+    try:
+        index.remove_ids(faiss.IDSelectorBatch(ids))
+        return index
+    except RuntimeError:
+        pass
+    # HNSW graphs cannot delete: rebuild from the surviving vectors.
+    base = faiss.downcast_index(index.index)
+    all_ids = faiss.vector_to_array(index.id_map)
+    vecs = base.reconstruct_n(0, base.ntotal)
+    keep = ~np.isin(all_ids, ids)
+    fresh = faiss.clone_index(base)
+    fresh.reset()
+    rebuilt = faiss.IndexIDMap2(fresh)
+    rebuilt.add_with_ids(vecs[keep], all_ids[keep])
+    return rebuilt
+
+def _new_index(first_batch: np.ndarray, index_type: str, **index_params):
+    """Empty id-mapped index; IVF variants are trained on the first batch of new chunks."""
+    from ann_index import build_faiss_index
+    train = first_batch if index_type in ("ivf_flat", "ivf_pq") else first_batch[:0]
+    index, params = build_faiss_index(train, index_type, **index_params)
+    index.reset()
+    return _with_id_map(index), params
+
+# -------------------------
+# Ingestion
+# -------------------------
+
+class _ChunkWriter:
+    """
+    Embeds new chunks window by window and appends them to the store as they
+    arrive, so memory stays flat however large the corpus is. Each window is
+    sorted by length and cut into encoder batches (little padding per batch);
+    the batches run on the EmbedPool while the caller keeps extracting pages,
+    and finished windows are appended to the store and the index in order (at
+    most two windows in flight). A new IVF store buffers KB_TRAIN_SIZE chunks
+    first to train its coarse quantizer. Every KB_CHECKPOINT_S seconds, and when
+    interrupted, the index is saved with a checkpoint (see checkpoint()).
+    """
+
+    def __init__(self, store_dir: str, index, manifest, chunk_ids: Dict[str, int], index_type: str,
+                 index_params: Dict[str, Any], batch_size: int, window: int, pool: EmbedPool,
+                 rebuild: bool, first_id: int = None, n_passages: int = None):
+        self.store_dir, self.index, self.manifest = store_dir, index, manifest
+        self.chunk_ids, self.index_type, self.index_params = chunk_ids, index_type, index_params
+        self.batch_size, self.window, self.pool, self.rebuild = batch_size, max(window, batch_size), pool, rebuild
+        self.batch: List[Dict[str, Any]] = []
+        self.pending = set()
+        self.inflight: deque = deque()  # (records, length order, futures) per window
+        self.embedded = 0
+        self.first_id, self.n_passages = first_id, n_passages  # passages written by this run: [first_id, n_passages)
+        self.saved_at = time.monotonic()
+
+    def add(self, record: Dict[str, Any]):
+        self.batch.append(record)
+        self.pending.add(record["hash"])
+        flush_at = self.window
+        if self.index is None and self.index_type in ("ivf_flat", "ivf_pq"):
+            flush_at = max(self.window, KB_TRAIN_SIZE)
+        if len(self.batch) >= flush_at:
+            self.flush()
+
+    def known(self, chunk_hash: str) -> bool:
+        return chunk_hash in self.chunk_ids or chunk_hash in self.pending
+
+    def flush(self, wait: bool = False):
+        """Dispatches the buffered window; appends finished windows (all of them with `wait`)."""
+        if self.batch:
+            order = sorted(range(len(self.batch)), key=lambda i: len(self.batch[i]["text"]))
+            futures = [self.pool.encode([self.batch[i]["text"] for i in order[s:s + self.batch_size]], self.batch_size)
+                       for s in range(0, len(order), self.batch_size)]
+            self.inflight.append((self.batch, order, futures))
+            self.batch = []
+        # The first window creates (and for IVF trains) the index, so it is appended right away.
+        limit = 0 if wait or self.index is None else 2
+        while len(self.inflight) > limit:
+            self._append(*self.inflight.popleft())
+
+    def _append(self, records: List[Dict[str, Any]], order: List[int], futures):
+        vecs = np.empty((len(records), 0), dtype=np.float32)
+        position = 0
+        for future in futures:
+            part = future.result()
+            if vecs.shape[1] == 0:
+                vecs = np.empty((len(records), part.shape[1]), dtype=np.float32)
+            vecs[order[position:position + len(part)]] = part
+            position += len(part)
+        if self.index is None:
+            self.index, params = _new_index(vecs, self.index_type, **self.index_params)
+            self.manifest = kb_store.make_manifest(EMBED_MODEL_NAME, params, 0, KB_CHUNK_SIZE, KB_CHUNK_OVERLAP,
+                                                   embed_backend=EMBED_BACKEND)
+            kb_store.write_store(self.store_dir, self.index, [], self.manifest)
+        first_id = kb_store.append_passages(self.store_dir, records)
+        ids = np.arange(first_id, first_id + len(records), dtype=np.int64)
+        self.index.add_with_ids(vecs, ids)
+        for rec, i in zip(records, ids):
+            self.chunk_ids[rec["hash"]] = int(i)
+            self.pending.discard(rec["hash"])
+        self.embedded += len(records)
+        self.first_id = first_id if self.first_id is None else self.first_id
+        self.n_passages = first_id + len(records)
+        if time.monotonic() - self.saved_at >= KB_CHECKPOINT_S:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Saves the index and records which passages it covers, so an interrupted
+        run can resume (ingest_documents) without re-embedding them.
+        """
+        if self.index is None or self.first_id is None:
+            return
+        kb_store.write_index_file(self.store_dir, self.index)
+        kb_store.write_checkpoint(self.store_dir, {
+            "rebuild": self.rebuild, "first_id": self.first_id, "n_passages": self.n_passages,
+            "saved_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        })
+        self.saved_at = time.monotonic()
+
+    def abort(self):
+        """Drops the windows still being embedded and checkpoints what was appended."""
+        self.pool.shutdown(cancel=True)
+        self.inflight.clear()
+        self.batch = []
+        self.checkpoint()
+
+def _resume_chunk_ids(store_dir: str, checkpoint: Dict[str, Any]) -> Dict[str, int]:
+    """Chunk hash -> id of the passages an interrupted run had embedded."""
+    passages = kb_store.PassageStore(store_dir)
+    try:
+        return {passages.record(i)["hash"]: i for i in range(checkpoint["first_id"], checkpoint["n_passages"])}
+    finally:
+        passages.close()
+
+def ingest_documents(paths: Iterable[str], store_dir: str = KB_STORE_DIR, index_type: str = None,
+                     prune: bool = False, rebuild: bool = False, workers: int = None,
+                     batch_size: int = EMBED_BATCH_SIZE, embed_workers: int = None,
+                     window: int = KB_EMBED_WINDOW, resume: bool = True, **index_params) -> Dict[str, Any]:
+    """
+    Ingests PDFs (files or directories) into the KB store, embedding only new or
+    changed chunks. Pages are streamed (optionally from a process pool, see
+    `workers`); chunks are embedded in batches of `batch_size` by `embed_workers`
+    encoder processes (default KB_EMBED_WORKERS), sorted by length in windows of
+    `window` chunks. An interrupted run is resumed from its checkpoint unless
+    `resume` is False. Returns counters describing what was done.
+    """
+    t0 = time.perf_counter()
+    pdfs = collect_pdfs(paths)
+    stats = {"docs_seen": len(pdfs), "docs_skipped": 0, "docs_removed": 0,
+             "chunks_embedded": 0, "chunks_reused": 0, "chunks_removed": 0}
+
+    live_dir = store_dir
+    build_dir = store_dir.rstrip("/\\") + BUILD_SUFFIX
+    exists = kb_store.is_store(store_dir) and not rebuild
+    if exists:
+        manifest = kb_store.read_manifest(store_dir)
+        kb_store.validate_manifest(manifest, EMBED_MODEL_NAME, EMBED_BACKEND)
+        docs = kb_store.read_docs(store_dir)
+        if not docs and manifest.get("n_passages"):
+            print(f"{store_dir} has no document registry (converted from the legacy pickle); rebuilding it.")
+            exists = False
+    checkpoint = kb_store.read_checkpoint(store_dir) if exists else None
+    if not exists:
+        # Full build in <store>.build; an interrupted one (no docs.json yet) is continued like an update.
+        store_dir = build_dir
+        checkpoint = kb_store.read_checkpoint(build_dir) if kb_store.is_store(build_dir) else None
+        if checkpoint and resume:
+            exists = True
+            manifest = kb_store.read_manifest(build_dir)
+            kb_store.validate_manifest(manifest, EMBED_MODEL_NAME, EMBED_BACKEND)
+            docs = kb_store.read_docs(build_dir)
+        else:
+            checkpoint = None
+            shutil.rmtree(build_dir, ignore_errors=True)
+    if exists:
+        index = _with_id_map(kb_store.read_faiss_index(store_dir, use_mmap=False))
+        chunk_ids: Dict[str, int] = {}
+        for d in docs.values():
+            for page in d["pages"].values():
+                chunk_ids.update(zip(page["chunks"], page["ids"]))
+        if checkpoint:
+            # Passages appended after the checkpoint have no vectors in the saved index.
+            kb_store.truncate_passages(store_dir, checkpoint["n_passages"])
+            if resume:
+                chunk_ids.update(_resume_chunk_ids(store_dir, checkpoint))
+                print(f"Resuming the interrupted ingestion of {store_dir}: "
+                      f"{checkpoint['n_passages'] - checkpoint['first_id']} passages already embedded.")
+            else:
+                index = _remove_ids(index, list(range(checkpoint["first_id"], checkpoint["n_passages"])))
+                kb_store.truncate_passages(store_dir, checkpoint["first_id"])
+                checkpoint = None
+    else:
+        manifest, docs, index, chunk_ids = None, {}, None, {}
+
+    pool = EmbedPool(EMBED_MODEL_NAME, embed_workers)
+    stats["embed_workers"] = pool.workers
+    writer = _ChunkWriter(store_dir, index, manifest, chunk_ids, index_type or KB_INDEX_TYPE, index_params,
+                          batch_size, window, pool, store_dir == build_dir,
+                          first_id=checkpoint["first_id"] if checkpoint else None,
+                          n_passages=checkpoint["n_passages"] if checkpoint else None)
+
+    # --- Diff documents against the registry, streaming new chunks to the writer ---
+    seen_names = set()
+    try:
+        for path, name in pdfs:
+            seen_names.add(name)
+            sha = kb_store.file_sha256(path)
+            old = docs.get(name)
+            if old and old["sha256"] == sha:
+                stats["docs_skipped"] += 1
+                continue
+
+            old_pages = old["pages"] if old else {}
+            pages: Dict[str, Any] = {}
+            for page_no, text in iter_pdf_pages(path, workers=workers):
+                page_hash = _sha1(text)
+                prev = old_pages.get(str(page_no))
+                if prev and prev["hash"] == page_hash:
+                    pages[str(page_no)] = prev
+                    stats["chunks_reused"] += len(prev["chunks"])
+                    continue
+                hashes = []
+                for chunk in _page_chunks(text):
+                    h = _sha1(chunk)
+                    hashes.append(h)
+                    if writer.known(h):
+                        stats["chunks_reused"] += 1
+                        continue
+                    writer.add({"text": chunk, "source": name, "page": page_no, "hash": h})
+                pages[str(page_no)] = {"hash": page_hash, "chunks": hashes, "ids": []}
+            docs[name] = {"sha256": sha, "n_pages": len(pages), "pages": pages}
+        writer.flush(wait=True)
+    except BaseException:
+        writer.abort()
+        if writer.first_id is not None:
+            print(f"WARNING: ingestion interrupted; checkpoint saved ({writer.n_passages - writer.first_id} passages "
+                  f"embedded). Run the same command again to resume.")
+        raise
+    finally:
+        pool.shutdown()
+
+    if prune:
+        for name in [n for n in docs if n not in seen_names]:
+            del docs[name]
+            stats["docs_removed"] += 1
+
+    index, manifest = writer.index, writer.manifest
+    stats["chunks_embedded"] = writer.embedded
+    if index is None:
+        print("WARNING: no passages found to ingest.")
+        return stats
+
+    # --- Resolve ids and drop chunks nobody references any more ---
+    live = set()
+    for d in docs.values():
+        for page in d["pages"].values():
+            page["ids"] = [chunk_ids[h] for h in page["chunks"]]
+            live.update(page["chunks"])
+    stale = [i for h, i in chunk_ids.items() if h not in live]
+    index = _remove_ids(index, stale)
+    stats["chunks_removed"] = len(stale)
+    elapsed = time.perf_counter() - t0
+    stats["seconds"] = round(elapsed, 2)
+    stats["passages_per_s"] = round(writer.embedded / elapsed, 1) if elapsed > 0 else 0.0
+    if store_dir == live_dir and stats["docs_skipped"] == len(pdfs) and not (stats["docs_removed"] or stale):
+        return stats  # nothing changed: leave the manifest (and every reader's caches) alone
+
+    kb_store.write_index_file(store_dir, index)
+    kb_store.write_docs(store_dir, docs)
+    manifest.update(
+        n_passages=int(index.ntotal),
+        generation=int(manifest.get("generation", 0)) + 1,
+        sources=[{"path": n, "sha256": d["sha256"], "pages": d["n_pages"]} for n, d in sorted(docs.items())],
+    )
+    kb_store.write_manifest(store_dir, manifest)
+    kb_store.clear_checkpoint(store_dir)
+    if store_dir != live_dir:
+        kb_store.replace_store(store_dir, live_dir)
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally ingest guideline PDFs into the CareCrew KB store")
+    parser.add_argument("paths", nargs="*", default=[STG_PDF], help="PDF files or directories")
+    parser.add_argument("--store", default=KB_STORE_DIR)
+    parser.add_argument("--index-type", default=None, help="flat | ivf_flat | hnsw | ivf_pq (new stores only)")
+    parser.add_argument("--prune", action="store_true", help="remove documents not among the given paths")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the existing store and re-embed everything")
+    parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes (default: PDF_WORKERS)")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="chunks per encoder batch")
+    parser.add_argument("--embed-workers", type=int, default=None,
+                        help="embedding processes (default: KB_EMBED_WORKERS)")
+    parser.add_argument("--window", type=int, default=KB_EMBED_WINDOW, help="chunks sorted by length together")
+    parser.add_argument("--no-resume", action="store_true", help="discard the checkpoint of an interrupted run")
+    args = parser.parse_args()
+
+    result = ingest_documents(args.paths, args.store, index_type=args.index_type, prune=args.prune,
+                              rebuild=args.rebuild, workers=args.workers, batch_size=args.batch_size,
+                              embed_workers=args.embed_workers, window=args.window, resume=not args.no_resume)
+    print("✅ KB ingestion finished: " + ", ".join(f"{k}={v}" for k, v in result.items()))
@@ -0,0 +1,328 @@
+# kb_store.py - Versioned, memory-mapped on-disk format for the STG knowledge base
+#
+# A KB store is a directory:
+#   manifest.json    format version, embedding model, chunking and index params, source hashes
+#   index.faiss      FAISS index written with faiss.write_index, opened with mmap
+#   passages.jsonl   one JSON record per passage ({"text", "source", "page", "hash"}), id == line number
+#   passages.idx     little-endian uint64 byte offsets into passages.jsonl (n + 1 entries)
+#   docs.json        per-document registry used by kb_ingest.py (file hash, page hashes, chunk ids)
+#   checkpoint.json  only while an ingestion is running or after it was interrupted (see kb_ingest.py)
+#
+# Every file is opened read-only through mmap, so all KB workers on a node share
+# the same page cache instead of each unpickling a private copy.
+#
+# One-shot conversion of the legacy pickle:
+#   python kb_store.py convert --pickle kb_index.pkl --out kb_store
+
+import os
+import sys
+import json
+import mmap
+import shutil
+import hashlib
+import argparse
+import datetime
+import numpy as np
+from typing import Dict, Any, List, Iterable, Optional
+
+from embedder_backends import vector_space
+
+KB_FORMAT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+PASSAGES_FILE = "passages.jsonl"
+OFFSETS_FILE = "passages.idx"
+DOCS_FILE = "docs.json"
+CHECKPOINT_FILE = "checkpoint.json"
+
+# -------------------------
+# Passages
+# -------------------------
+
+class PassageStore:
+    """Read-on-demand, list-like view of passages.jsonl (supports len() and [i])."""
+
+    def __init__(self, store_dir: str):
+        self.path = os.path.join(store_dir, PASSAGES_FILE)
+        offsets_path = os.path.join(store_dir, OFFSETS_FILE)
+        if os.path.getsize(offsets_path):
+            self._offsets = np.memmap(offsets_path, dtype="<u8", mode="r")
+        else:
+            self._offsets = np.zeros(1, dtype="<u8")
+        self._file = open(self.path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.path) else b""
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def record(self, i: int) -> Dict[str, Any]:
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return json.loads(self._data[start:end])
+
+    def __getitem__(self, i: int) -> str:
+        return self.record(int(i))["text"]
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+def write_passages(store_dir: str, records: Iterable[Dict[str, Any]]) -> int:
+    """Writes passage records and their offsets table; returns the number written."""
+    offsets = [0]
+    with open(os.path.join(store_dir, PASSAGES_FILE), "wb") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+    np.asarray(offsets, dtype="<u8").tofile(os.path.join(store_dir, OFFSETS_FILE))
+    return len(offsets) - 1
+
+def append_passages(store_dir: str, records: List[Dict[str, Any]]) -> int:
+    """
+    Appends records to an existing store and returns the id of the first one.
+    Passages are append-only: ids stay stable, and removed chunks are only
+    dropped from the FAISS index. Readers that already mapped the files keep a
+    consistent (shorter) view.
+    """
+    offsets_path = os.path.join(store_dir, OFFSETS_FILE)
+    existing = np.fromfile(offsets_path, dtype="<u8") if os.path.getsize(offsets_path) else np.zeros(1, dtype="<u8")
+    first_id = len(existing) - 1
+    new_offsets = []
+    with open(os.path.join(store_dir, PASSAGES_FILE), "ab") as f:
+        f.seek(int(existing[-1]))
+        f.truncate()  # drop bytes from an append that crashed before its offsets were written
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+            new_offsets.append(f.tell())
+    if len(existing) == 1 and not os.path.getsize(offsets_path):
+        new_offsets.insert(0, 0)
+    with open(offsets_path, "ab") as f:
+        np.asarray(new_offsets, dtype="<u8").tofile(f)
+    return first_id
+
+def truncate_passages(store_dir: str, n: int):
+    """Drops every passage from id `n` on (records appended after the last ingestion checkpoint)."""
+    offsets_path = os.path.join(store_dir, OFFSETS_FILE)
+    offsets = np.fromfile(offsets_path, dtype="<u8")
+    if len(offsets) <= n + 1:
+        return
+    with open(offsets_path, "r+b") as f:
+        f.truncate((n + 1) * offsets.itemsize)
+    with open(os.path.join(store_dir, PASSAGES_FILE), "r+b") as f:
+        f.truncate(int(offsets[n]))
+
+# -------------------------
+# Manifest
+# -------------------------
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def make_manifest(embed_model: str, index_params: Dict[str, Any], n_passages: int,
+                  chunk_size: int, overlap: int, sources: List[str] = (), embed_backend: str = "torch") -> Dict[str, Any]:
+    return {
+        "format_version": KB_FORMAT_VERSION,
+        "embed_model": embed_model,
+        "embed_backend": embed_backend,
+        "dim": index_params.get("dim"),
+        "metric": "l2",
+        "index_params": index_params,
+        "chunking": {"chunk_size": chunk_size, "overlap": overlap},
+        "sources": [{"path": os.path.basename(p), "sha256": file_sha256(p)} for p in sources if os.path.exists(p)],
+        "n_passages": n_passages,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+
+def read_manifest(store_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(store_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_json_atomic(path: str, obj: Any):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+def write_manifest(store_dir: str, manifest: Dict[str, Any]):
+    _write_json_atomic(os.path.join(store_dir, MANIFEST_FILE), manifest)
+
+def read_docs(store_dir: str) -> Dict[str, Any]:
+    path = os.path.join(store_dir, DOCS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_docs(store_dir: str, docs: Dict[str, Any]):
+    _write_json_atomic(os.path.join(store_dir, DOCS_FILE), docs)
+
+def read_checkpoint(store_dir: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(store_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_checkpoint(store_dir: str, checkpoint: Dict[str, Any]):
+    _write_json_atomic(os.path.join(store_dir, CHECKPOINT_FILE), checkpoint)
+
+def clear_checkpoint(store_dir: str):
+    try:
+        os.remove(os.path.join(store_dir, CHECKPOINT_FILE))
+    except FileNotFoundError:
+        pass
+
+def validate_manifest(manifest: Dict[str, Any], embed_model: str, embed_backend: str = None):
+    """Refuses stores written by another format version or embedding model, or with incompatible vectors."""
+    version = manifest.get("format_version")
+    if version != KB_FORMAT_VERSION:
+        raise RuntimeError(f"KB store format version {version} is not supported (expected {KB_FORMAT_VERSION}). Rebuild the KB.")
+    if manifest.get("embed_model") != embed_model:
+        raise RuntimeError(
+            f"KB store was embedded with '{manifest.get('embed_model')}' but queries use '{embed_model}'. "
+            "Rebuild the KB with the current model."
+        )
+    # Stores written before the backend was recorded were embedded with torch.
+    stored = manifest.get("embed_backend") or "torch"
+    if embed_backend is not None and vector_space(stored) != vector_space(embed_backend):
+        raise RuntimeError(
+            f"KB store was embedded with the '{stored}' backend but queries use EMBED_BACKEND='{embed_backend}'; "
+            "their vectors are not interchangeable. Rebuild the KB or switch EMBED_BACKEND back."
+        )
+
+# -------------------------
+# Store
+# -------------------------
+
+def is_store(store_dir: str) -> bool:
+    return os.path.isfile(os.path.join(store_dir, MANIFEST_FILE))
+
+def write_store(store_dir: str, index, records: Iterable[Dict[str, Any]], manifest: Dict[str, Any]):
+    """
+    Writes a complete store into a sibling temp dir and swaps it in, so readers
+    never see a half-written store (processes that already mapped the old files
+    keep reading them until they reload).
+    """
+    import faiss
+
+    tmp_dir = store_dir.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILE))
+    manifest = {**manifest, "n_passages": write_passages(tmp_dir, records)}
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    replace_store(tmp_dir, store_dir)
+    return manifest
+
+def replace_store(src_dir: str, store_dir: str):
+    """Swaps the complete store in `src_dir` in for `store_dir` (which may not exist yet)."""
+    old_dir = store_dir.rstrip("/\\") + ".old"
+    if os.path.exists(store_dir):
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(store_dir, old_dir)
+    os.replace(src_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def write_index_file(store_dir: str, index):
+    """Replaces index.faiss atomically (mmap readers keep the old inode until they reload)."""
+    import faiss
+
+    path = os.path.join(store_dir, INDEX_FILE)
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def read_faiss_index(store_dir: str, use_mmap: bool = True):
+    import faiss
+
+    path = os.path.join(store_dir, INDEX_FILE)
+    if use_mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+        except RuntimeError:
+            pass  # index type without mmap support: fall back to a regular read
+    return faiss.read_index(path)
+
+def open_store(store_dir: str, embed_model: str = None, use_mmap: bool = True,
+               embed_backend: str = None) -> Dict[str, Any]:
+    """
+    Opens a KB store. Returns the same shape callers used with the pickle
+    ({"index", "passages", "index_params"}) plus the manifest.
+    """
+    manifest = read_manifest(store_dir)
+    if embed_model is not None:
+        validate_manifest(manifest, embed_model, embed_backend)
+    return {
+        "index": read_faiss_index(store_dir, use_mmap=use_mmap),
+        "passages": PassageStore(store_dir),
+        "index_params": manifest.get("index_params", {"type": "flat"}),
+        "manifest": manifest,
+    }
+
+# -------------------------
+# Legacy pickle conversion
+# -------------------------
+
+def _load_legacy_pickle(pickle_path: str) -> Dict[str, Any]:
+    """
+    Unpickles kb_index.pkl. The pickle names the SIMD-specific SWIG module it was
+    written with (e.g. faiss.swigfaiss_avx2); importing that next to the variant
+    faiss actually loaded breaks every index proxy in the process, so classes are
+    resolved through the top-level faiss module instead.
+    """
+    import pickle
+    import faiss
+
+    class _Unpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            if module.startswith("faiss.swigfaiss"):
+                module = "faiss"
+            return super().find_class(module, name)
+
+    with open(pickle_path, "rb") as f:
+        data = _Unpickler(f).load()
+    raw = getattr(data["index"], "__dict__", {}).get("this")
+    if isinstance(raw, (bytes, bytearray)):
+        data["index"] = faiss.deserialize_index(np.frombuffer(raw, dtype="uint8"))
+    return data
+
+def convert_pickle(pickle_path: str, store_dir: str, embed_model: str, source_pdf: str = None,
+                   chunk_size: int = 300, overlap: int = 50) -> Dict[str, Any]:
+    """One-shot converter from the old kb_index.pkl ({"index", "passages"}) to a KB store."""
+    data = _load_legacy_pickle(pickle_path)
+    index = data["index"]
+    params = dict(data.get("index_params") or {"type": "flat"})
+    params.setdefault("dim", index.d)
+    manifest = make_manifest(embed_model, params, len(data["passages"]), chunk_size, overlap,
+                             sources=[source_pdf] if source_pdf else [])
+    manifest["converted_from"] = os.path.basename(pickle_path)
+    manifest = write_store(store_dir, index, ({"text": p} for p in data["passages"]), manifest)
+    print(f"✅ Converted {pickle_path} ({manifest['n_passages']} passages) to KB store {store_dir}")
+    return manifest
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from data_analyze import EMBED_MODEL_NAME, KB_INDEX_PICKLE, KB_STORE_DIR, STG_PDF
+
+    parser = argparse.ArgumentParser(description="CareCrew KB store tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    conv = sub.add_parser("convert", help="convert the legacy pickle into a KB store")
+    conv.add_argument("--pickle", default=KB_INDEX_PICKLE)
+    conv.add_argument("--out", default=KB_STORE_DIR)
+    conv.add_argument("--source-pdf", default=STG_PDF)
+    info = sub.add_parser("info", help="print a store's manifest")
+    info.add_argument("--store", default=KB_STORE_DIR)
+    args = parser.parse_args()
+
+    if args.cmd == "convert":
+        convert_pickle(args.pickle, args.out, EMBED_MODEL_NAME, source_pdf=args.source_pdf)
+    else:
+        print(json.dumps(read_manifest(args.store), indent=2))
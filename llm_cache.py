@@ -0,0 +1,151 @@
+# llm_cache.py - Content-addressed cache for LLM completions (opt-in)
+#
+# Pipeline stages build their prompts purely from upstream text, so re-running a
+# case (same upload re-analyzed, or a retry after a later stage failed) repeats
+# identical requests. chat_completion()/achat_completion() consult this cache
+# first. The key is a SHA-256 over model, messages (inline images replaced by
+# the hash of their bytes) and sampling parameters. Completions live in a
+# byte-bounded in-memory LRU, backed by a SQLite tier that survives restarts.
+#
+#   LLM_CACHE=1                       enable
+#   LLM_CACHE_STAGES=icd,reasoning,kb only cache these pipeline stages ("*" = all,
+#                                     "*,-advisory" = all but the advisory stage)
+#
+# Only successful completions are stored. Requests made outside the pipeline
+# DAG count as the stage "default".
+
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+
+from cache_store import ByteLRUCache, SqliteCache
+
+LLM_CACHE = os.getenv("LLM_CACHE", "0") != "0"
+LLM_CACHE_STAGES = os.getenv("LLM_CACHE_STAGES", "*")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(32 * 2**20)))
+# Empty string keeps the cache in memory only.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm.sqlite"))
+LLM_CACHE_DISK_MAX_BYTES = int(os.getenv("LLM_CACHE_DISK_MAX_BYTES", str(256 * 2**20)))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+
+def _canonical_content(content):
+    """Message content with inline (base64) images replaced by the hash of their data."""
+    if isinstance(content, list):
+        return [_canonical_content(part) for part in content]
+    if isinstance(content, dict):
+        out = {}
+        for k, v in content.items():
+            if k == "url" and isinstance(v, str) and v.startswith("data:"):
+                v = "sha256:" + hashlib.sha256(v.encode("utf-8")).hexdigest()
+            out[k] = _canonical_content(v)
+        return out
+    return content
+
+def make_key(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+    blob = json.dumps({"model": model, "messages": _canonical_content(messages), "params": params},
+                      sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    def __init__(self, enabled: bool = LLM_CACHE, stages: str = LLM_CACHE_STAGES,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, disk_path: str = LLM_CACHE_PATH):
+        self.enabled = enabled
+        self.stages, self.disabled = self._parse_stages(stages)
+        self.memory = ByteLRUCache(max_bytes)
+        self._disk_path = disk_path
+        self._disk: Optional[SqliteCache] = None
+        self._lock = threading.Lock()
+        self.per_stage: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _parse_stages(stages):
+        """"*" / None = every stage; "a,b" = only these; "*,-advisory" = all but advisory."""
+        if stages is None:
+            return None, set()
+        if isinstance(stages, str):
+            stages = stages.split(",")
+        names = [s.strip() for s in stages if s.strip()]
+        disabled = {n[1:] for n in names if n.startswith("-")}
+        allowed = {n for n in names if not n.startswith("-")}
+        return (None if "*" in allowed or not allowed else allowed), disabled
+
+    @property
+    def disk(self) -> Optional[SqliteCache]:
+        if self._disk is None and self._disk_path:
+            with self._lock:
+                if self._disk is None:
+                    self._disk = SqliteCache(self._disk_path, max_bytes=LLM_CACHE_DISK_MAX_BYTES,
+                                             default_ttl=LLM_CACHE_TTL)
+        return self._disk
+
+    def set_stage_enabled(self, stage: str, enabled: bool):
+        """Per-stage switch at runtime."""
+        with self._lock:
+            if enabled:
+                self.disabled.discard(stage)
+                if self.stages is not None:
+                    self.stages.add(stage)
+            else:
+                self.disabled.add(stage)
+
+    def enabled_for(self, stage: Optional[str]) -> bool:
+        stage = stage or "default"
+        return self.enabled and stage not in self.disabled and (self.stages is None or stage in self.stages)
+
+    def _count(self, stage: Optional[str], name: str):
+        with self._lock:
+            counts = self.per_stage.setdefault(stage or "default", {"hits": 0, "misses": 0, "stores": 0})
+            counts[name] += 1
+
+    def get(self, key: str, stage: Optional[str] = None) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        self._count(stage, "hits" if value is not None else "misses")
+        return value
+
+    def put(self, key: str, text: str, stage: Optional[str] = None):
+        if not text:
+            return
+        self.memory.put(key, text)
+        if self.disk is not None:
+            self.disk.put(key, text)
+        self._count(stage, "stores")
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(c["hits"] for c in self.per_stage.values())
+        misses = sum(c["misses"] for c in self.per_stage.values())
+        per_stage = {stage: {**c, "hit_rate": round(c["hits"] / max(c["hits"] + c["misses"], 1), 3)}
+                     for stage, c in self.per_stage.items()}
+        stats = {"enabled": self.enabled, "stages": "*" if self.stages is None else sorted(self.stages),
+                 "disabled_stages": sorted(self.disabled),
+                 "hits": hits, "misses": misses, "hit_rate": round(hits / max(hits + misses, 1), 3),
+                 "per_stage": per_stage, "memory": self.memory.stats()}
+        if self._disk is not None:
+            stats["disk"] = self._disk.stats()
+        return stats
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache() -> LLMCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
+
+def lookup_key(stage: Optional[str], model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> Optional[str]:
+    """Cache key for this request, or None when the cache is off for `stage`."""
+    cache = get_llm_cache()
+    return make_key(model, messages, params) if cache.enabled_for(stage) else None
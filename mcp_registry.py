@@ -0,0 +1,185 @@
+# mcp_registry.py - Long-lived, thread-safe MCP tool registry
+#
+# run_medical_crew() used to build a new MCPServerAdapter per request: a fresh
+# streamable-HTTP handshake and tool discovery against both MCP servers (plus a
+# background thread that was never stopped), tool lookup by name, and six new
+# crewai Agent objects. The registry does this once per process:
+#   - one adapter, its sessions kept open between requests
+#   - tools indexed by name (with fix_groq_url applied once)
+#   - agents built once and cached until the tools change
+#   - a cheap health check (GET /health on each server, at most every
+#     MCP_HEALTH_INTERVAL_S) that reconnects when a server went away or restarted
+
+import os
+import time
+import atexit
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+import groq
+
+import tracing
+
+MCP_FDA_URL = os.getenv("MCP_FDA_URL", "http://127.0.0.1:8001/mcp")
+MCP_KB_URL = os.getenv("MCP_KB_URL", "http://127.0.0.1:8002/mcp")
+MCP_SERVER_PARAMS = [
+    {"url": MCP_FDA_URL, "transport": "streamable-http"},
+    {"url": MCP_KB_URL, "transport": "streamable-http"},
+]
+MCP_HEALTH_INTERVAL_S = float(os.getenv("MCP_HEALTH_INTERVAL_S", "10"))
+MCP_CONNECT_TIMEOUT_S = int(os.getenv("MCP_CONNECT_TIMEOUT_S", "30"))
+
+def fix_groq_url(tool):
+    """Ensure Groq models inside tools use string URLs, not URL objects."""
+    if hasattr(tool, 'model') and isinstance(tool.model, groq.Groq):
+        tool.model = groq.Groq(url=str(tool.model.url))
+    return tool
+
+def health_url(mcp_url: str) -> str:
+    base = mcp_url.rstrip("/")
+    if base.endswith("/mcp"):
+        base = base[:-len("/mcp")]
+    return base + "/health"
+
+def _crewai_adapter(server_params: List[Dict], connect_timeout: int):
+    from crewai_tools import MCPServerAdapter
+    return MCPServerAdapter(server_params, connect_timeout=connect_timeout)
+
+class MCPToolRegistry:
+    def __init__(self, server_params: List[Dict] = None, health_interval: float = MCP_HEALTH_INTERVAL_S,
+                 adapter_factory: Callable[[List[Dict], int], Any] = None, connect_timeout: int = MCP_CONNECT_TIMEOUT_S):
+        self.server_params = server_params or MCP_SERVER_PARAMS
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        self._adapter_factory = adapter_factory or _crewai_adapter
+        self._lock = threading.RLock()
+        self._http = requests.Session()
+        self._adapter = None
+        self._tools: Dict[str, Any] = {}
+        self._agents: Dict[str, Any] = {}
+        self._boot_ids: Dict[str, Optional[str]] = {}
+        self._checked_at = 0.0
+        self.counters = {"connects": 0, "reconnects": 0, "health_checks": 0, "agent_builds": 0}
+
+    # -------------------------
+    # Health
+    # -------------------------
+    def _boot_id(self, mcp_url: str) -> Optional[str]:
+        """Server boot id from /health; '' for a live server without the route. Raises when unreachable."""
+        resp = self._http.get(health_url(mcp_url), timeout=2)
+        if resp.status_code == 404:
+            return ""
+        resp.raise_for_status()
+        return resp.json().get("boot_id", "")
+
+    def _healthy(self) -> bool:
+        self.counters["health_checks"] += 1
+        try:
+            current = {p["url"]: self._boot_id(p["url"]) for p in self.server_params}
+        except Exception as e:
+            print(f"WARNING: MCP health check failed ({e}); reconnecting.")
+            return False
+        # None: the probe failed when we connected; adopt the id now instead of treating it as a restart.
+        if any(self._boot_ids.get(url) not in (None, boot_id) for url, boot_id in current.items()):
+            print("WARNING: an MCP server restarted; reconnecting.")
+            return False
+        self._boot_ids = current
+        return True
+
+    # -------------------------
+    # Connection lifecycle
+    # -------------------------
+    def _connect(self):
+        with tracing.span("mcp.connect", servers=len(self.server_params)):
+            self._open()
+
+    def _probe(self, mcp_url: str) -> Optional[str]:
+        try:
+            return self._boot_id(mcp_url)
+        except Exception:
+            return None
+
+    def _open(self):
+        boot_ids = {p["url"]: self._probe(p["url"]) for p in self.server_params}
+        try:
+            adapter = self._adapter_factory(self.server_params, self.connect_timeout)
+        except Exception as e:
+            urls = ", ".join(p["url"] for p in self.server_params)
+            raise RuntimeError(f"MCP Connection Failure: Ensure servers at {urls} are running. Error: {e}")
+        self._adapter = adapter
+        self._tools = {t.name: fix_groq_url(t) for t in adapter.tools}
+        self._agents = {}
+        self._boot_ids = boot_ids
+        self._checked_at = time.monotonic()
+        self.counters["connects"] += 1
+        print(f"✅ MCP tools connected: {', '.join(sorted(self._tools))}")
+
+    def _disconnect(self):
+        adapter, self._adapter = self._adapter, None
+        self._tools, self._agents = {}, {}
+        if adapter is not None:
+            try:
+                adapter.stop()
+            except Exception as e:
+                print(f"WARNING: closing MCP adapter failed: {e}")
+
+    def _ensure(self):
+        with self._lock:
+            if self._adapter is None:
+                self._connect()
+            elif time.monotonic() - self._checked_at >= self.health_interval:
+                if self._healthy():
+                    self._checked_at = time.monotonic()
+                else:
+                    self.counters["reconnects"] += 1
+                    self._disconnect()
+                    self._connect()
+
+    def invalidate(self):
+        """Drops the connection (e.g. after a failed tool call); the next request reconnects."""
+        with self._lock:
+            self._disconnect()
+
+    def close(self):
+        self.invalidate()
+
+    # -------------------------
+    # Access
+    # -------------------------
+    def tools(self) -> Dict[str, Any]:
+        self._ensure()
+        return dict(self._tools)
+
+    def get_tool(self, name: str):
+        tool = self.tools().get(name)
+        if tool is None:
+            raise RuntimeError(f"❌ Required MCP tool not found: {name}")
+        return tool
+
+    def get_agent(self, name: str, factory: Callable[[], Any]):
+        """Cached agent object; rebuilt only after the tools were reconnected."""
+        self._ensure()
+        with self._lock:
+            agent = self._agents.get(name)
+            if agent is None:
+                agent = factory()
+                self._agents[name] = agent
+                self.counters["agent_builds"] += 1
+            return agent
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "connected": self._adapter is not None, "tools": sorted(self._tools)}
+
+_registry: Optional[MCPToolRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> MCPToolRegistry:
+    """Process-wide registry, created on first use and closed at interpreter exit."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MCPToolRegistry()
+                atexit.register(_registry.close)
+    return _registry
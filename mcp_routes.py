@@ -0,0 +1,34 @@
+# mcp_routes.py - Plain HTTP routes shared by the MCP servers
+#
+# GET /health returns a boot id that changes on every server start, so clients
+# holding long-lived MCP sessions (mcp_registry.py) can tell "still up" apart
+# from "restarted, my session is gone" without an MCP round trip.
+#
+# GET /metrics serves this process's span metrics (tracing.py) in the Prometheus
+# text format: latency histograms and p50/p95/p99 per tool, OpenFDA request,
+# embedding and index search, plus error counts, bytes and cache hits/misses.
+
+import time
+import uuid
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+
+import tracing
+
+BOOT_ID = uuid.uuid4().hex
+STARTED_AT = time.time()
+
+def add_health_route(mcp, server_name: str):
+    @mcp.custom_route("/health", methods=["GET"])
+    async def health(request: Request) -> JSONResponse:
+        return JSONResponse({"status": "ok", "server": server_name, "boot_id": BOOT_ID,
+                             "uptime_s": round(time.time() - STARTED_AT, 1)})
+    return health
+
+def add_metrics_route(mcp, server_name: str):
+    @mcp.custom_route("/metrics", methods=["GET"])
+    async def metrics(request: Request) -> PlainTextResponse:
+        text = tracing.prometheus_metrics()
+        text += f'carecrew_uptime_seconds{{server="{server_name}"}} {time.time() - STARTED_AT:.1f}\n'
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+    return metrics
@@ -1,11 +1,15 @@
 # mcp_server_fda.py - Exposes OpenFDA API as an MCP Tool on port 8001
 
+import os
 import uvicorn
 from fastmcp import FastMCP
+from mcp_routes import add_health_route, add_metrics_route
+import tracing
 from pydantic import BaseModel, Field
+from typing import List
 
-# --- Import core logic from data_analyze.py ---
-from data_analyze import get_openfda_warnings 
+# --- Import core logic from openfda_client.py (no embedder/KB imports needed here) ---
+from openfda_client import get_openfda_warnings, get_openfda_warnings_many
 # -----------------------------------------------
 
 # Define the output structure for the LLM
@@ -17,10 +21,19 @@ class FdaWarningOutput(BaseModel):
     warnings: str = Field(description="The primary safety warnings or adverse effects found in the FDA label.")
     found: bool = Field(description="True if successful data was retrieved, False otherwise.")
 
+class FdaBatchOutput(BaseModel):
+    """Results of checking several drugs against the FDA database in one call."""
+    results: List[FdaWarningOutput] = Field(description="One result per drug, in the order the drugs were given.")
+
+MCP_HOST = os.getenv("MCP_HOST", "0.0.0.0")
+MCP_FDA_PORT = int(os.getenv("MCP_FDA_PORT", "8001"))
+
 # Initialize the MCP Server
 # NOTE: The Deprecation Warning about providing 'port' here is unavoidable for now, 
 # but it doesn't stop the server.
-mcp = FastMCP("FDA_Safety_Checker", port=8001)
+mcp = FastMCP("FDA_Safety_Checker", port=MCP_FDA_PORT)
+add_health_route(mcp, "FDA_Safety_Checker")  # GET /health, used by mcp_registry.py
+add_metrics_route(mcp, "FDA_Safety_Checker")  # GET /metrics (Prometheus)
 
 # We rely on the Python type hint '-> FdaWarningOutput' to handle the schema definition.
 @mcp.tool() 
@@ -31,11 +44,23 @@ def check_drug_safety(drug_name: str = Field(description="The exact brand or gen
     medication proposed in the treatment plan.
     """
     # Call the underlying logic function from data_analyze.py
-    result = get_openfda_warnings(drug_name)
+    with tracing.span("mcp.tool", tool="check_drug_safety"):
+        result = get_openfda_warnings(drug_name)
     return FdaWarningOutput(**result)
 
+@mcp.tool()
+def check_drug_safety_batch(drug_names: List[str] = Field(description="Brand or generic names of every drug to check.")) -> FdaBatchOutput:
+    """
+    Checks several drugs against the OpenFDA database in one call (looked up
+    concurrently and cached). Prefer this over repeated single checks when a
+    treatment plan proposes more than one medication.
+    """
+    with tracing.span("mcp.tool", tool="check_drug_safety_batch", items=len(drug_names)):
+        results = get_openfda_warnings_many(drug_names)
+    return FdaBatchOutput(results=[FdaWarningOutput(**r) for r in results])
+
 if __name__ == "__main__":
-    print("--- Starting FDA MCP Server on port 8001 ---")
+    print(f"--- Starting FDA MCP Server on port {MCP_FDA_PORT} ---")
     # --- FIX: Use the FastMCP built-in .run() method with correct arguments ---
-    mcp.run(transport="streamable-http", host="0.0.0.0", port=8001)
+    mcp.run(transport="streamable-http", host=MCP_HOST, port=MCP_FDA_PORT)
     # -------------------------------------------------------------------------
@@ -1,42 +1,80 @@
 # mcp_server_kb.py - Exposes RAG Knowledge Base lookup as an MCP Tool on port 8002
 
+import os
+import asyncio
 import uvicorn
 from fastmcp import FastMCP
+from mcp_routes import add_health_route, add_metrics_route
+import tracing
 from pydantic import BaseModel, Field
 from typing import List, Dict
 
 # --- Import core logic from data_analyze.py ---
-from data_analyze import rag_lookup_kb
+from data_analyze import rag_lookup_kb, rag_lookup_kb_batch, warm_up_kb
 # -----------------------------------------------
+from kb_batcher import KB_BATCH_WINDOW_MS, KBQueryBatcher
 
 # Define the output structure for the LLM
 class KBLookupOutput(BaseModel):
     """Structured data returned after searching the internal Knowledge Base (STG)."""
     guideline_snippets: List[str] = Field(description="A list of up to 4 highly relevant text passages from the medical guidelines.")
     query_used: str = Field(description="The clinical query used for retrieval.")
+    sources: List[str] = Field(default_factory=list, description="Source document and page for each snippet, in the same order.")
+
+class KBBatchLookupOutput(BaseModel):
+    """Results of several Knowledge Base searches performed in one call."""
+    results: List[KBLookupOutput] = Field(description="One lookup result per query, in the order the queries were given.")
+
+def _to_output(query: str, hits) -> KBLookupOutput:
+    return KBLookupOutput(
+        guideline_snippets=[h['passage'] for h in hits],
+        query_used=query,
+        sources=[f"{h.get('source') or 'STG'} p.{h.get('page') or '?'}" for h in hits],
+    )
+
+MCP_HOST = os.getenv("MCP_HOST", "0.0.0.0")
+MCP_KB_PORT = int(os.getenv("MCP_KB_PORT", "8002"))
 
 # Initialize the MCP Server
-mcp = FastMCP("STG_Knowledge_Base", port=8002)
+mcp = FastMCP("STG_Knowledge_Base", port=MCP_KB_PORT)
+add_health_route(mcp, "STG_Knowledge_Base")  # GET /health, used by mcp_registry.py
+add_metrics_route(mcp, "STG_Knowledge_Base")  # GET /metrics (Prometheus)
+
+# Concurrent single-query searches are coalesced into one encoder/FAISS batch
+# (see kb_batcher.py); KB_BATCH_WINDOW_MS=0 searches each query on its own.
+_batcher = KBQueryBatcher(rag_lookup_kb_batch)
 
 @mcp.tool()
-def search_medical_guidelines(query: str = Field(description="The key clinical finding or diagnostic question to search the Standard Treatment Guidelines (STG) for.")) -> KBLookupOutput:
+async def search_medical_guidelines(query: str = Field(description="The key clinical finding or diagnostic question to search the Standard Treatment Guidelines (STG) for.")) -> KBLookupOutput:
     """
     Performs a deep semantic search against the internal Standard Treatment Guidelines (STG)
     to retrieve evidence-based passages relevant to the diagnosis or treatment plan.
     """
     # Call the underlying RAG logic function from data_analyze.py
-    hits = rag_lookup_kb(query, top_k=4)
-    
-    # Extract just the passage text for the final output
-    snippets = [h['passage'] for h in hits]
-    
-    return KBLookupOutput(
-        guideline_snippets=snippets,
-        query_used=query
-    )
+    with tracing.span("mcp.tool", tool="search_medical_guidelines"):
+        if KB_BATCH_WINDOW_MS > 0:
+            hits = await _batcher.search(query, top_k=4)
+        else:
+            hits = await asyncio.to_thread(rag_lookup_kb, query, top_k=4)
+    return _to_output(query, hits)
+
+@mcp.tool()
+async def search_medical_guidelines_batch(queries: List[str] = Field(description="Clinical findings or differential diagnoses to search the STG for, one query per item.")) -> KBBatchLookupOutput:
+    """
+    Searches the Standard Treatment Guidelines (STG) for several queries in one round trip,
+    e.g. one per differential diagnosis. Prefer this over repeated single searches.
+    """
+    with tracing.span("mcp.tool", tool="search_medical_guidelines_batch", items=len(queries)):
+        # Already one encoder/FAISS call; run it off the event loop so coalesced single searches keep flowing.
+        hits_per_query = await asyncio.to_thread(rag_lookup_kb_batch, queries, top_k=4)
+    return KBBatchLookupOutput(results=[_to_output(q, hits) for q, hits in zip(queries, hits_per_query)])
 
 if __name__ == "__main__":
-    print("--- Starting KB RAG MCP Server on port 8002 ---")
+    print(f"--- Starting KB RAG MCP Server on port {MCP_KB_PORT} ---")
+    # Load the embedder and FAISS index before accepting requests so the first
+    # search does not pay for it. Set KB_WARMUP=0 to defer loading to first use.
+    if os.getenv("KB_WARMUP", "1") != "0":
+        warm_up_kb()
     # --- CRITICAL FIX: Use the FastMCP built-in .run() method ---
-    mcp.run(transport="streamable-http", host="0.0.0.0", port=8002)
+    mcp.run(transport="streamable-http", host=MCP_HOST, port=MCP_KB_PORT)
     # -----------------------------------------------------------
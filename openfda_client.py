@@ -0,0 +1,148 @@
+# openfda_client.py - Pooled, concurrent and cached OpenFDA drug-label lookups
+#
+# - one pooled requests.Session per process (keep-alive, retries on 429/5xx)
+# - get_openfda_warnings_many(): concurrent lookups with a bounded worker count
+# - persistent SQLite TTL cache keyed by normalized drug name, with shorter-lived
+#   negative entries for drugs OpenFDA has no label for (network errors are never cached)
+# - when an offline mirror exists (fda_mirror.py), it is consulted first and the
+#   live API is only used for names the mirror does not know
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache_store import SqliteCache
+import fda_mirror
+import tracing
+
+OPENFDA_BASE = os.getenv("OPENFDA_BASE", "https://api.fda.gov/drug/label.json")
+OPENFDA_TIMEOUT = float(os.getenv("OPENFDA_TIMEOUT", "10"))
+OPENFDA_MAX_CONCURRENCY = int(os.getenv("OPENFDA_MAX_CONCURRENCY", "8"))
+# Empty string disables the persistent cache.
+OPENFDA_CACHE_PATH = os.getenv("OPENFDA_CACHE_PATH", os.path.join(".cache", "openfda.sqlite"))
+OPENFDA_CACHE_TTL = float(os.getenv("OPENFDA_CACHE_TTL", str(7 * 24 * 3600)))
+OPENFDA_NEGATIVE_TTL = float(os.getenv("OPENFDA_NEGATIVE_TTL", str(24 * 3600)))
+
+_session: Optional[requests.Session] = None
+_cache: Optional[SqliteCache] = None
+_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=frozenset(["GET"]))
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(OPENFDA_MAX_CONCURRENCY, 4), max_retries=retry)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def get_cache() -> Optional[SqliteCache]:
+    global _cache
+    if _cache is None and OPENFDA_CACHE_PATH:
+        with _lock:
+            if _cache is None:
+                _cache = SqliteCache(OPENFDA_CACHE_PATH, max_bytes=64 * 2**20)
+    return _cache
+
+def normalize_drug_name(drug_name: str) -> str:
+    return " ".join(drug_name.lower().split())
+
+def not_found_result(drug_name: str) -> Dict:
+    # Every FdaWarningOutput field must be present, even on failure.
+    return {
+        "drug_name": drug_name,
+        "brand": "N/A",
+        "generic": "N/A",
+        "warnings": "No data found due to search or network error.",
+        "found": False,
+    }
+
+def _label_to_result(drug_name: str, entry: Dict) -> Dict:
+    return {
+        "drug_name": drug_name,
+        "brand": entry.get("openfda", {}).get("brand_name", ["N/A"])[0],
+        "generic": entry.get("openfda", {}).get("generic_name", ["N/A"])[0],
+        "warnings": entry.get("warnings", ["No warnings available"])[0],
+        "found": True,
+    }
+
+def fetch_label(drug_name: str) -> Optional[Dict]:
+    """
+    Live OpenFDA lookup by brand, then generic name. Returns the result dict,
+    None when OpenFDA has no label, and raises on network/server errors.
+    """
+    session = get_session()
+    term = f'"{drug_name}"' if " " in drug_name else drug_name
+    for key in ["brand_name", "generic_name"]:
+        params = {"search": f"openfda.{key}:{term}", "limit": 1}
+        with tracing.span("fda.http", field=key) as span:
+            resp = session.get(OPENFDA_BASE, params=params, timeout=OPENFDA_TIMEOUT)
+            span.set(status=resp.status_code, bytes=len(resp.content))
+        if resp.status_code == 404:  # OpenFDA answers NOT_FOUND with a 404
+            continue
+        resp.raise_for_status()
+        data = resp.json().get("results", [])
+        if data:
+            return _label_to_result(drug_name, data[0])
+    return None
+
+def get_openfda_warnings(drug_name: str) -> Dict:
+    """
+    Searches the OpenFDA database for safety warnings. Returns a structured dictionary
+    with ALL FdaWarningOutput fields, also on failure.
+    """
+    with tracing.span("fda.lookup") as span:
+        result = fda_mirror.lookup(drug_name)
+        if result is not None:
+            span.set(cache="mirror")
+            return result
+        key = normalize_drug_name(drug_name)
+        cache = get_cache()
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                span.set(cache="hit")
+                return {**cached, "drug_name": drug_name}
+        span.set(cache="miss")
+        return _fetch_and_cache(drug_name, key, cache)
+
+def _fetch_and_cache(drug_name: str, key: str, cache: Optional[SqliteCache]) -> Dict:
+    try:
+        result = fetch_label(drug_name)
+    except Exception:
+        return not_found_result(drug_name)
+
+    if result is None:
+        result = not_found_result(drug_name)
+        ttl = OPENFDA_NEGATIVE_TTL
+    else:
+        ttl = OPENFDA_CACHE_TTL
+    if cache is not None:
+        cache.put(key, result, ttl=ttl)
+    return result
+
+def get_openfda_warnings_many(drug_names: List[str], max_concurrency: int = None) -> List[Dict]:
+    """
+    Looks up several drugs concurrently (at most `max_concurrency` requests in
+    flight, default OPENFDA_MAX_CONCURRENCY). Duplicate names are fetched once;
+    results come back in input order.
+    """
+    unique: Dict[str, str] = {}
+    for name in drug_names:
+        unique.setdefault(normalize_drug_name(name), name)
+    if not unique:
+        return []
+    workers = max(1, min(max_concurrency or OPENFDA_MAX_CONCURRENCY, len(unique)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="openfda") as pool:
+        fetched = dict(zip(unique, pool.map(tracing.bind_context(get_openfda_warnings), unique.values())))
+    return [{**fetched[normalize_drug_name(name)], "drug_name": name} for name in drug_names]
@@ -0,0 +1,74 @@
+# pdf_extract.py - Streaming, page-parallel PDF text extraction
+#
+# iter_pdf_pages() yields (page_number, text) one page at a time, so callers
+# never hold the whole document as one string. With workers > 1, page ranges
+# are extracted by a shared process pool; results still come back in page
+# order, and only a bounded number of ranges is in flight at once, which keeps
+# memory flat no matter how large the PDF is.
+#
+# Kept free of heavy imports: spawned pool workers import only this module and fitz.
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+# Worker processes for PDFs larger than one page range (1 = extract in-process).
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "64"))
+
+_POOL = None
+_POOL_WORKERS = 0
+_POOL_LOCK = threading.Lock()
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """One process pool per process, grown if a caller asks for more workers."""
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_WORKERS < workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False)
+            # spawn, not fork: callers (Streamlit, uvicorn) are multi-threaded.
+            _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _POOL_WORKERS = workers
+        return _POOL
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return [(i + 1, doc[i].get_text("text")) for i in range(start, stop)]
+
+def pdf_page_count(pdf_path: str) -> int:
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+def iter_pdf_pages(pdf_path: str, workers: int = None, pages_per_task: int = None) -> Iterator[Tuple[int, str]]:
+    """Yields (1-based page number, page text) in page order."""
+    import fitz
+
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"{pdf_path} not found")
+    workers = PDF_WORKERS if workers is None else workers
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+
+    with fitz.open(pdf_path) as doc:
+        n_pages = doc.page_count
+        if workers <= 1 or n_pages <= pages_per_task:
+            for i, page in enumerate(doc):
+                yield i + 1, page.get_text("text")
+            return
+
+    pool = _get_pool(workers)
+    ranges = [(s, min(s + pages_per_task, n_pages)) for s in range(0, n_pages, pages_per_task)]
+    max_in_flight = workers * 2
+    in_flight = []
+    next_range = 0
+    while next_range < len(ranges) or in_flight:
+        while next_range < len(ranges) and len(in_flight) < max_in_flight:
+            start, stop = ranges[next_range]
+            in_flight.append(pool.submit(_extract_range, pdf_path, start, stop))
+            next_range += 1
+        for page in in_flight.pop(0).result():
+            yield page
@@ -0,0 +1,251 @@
+# pipeline_dag.py - Small asyncio DAG executor for the agent pipeline
+#
+# Each Stage names the stages whose results it takes as positional arguments.
+# A stage starts as soon as all of its inputs are done, so independent work
+# overlaps and wall-clock time follows the critical path, not the sum of the
+# stages. Async stage functions run on the event loop; plain functions run in a
+# worker thread. Every stage has its own timeout and retry policy. A stage that
+# still fails yields an error string (like safe_task() did), and its dependents
+# run anyway, so one failed agent never loses the rest of the report.
+#
+# Events (on_event): stage_start, delta (streamed LLM text of the running stage),
+# stage_retry (discard that stage's streamed text), stage_complete.
+#
+# Setting the optional `cancel` event stops the run: no further stage starts,
+# running stages are cancelled, and run_dag() raises PipelineCancelled once
+# they have stopped (a plain-function stage finishes its current call first).
+#
+# A timeout cannot stop a plain-function stage either: its thread keeps running.
+# So its retry does not start a second copy of the call (and of its I/O); it
+# waits up to another timeout for the call that is already running.
+
+import asyncio
+import contextvars
+import inspect
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import tracing
+
+FAILED_PREFIX = "❌ Task failed: "
+CANCEL_POLL_S = 0.1
+
+class PipelineCancelled(Exception):
+    """The run was stopped through its `cancel` event."""
+
+# Set while a stage runs with an event handler; LLM helpers stream into it (see achat_completion).
+_DELTA_SINK: "contextvars.ContextVar[Optional[Callable[[str], None]]]" = contextvars.ContextVar("delta_sink", default=None)
+
+_CURRENT_STAGE: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("current_stage", default=None)
+
+def current_stage() -> Optional[str]:
+    """Name of the pipeline stage running in this context (None outside the DAG)."""
+    return _CURRENT_STAGE.get()
+
+# Token counts of the LLM calls made by the running stage (see record_stage_usage).
+_STAGE_USAGE: "contextvars.ContextVar[Optional[Dict[str, int]]]" = contextvars.ContextVar("stage_usage", default=None)
+_USAGE_LOCK = threading.Lock()
+
+def record_stage_usage(counts: Dict[str, int]):
+    """Adds one LLM response's token counts to the current stage (no-op outside the DAG)."""
+    usage = _STAGE_USAGE.get()
+    if usage is not None:
+        with _USAGE_LOCK:
+            for key, value in counts.items():
+                usage[key] = usage.get(key, 0) + value
+
+def current_delta_sink() -> Optional[Callable[[str], None]]:
+    """Callback for streamed text of the stage running in this context, if anyone is listening."""
+    return _DELTA_SINK.get()
+
+def set_delta_sink(sink: Optional[Callable[[str], None]]):
+    """Overrides the sink for the current task (e.g. None for concurrent sub-calls); returns a reset token."""
+    return _DELTA_SINK.set(sink)
+
+def is_failure(result: Any) -> bool:
+    """True for the placeholder result of a stage that failed after all retries."""
+    return isinstance(result, str) and result.startswith(FAILED_PREFIX)
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[..., Any]
+    deps: Sequence[str] = ()
+    label: str = None
+    timeout: Optional[float] = None   # seconds per attempt (None = no limit)
+    retries: int = 0                  # extra attempts after a failure or timeout
+    backoff: float = 1.0              # seconds before the first retry, doubled each time
+
+    def __post_init__(self):
+        self.label = self.label or self.name
+
+def _check_graph(stages: List[Stage]):
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names in {names}")
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"Stage {s.name!r} depends on unknown stage(s) {missing}")
+    state: Dict[str, int] = {}  # 1 visiting, 2 done
+
+    def visit(name, path):
+        if state.get(name) == 2:
+            return
+        if state.get(name) == 1:
+            raise ValueError(f"Cycle in pipeline: {' -> '.join(path + [name])}")
+        state[name] = 1
+        for d in by_name[name].deps:
+            visit(d, path + [name])
+        state[name] = 2
+
+    for name in names:
+        visit(name, [])
+
+def _emit(on_event, event: Dict[str, Any]):
+    if on_event is not None:
+        try:
+            on_event(event)
+        except Exception as e:
+            print(f"WARNING: pipeline event handler failed: {e}")
+
+class _ThreadTimeout(asyncio.TimeoutError):
+    """A plain-function attempt timed out; `call` is its still-running thread call."""
+
+    def __init__(self, call: "asyncio.Future"):
+        super().__init__()
+        self.call = call
+
+async def _call(stage: Stage, args: list, running: "asyncio.Future" = None):
+    """One attempt. `running` is the thread call of a timed-out attempt, waited for instead of a new call."""
+    if running is None and inspect.iscoroutinefunction(stage.fn):
+        coro = stage.fn(*args)
+        return await asyncio.wait_for(coro, stage.timeout) if stage.timeout else await coro
+    call = running or asyncio.ensure_future(asyncio.to_thread(stage.fn, *args))
+    try:
+        result = await asyncio.wait_for(asyncio.shield(call), stage.timeout) if stage.timeout else await call
+    except asyncio.TimeoutError:
+        raise _ThreadTimeout(call) from None
+    if inspect.isawaitable(result):  # e.g. a lambda that returns a coroutine
+        result = await asyncio.wait_for(result, stage.timeout) if stage.timeout else await result
+    return result
+
+async def _run_stage(stage: Stage, tasks: Dict[str, "asyncio.Task"], timings: Dict[str, Dict], on_event):
+    args = [await tasks[d] for d in stage.deps]
+    start = time.perf_counter()
+    timings[stage.name] = {"start": start}
+    _emit(on_event, {"type": "stage_start", "stage": stage.name, "label": stage.label})
+    with tracing.span("stage", stage=stage.name) as span:
+        result, error, attempt, usage = await _attempt_stage(stage, args, on_event)
+        span.set(ok=error is None, retries=attempt, tokens_in=usage.get("prompt_tokens", 0),
+                 tokens_out=usage.get("completion_tokens", 0))
+    end = time.perf_counter()
+    if usage:
+        print(f"📊 {stage.label}: {usage.get('prompt_tokens', 0)} tokens in / {usage.get('completion_tokens', 0)} tokens out")
+    timings[stage.name].update(end=end, seconds=end - start, attempts=attempt + 1, ok=error is None,
+                               tokens_in=usage.get("prompt_tokens", 0), tokens_out=usage.get("completion_tokens", 0))
+    _emit(on_event, {"type": "stage_complete", "stage": stage.name, "label": stage.label,
+                     "ok": error is None, "seconds": end - start, "result": result, "usage": dict(usage)})
+    return result
+
+async def _attempt_stage(stage: Stage, args: list, on_event):
+    """Runs the stage with its retry policy; returns (result, error or None, last attempt index, token usage)."""
+    _CURRENT_STAGE.set(stage.name)
+    usage: Dict[str, int] = {}
+    _STAGE_USAGE.set(usage)
+    if on_event is not None:
+        _DELTA_SINK.set(lambda text: _emit(on_event, {"type": "delta", "stage": stage.name, "text": text}))
+    error, running = None, None
+    for attempt in range(stage.retries + 1):
+        if attempt:
+            _emit(on_event, {"type": "stage_retry", "stage": stage.name, "label": stage.label, "attempt": attempt + 1})
+            if running is None:
+                await asyncio.sleep(stage.backoff * 2 ** (attempt - 1))
+        try:
+            result = await _call(stage, args, running)
+            error = None
+            break
+        except _ThreadTimeout as e:
+            running = e.call
+            error = TimeoutError(f"timed out after {stage.timeout:g}s")
+        except asyncio.TimeoutError:
+            running = None
+            error = TimeoutError(f"timed out after {stage.timeout:g}s")
+        except Exception as e:
+            running, error = None, e
+        print(f"WARNING: {stage.label} attempt {attempt + 1}/{stage.retries + 1} failed: {error}")
+    if error is None:
+        print(f"✅ {stage.label} succeeded.")
+    else:
+        print(f"❌ {stage.label} failed: {error}")
+        result = f"{FAILED_PREFIX}{stage.label} | Error: {error}"
+    return result, error, attempt, usage
+
+async def _watch_cancel(cancel: threading.Event, tasks: Dict[str, "asyncio.Task"]):
+    while not cancel.is_set():
+        await asyncio.sleep(CANCEL_POLL_S)
+    for task in tasks.values():
+        task.cancel()
+
+async def arun_dag(stages: List[Stage], on_event: Callable[[Dict[str, Any]], None] = None,
+                   timings: Dict[str, Dict] = None, cancel: threading.Event = None) -> Dict[str, Any]:
+    """
+    Runs all stages; returns {stage name: result}. Pass `timings` to collect
+    per-stage timing, and `cancel` to be able to stop the run from another thread.
+    """
+    _check_graph(stages)
+    timings = {} if timings is None else timings
+    t0 = time.perf_counter()
+    tasks: Dict[str, asyncio.Task] = {}
+    with tracing.span("pipeline", stages=len(stages)):
+        for stage in stages:
+            tasks[stage.name] = asyncio.ensure_future(_run_stage(stage, tasks, timings, on_event))
+        watcher = asyncio.ensure_future(_watch_cancel(cancel, tasks)) if cancel is not None else None
+        try:
+            results = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+        except asyncio.CancelledError:
+            if cancel is None or not cancel.is_set():
+                raise
+            await asyncio.gather(*tasks.values(), return_exceptions=True)  # let every stage unwind
+            done = sum(1 for t in timings.values() if "end" in t)
+            print(f"WARNING: pipeline cancelled after {done}/{len(stages)} stages")
+            raise PipelineCancelled("pipeline cancelled") from None
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+    wall = time.perf_counter() - t0
+    summed = sum(t.get("seconds", 0.0) for t in timings.values())
+    print(f"⏱️ Pipeline finished in {wall:.1f}s (stages sum to {summed:.1f}s)")
+    tokens_in = sum(t.get("tokens_in", 0) for t in timings.values())
+    if tokens_in:
+        print(f"📊 Pipeline tokens: {tokens_in} in / {sum(t.get('tokens_out', 0) for t in timings.values())} out")
+    return results
+
+def run_coroutine_sync(coro):
+    """Runs a coroutine to completion from sync code, also from a thread that already runs an event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    box: Dict[str, Any] = {}
+
+    def runner():
+        try:
+            box["result"] = asyncio.run(coro)
+        except BaseException as e:
+            box["error"] = e
+
+    thread = threading.Thread(target=runner, name="pipeline-dag")
+    thread.start()
+    thread.join()
+    if "error" in box:
+        raise box["error"]
+    return box["result"]
+
+def run_dag(stages: List[Stage], on_event: Callable[[Dict[str, Any]], None] = None,
+            timings: Dict[str, Dict] = None, cancel: threading.Event = None) -> Dict[str, Any]:
+    """Blocking wrapper around arun_dag()."""
+    return run_coroutine_sync(arun_dag(stages, on_event, timings, cancel))
@@ -0,0 +1,267 @@
+# structured_labs.py - Deterministic parsing of tabular lab / vitals results
+#
+# Lab exports (CSV/TSV such as "sample data/health_vitals.csv") and simple
+# "Test: value unit (range)" text files do not need an LLM to pull values out.
+# They are parsed into a typed table:
+#
+#   patient | test | value | value2 | unit | ref_low | ref_high | ref_low2 | ref_high2 | flag
+#
+# where value2 / *2 hold the second component of compound results such as blood
+# pressure ("150/95 mmHg" against "120/80 mmHg"). Abnormal flags are computed with
+# vectorized pandas/NumPy over the whole table, and only a compact list of the
+# abnormal findings (per-test aggregates for large tables) goes to later stages.
+
+import os
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+LABS_MAX_FINDINGS = int(os.getenv("LABS_MAX_FINDINGS", "40"))
+# A .txt file is parsed as key-value labs when at least this share of its lines are "Test: number ..." rows.
+LABS_KV_MIN_FRACTION = float(os.getenv("LABS_KV_MIN_FRACTION", "0.6"))
+
+TABLE_EXTS = (".csv", ".tsv")
+
+# Normalized header (lowercase, alphanumerics only) -> column
+_COLUMNS = {
+    "patient": ("patientid", "patient", "id", "mrn", "subject", "subjectid"),
+    "test": ("test", "testname", "analyte", "parameter", "name", "investigation", "component", "vital"),
+    "result": ("result", "value", "resultvalue", "observation", "reading"),
+    "unit": ("unit", "units", "uom"),
+    "range": ("normalrange", "referencerange", "refrange", "range", "reference", "referenceinterval", "normal"),
+    "flag": ("flag", "abnormalflag", "interpretation", "status"),
+}
+
+_NUM = r"\d+(?:[.,]\d+)?"
+# "155 mg/dL", "<5", "150/95 mmHg"
+_RESULT = re.compile(rf"^\s*(?P<cmp>[<>]=?|[≤≥])?\s*(?P<v1>-?{_NUM})(?:\s*/\s*(?P<v2>{_NUM}))?\s*(?P<unit>\S.*)?$")
+# "70-110 mg/dL", "< 200", ">= 40", "3.5–5.0", "120/80 mmHg", "90-120/60-80 mmHg"
+_RANGE = re.compile(rf"^\s*(?P<op>[<>]=?|[≤≥]|up to)?\s*(?P<a>{_NUM})(?:\s*(?:-|–|to)\s*(?P<b>{_NUM}))?"
+                    rf"(?:\s*/\s*(?P<c>{_NUM})(?:\s*(?:-|–|to)\s*(?P<d>{_NUM}))?)?\s*(?P<unit>\S.*)?$", re.I)
+# "Glucose: 155 mg/dL (70-110 mg/dL)", "Hemoglobin = 10.2 g/dL ref 13-17"
+_KV_LINE = re.compile(rf"^\s*(?P<test>[A-Za-z][\w ()%,.'/-]{{0,60}}?)\s*[:=]\s*(?P<result>[<>≤≥]?=?\s*-?{_NUM}(?:\s*/\s*{_NUM})?[^(\[;]*?)"
+                      rf"\s*(?:[(\[]\s*(?:ref(?:erence)?(?: range)?[:\s]*|normal[:\s]*)?(?P<range>[^)\]]+)[)\]]|[;,]?\s*(?:ref(?:erence)?(?: range)?|normal)[:\s]+(?P<range2>.+))?\s*$", re.I)
+# "Patient ID: 12345", "Report No: 7" are identifiers, not results.
+_IDENTIFIER = re.compile(r"\b(?:id|mrn|no|number|date|phone|age)\b\.?$", re.I)
+# "Label: anything" lines that are not results; "Results:" alone is a section header.
+_LABELED = re.compile(r"^\s*(?P<label>[A-Za-z][^:=]{0,60}?)\s*[:=]\s*(?P<value>.*?)\s*$")
+
+# -------------------------
+# Loading
+# -------------------------
+def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    mapping = {}
+    for col in df.columns:
+        key = re.sub(r"[^a-z0-9]", "", str(col).lower())
+        for target, aliases in _COLUMNS.items():
+            if key in aliases and target not in mapping.values():
+                mapping[col] = target
+                break
+    df = df.rename(columns=mapping)
+    if "test" not in df.columns or "result" not in df.columns:
+        raise ValueError(f"no test/result columns in {list(mapping) or list(df.columns)}")
+    return df
+
+def read_table(path: str) -> pd.DataFrame:
+    """Reads a CSV/TSV lab export into raw string columns test/result (+ patient/unit/range/flag)."""
+    sep = "\t" if path.lower().endswith(".tsv") else None  # None: sniff , or ;
+    df = pd.read_csv(path, sep=sep, dtype=str, keep_default_na=False, skipinitialspace=True,
+                     engine="c" if sep else "python")
+    return _normalize_columns(df)
+
+def parse_key_value(text: str) -> (pd.DataFrame, List[str]):
+    """
+    Splits "Test: value unit (range)" lines into a raw table; returns (table,
+    free-text lines). Identifier lines and bare section headers are dropped.
+    """
+    rows, rest = [], []
+    for line in text.splitlines():
+        match = _KV_LINE.match(line)
+        if match and _IDENTIFIER.search(match["test"]):
+            continue
+        if match:
+            rows.append({"test": match["test"], "result": match["result"], "range": match["range"] or match["range2"] or ""})
+        elif line.strip():
+            labeled = _LABELED.match(line)
+            if labeled and (_IDENTIFIER.search(labeled["label"]) or not labeled["value"]):
+                continue
+            rest.append(line)
+    return pd.DataFrame(rows, columns=["test", "result", "range"]), rest
+
+def looks_like_key_value(text: str) -> bool:
+    lines = [line for line in text.splitlines() if line.strip()]
+    matched = sum(1 for line in lines if _KV_LINE.match(line))
+    return matched >= 3 and matched >= LABS_KV_MIN_FRACTION * len(lines)
+
+# -------------------------
+# Typing and flags (vectorized)
+# -------------------------
+def _to_float(s: pd.Series) -> pd.Series:
+    return pd.to_numeric(s.str.replace(",", ".", regex=False), errors="coerce")
+
+def _per_unique(s: pd.Series, fn) -> pd.DataFrame:
+    """Applies `fn` (Series -> DataFrame) once per distinct value and broadcasts back: exports repeat
+    the same ranges, units and often results thousands of times."""
+    codes, uniques = pd.factorize(s)
+    out = fn(pd.Series(uniques, dtype=object))
+    return pd.DataFrame({col: out[col].to_numpy()[codes] for col in out.columns}, index=s.index)
+
+def _extract(s: pd.Series, pattern: re.Pattern, numeric: str) -> pd.DataFrame:
+    def fn(u):
+        ext = u.str.extract(pattern)
+        for col in numeric:
+            ext[col] = _to_float(ext[col])
+        return ext
+    return _per_unique(s, fn)
+
+def _clean(s: pd.Series) -> pd.Series:
+    return _per_unique(s.astype(str), lambda u: u.str.strip().to_frame("v"))["v"]
+
+def _parse_results(results: pd.Series) -> pd.DataFrame:
+    """v1/v2/unit columns. Plain "155 mg/dL" values take a split + to_numeric fast path; the rest
+    (compound values, "<5", decimal commas, "155mg/dL") go through the regex."""
+    def fn(u):
+        value, _, unit = zip(*(r.partition(" ") for r in u)) if len(u) else ((), (), ())
+        out = pd.DataFrame({"v1": pd.to_numeric(pd.Series(value, dtype=object), errors="coerce"),
+                            "v2": np.nan, "unit": pd.Series(unit, dtype=object)})
+        slow = out["v1"].isna().to_numpy()
+        if slow.any():
+            ext = u[slow].str.extract(_RESULT)
+            out.loc[slow, ["v1", "v2", "unit"]] = np.column_stack(
+                [_to_float(ext["v1"]), _to_float(ext["v2"]), ext["unit"]])
+        return out
+    return _per_unique(results, fn)
+
+def _unit_key(s: pd.Series) -> pd.Series:
+    key = lambda u: u.fillna("").str.lower().str.replace(r"[\s.]", "", regex=True).str.replace("µ", "u", regex=False).to_frame("k")
+    return _per_unique(s.fillna(""), key)["k"]
+
+def parse_table(raw: pd.DataFrame) -> pd.DataFrame:
+    """Typed columns and abnormal flags ("H", "L" or "") for a raw table from read_table/parse_key_value."""
+    n = len(raw)
+    empty = pd.Series([""] * n, index=raw.index, dtype=object)
+    results = _clean(raw["result"])
+    ranges = _clean(raw.get("range", empty))
+    result = _parse_results(results)
+    ref = _extract(ranges, _RANGE, "abcd")
+    df = pd.DataFrame({
+        "patient": _clean(raw.get("patient", empty)),
+        "test": _clean(raw["test"]),
+        "result": results,
+        "range": ranges,
+        "value": result["v1"],
+        "value2": result["v2"],
+    })
+    unit = result["unit"].fillna("").str.strip()
+    if "unit" in raw.columns:  # a separate unit column wins over a unit written next to the value
+        given = _clean(raw["unit"])
+        unit = given.where(given != "", unit)
+    df["unit"] = unit
+
+    a, b, c, d = (ref[k] for k in "abcd")
+    op = ref["op"].fillna("").str.lower()
+    upper = op.isin(["<", "<=", "≤", "up to"])
+    lower = op.isin([">", ">=", "≥"])
+    compound = c.notna()
+    # One component: "lo-hi", "< hi" or "> lo". Compound ("120/80"): a bare number per side is an upper limit.
+    df["ref_low"] = np.where(b.notna(), a, np.where(lower, a, np.nan))
+    df["ref_high"] = np.where(b.notna(), b, np.where(upper | (compound & ~lower), a, np.nan))
+    df["ref_low2"] = np.where(d.notna(), c, np.where(compound & lower, c, np.nan))
+    df["ref_high2"] = np.where(d.notna(), d, np.where(compound & ~lower, c, np.nan))
+    ref_unit, result_unit = _unit_key(ref["unit"]), _unit_key(df["unit"])
+    df["unit_mismatch"] = (ref_unit != "") & (result_unit != "") & (ref_unit != result_unit)
+
+    comparable = ~df["unit_mismatch"].to_numpy()
+    with np.errstate(invalid="ignore"):
+        high = comparable & ((df["value"] > df["ref_high"]) | (df["value2"] > df["ref_high2"])).to_numpy()
+        low = comparable & ((df["value"] < df["ref_low"]) | (df["value2"] < df["ref_low2"])).to_numpy()
+    flag = np.select([high, low], ["H", "L"], "")
+    if "flag" in raw.columns:  # the lab's own flag, where no range could be used
+        given = raw["flag"].astype(str).str.strip().str.upper().str[:1]
+        flag = np.where((flag == "") & given.isin(["H", "L", "A"]).to_numpy(), given.to_numpy(), flag)
+    df["flag"] = flag
+
+    # Relative distance outside the range, for ordering findings.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        over = np.fmax((df["value"] - df["ref_high"]) / df["ref_high"], (df["value2"] - df["ref_high2"]) / df["ref_high2"])
+        under = np.fmax((df["ref_low"] - df["value"]) / df["ref_low"], (df["ref_low2"] - df["value2"]) / df["ref_low2"])
+    df["severity"] = np.fmax(over, under).fillna(0).clip(lower=0)
+    return df
+
+# -------------------------
+# Findings
+# -------------------------
+def _fmt(v: float) -> str:
+    return f"{v:g}"
+
+def _span(lo: float, hi: float) -> str:
+    return f"{_fmt(lo)}-{_fmt(hi)}" if lo != hi else _fmt(lo)
+
+def _range_text(row) -> str:
+    return row["range"] if row["range"] else "no reference range"
+
+def summarize(df: pd.DataFrame, source: str = "", max_findings: int = None) -> str:
+    """Compact bullet list of abnormal results (per-test aggregates when there are more than `max_findings`)."""
+    max_findings = LABS_MAX_FINDINGS if max_findings is None else max_findings
+    abnormal = df[df["flag"] != ""].sort_values("severity", ascending=False, kind="stable")
+    parsed = int(df["value"].notna().sum())
+    header = (f"Structured lab results{f' from {source}' if source else ''}: {len(df)} rows, "
+              f"{parsed} numeric, {len(abnormal)} abnormal (parsed without LLM).")
+    lines = [header]
+    label = {"H": "HIGH", "L": "LOW", "A": "ABNORMAL"}
+    patients = df.loc[df["patient"] != "", "patient"].nunique()
+    if len(abnormal) <= max_findings:
+        for _, row in abnormal.iterrows():
+            who = f" [patient {row['patient']}]" if patients > 1 and row["patient"] else ""
+            lines.append(f"- {row['test']}: {row['result']} ({_range_text(row)}) {label[row['flag']]}{who}")
+    else:
+        groups = abnormal.groupby(["test", "flag"], sort=False)
+        summary = groups.agg(count=("value", "size"), worst=("severity", "max"), lo=("value", "min"),
+                             hi=("value", "max"), lo2=("value2", "min"), hi2=("value2", "max"),
+                             unit=("unit", "first"), range=("range", "first"))
+        totals = df.groupby("test")["value"].size()
+        summary = summary.sort_values(["worst", "count"], ascending=False).head(max_findings)
+        for (test, flag), row in summary.iterrows():
+            values = _span(row["lo"], row["hi"])
+            if pd.notna(row["lo2"]):  # compound values such as blood pressure
+                values += "/" + _span(row["lo2"], row["hi2"])
+            lines.append(f"- {test}: {row['count']}/{totals[test]} results {label[flag]} "
+                         f"(values {values} {row['unit']}; ref {row['range'] or 'n/a'})".rstrip())
+        if len(groups) > max_findings:
+            lines.append(f"- ... {len(groups) - max_findings} more abnormal tests omitted")
+    mismatched = int(df["unit_mismatch"].sum())
+    if mismatched:
+        lines.append(f"- {mismatched} results not compared: result and reference units differ")
+    # Values the table gives no range for are listed as-is for later stages to judge.
+    ranged = df[["ref_low", "ref_high", "ref_low2", "ref_high2"]].notna().any(axis=1)
+    unranged = df[~ranged & df["value"].notna() & (df["flag"] == "")]
+    if len(unranged) <= max_findings:
+        values = [f"{row['test']} {row['result']}" for _, row in unranged.iterrows()]
+    else:
+        per_test = unranged.groupby("test", sort=False).agg(n=("value", "size"), lo=("value", "min"),
+                                                             hi=("value", "max"), unit=("unit", "first"))
+        values = [f"{test} {_span(row['lo'], row['hi'])} {row['unit']} (n={row['n']})".replace("  ", " ")
+                  for test, row in per_test.head(max_findings).iterrows()]
+    if values:
+        lines.append("- No reference range: " + "; ".join(values))
+    if not len(abnormal) and ranged.any():
+        lines.append("- All results with a reference range are within normal limits.")
+    return "\n".join(lines)
+
+def analyze_file(path: str, text: Optional[str] = None) -> Optional[Dict]:
+    """
+    Structured analysis of a CSV/TSV file, or of key-value lab text (`text`).
+    Returns {"findings": str, "rest": str (free text that is not a result), "rows": int}
+    or None when the input is not structured.
+    """
+    name = os.path.basename(path)
+    if text is None:
+        raw, rest = read_table(path), []
+    else:
+        if not looks_like_key_value(text):
+            return None
+        raw, rest = parse_key_value(text)
+    df = parse_table(raw)
+    return {"findings": summarize(df, name), "rest": "\n".join(rest), "rows": len(df)}
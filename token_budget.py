@@ -0,0 +1,173 @@
+# token_budget.py - Prompt token counting and per-stage input budgets
+#
+# Stage inputs grow along the pipeline (the advisory prompt carries the document
+# findings, ICD codes, reasoning and the treatment plan). fit() counts the tokens
+# of a stage's input and, when it exceeds the stage budget, compacts it in steps
+# until it fits:
+#   1. de-duplication: repeated lines/bullets (the same finding restated by
+#      several upstream stages) are kept once
+#   2. structured-findings passthrough: bullets carrying values, units or ICD
+#      codes, and short headings, are kept verbatim
+#   3. extractive selection: the remaining sentences are ranked by similarity to
+#      the query (default: the centroid of the input) with the shared MiniLM
+#      embedder, and the best ones are kept in their original order
+#   4. a hard token cut as the last resort
+#
+# Tokens are counted with tiktoken (cl100k_base, close to the Llama tokenizer)
+# or, when its encoding is not available offline, estimated at 4 chars/token.
+
+import os
+import re
+import numpy as np
+from typing import Dict, List, Optional
+
+# Input budgets in tokens per agent prompt; TOKEN_BUDGETS="reasoning=4000,advisory=3000" overrides.
+DEFAULT_BUDGETS = {"icd": 6000, "reasoning": 8000, "kb_format": 4000, "plan": 10000, "advisory": 8000}
+TOKEN_BUDGET_DEFAULT = int(os.getenv("TOKEN_BUDGET_DEFAULT", "12000"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+def _parse_budgets(spec: str) -> Dict[str, int]:
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            budgets[name.strip()] = int(value)
+    return budgets
+
+STAGE_BUDGETS = _parse_budgets(os.getenv("TOKEN_BUDGETS", ""))
+
+# -------------------------
+# Counting
+# -------------------------
+class _CharEstimate:
+    """Fallback tokenizer: ~4 characters per token."""
+
+    def encode(self, text: str, **kwargs) -> List[int]:
+        return [0] * ((len(text) + 3) // 4)
+
+def _load_tokenizer():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        print(f"WARNING: tiktoken encoding {TOKENIZER_ENCODING} unavailable ({type(e).__name__}); estimating 4 chars/token.")
+        return _CharEstimate()
+
+def get_tokenizer():
+    from data_analyze import get_resource
+    return get_resource("tokenizer", _load_tokenizer)
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer().encode(text, disallowed_special=())) if text else 0
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    tokenizer = get_tokenizer()
+    if isinstance(tokenizer, _CharEstimate):
+        return text[:max_tokens * 4]
+    ids = tokenizer.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else tokenizer.decode(ids[:max_tokens])
+
+# -------------------------
+# Compaction
+# -------------------------
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+_FINDING = re.compile(r"\d|\b[A-TV-Z]\d{2}(?:\.\d+)?\b")  # values/units, or an ICD-10 code
+_SENTENCE = re.compile(r"(?<=[.!?])\s+(?=[A-Z(])")
+
+def _line_key(line: str) -> str:
+    line = _BULLET.sub("", line).replace("**", "").lower()
+    return " ".join(re.sub(r"[^\w%/.<>=+-]+", " ", line).split()).rstrip(".")
+
+def dedup_lines(text: str, min_repeats: int = 1) -> str:
+    """
+    Drops repeated lines (compared after normalizing bullets and punctuation),
+    keeping the first. With `min_repeats` > 1 only lines seen at least that
+    many times are collapsed, e.g. 3 for page headers/footers of a PDF dump;
+    short lines (table cells such as "Normal" or "mg/dL") are then left alone.
+    """
+    lines = text.splitlines()
+    keys = [_line_key(line) for line in lines]
+    if min_repeats > 1:
+        counts: Dict[str, int] = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+    seen, kept = set(), []
+    for line, key in zip(lines, keys):
+        if key:
+            if key in seen and (min_repeats <= 1 or (counts[key] >= min_repeats and key.count(" ") >= 2)):
+                continue
+            seen.add(key)
+        kept.append(line)
+    return "\n".join(kept)
+
+def _is_structured(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped:
+        return True
+    if _BULLET.match(line) and _FINDING.search(stripped):
+        return True
+    return len(stripped) <= 60 and (stripped.endswith(":") or stripped.startswith("#"))
+
+def _select_sentences(units: List[str], query: Optional[str], budget: int) -> List[int]:
+    """Indices of the units to keep: the most relevant ones that fit in `budget` tokens."""
+    costs = [count_tokens(u) + 1 for u in units]
+    try:
+        from data_analyze import get_embedder
+        vecs = np.asarray(get_embedder().encode(units + ([query] if query else []), normalize_embeddings=True))
+        target = vecs[-1] if query else vecs.mean(axis=0)
+        scores = vecs[:len(units)] @ target
+        order = np.argsort(-scores, kind="stable")
+    except Exception as e:
+        print(f"WARNING: extractive selection without embeddings ({e}); keeping the earliest sentences.")
+        order = range(len(units))
+    keep, used = [], 0
+    for i in order:
+        if used + costs[i] <= budget:
+            keep.append(int(i))
+            used += costs[i]
+    return sorted(keep)
+
+def compact(text: str, budget: int, query: str = None) -> str:
+    """Shrinks `text` to at most `budget` tokens (see module comment for the steps)."""
+    text = dedup_lines(text)
+    if count_tokens(text) <= budget:
+        return text
+    lines = text.splitlines()
+    structured = [_is_structured(line) for line in lines]
+    fixed = sum(count_tokens(line) + 1 for line, s in zip(lines, structured) if s)
+    if fixed > budget:  # findings alone are over budget: rank them too
+        structured = [not line.strip() for line in lines]
+        fixed = 0
+    # Free text is split into sentences; each one remembers its line.
+    units, owners = [], []
+    for i, line in enumerate(lines):
+        if not structured[i]:
+            for sentence in _SENTENCE.split(line.strip()):
+                units.append(sentence)
+                owners.append(i)
+    keep = _select_sentences(units, query, budget - fixed) if units else []
+    kept_by_line: Dict[int, List[str]] = {}
+    for k in keep:
+        kept_by_line.setdefault(owners[k], []).append(units[k])
+    out = []
+    for i, line in enumerate(lines):
+        if structured[i]:
+            out.append(line)
+        elif i in kept_by_line:
+            indent = line[:len(line) - len(line.lstrip())]
+            out.append(indent + " ".join(kept_by_line[i]))
+    result = re.sub(r"\n{3,}", "\n\n", "\n".join(out)).strip()
+    return result if count_tokens(result) <= budget else truncate_tokens(result, budget)
+
+def budget_for(stage: str) -> int:
+    return STAGE_BUDGETS.get(stage, TOKEN_BUDGET_DEFAULT)
+
+def fit(stage: str, text: str, query: str = None, budget: int = None) -> str:
+    """`text` unchanged when it is within the stage budget, else compacted to fit."""
+    budget = budget or budget_for(stage)
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return text
+    compacted = compact(text, budget, query)
+    print(f"📊 Token budget [{stage}]: input compacted {tokens} -> {count_tokens(compacted)} tokens (budget {budget})")
+    return compacted
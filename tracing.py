@@ -0,0 +1,269 @@
+# tracing.py - Timing spans, Prometheus-style metrics and trace reports
+#
+# span() times a block of sync or async code and records it:
+#   - always, into in-process metrics: a latency histogram per span name (split
+#     by stage or tool), recent-sample p50/p95/p99, error counts and attribute totals
+#     (tokens in/out, bytes, cache hits/misses). The MCP servers serve them at
+#     GET /metrics (mcp_routes.add_metrics_route).
+#   - when TRACE_PATH is set, as one JSON line per span (trace id, parent span,
+#     start, duration, attributes, error).
+# Spans nest through a contextvar, so the pipeline DAG, its stages and the I/O
+# calls made by a stage (LLM, OpenFDA HTTP, embedding, FAISS search) end up in
+# one trace. Work handed to a thread pool keeps its parent via bind_context().
+#
+#   python tracing.py report .cache/traces.jsonl      per-stage latency breakdown
+#
+# Stdlib only, so any module can import it cheaply.
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Empty string: no JSONL export (metrics are still collected).
+TRACE_PATH = os.getenv("TRACE_PATH", "")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILE_WINDOW = int(os.getenv("TRACE_QUANTILE_WINDOW", "2048"))  # recent samples per series
+# Numeric attributes summed into counters.
+_COUNTED_ATTRS = ("tokens_in", "tokens_out", "bytes", "retries")
+# Attributes that split a span name into separate metric series (first one present wins).
+_SERIES_ATTRS = ("stage", "tool")
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "duration", "attrs", "error", "_t0")
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+        self.start = time.time()
+        self.duration = 0.0
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key: str, value: float):
+        """Adds to a numeric attribute (e.g. tokens over several responses)."""
+        self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+                "start": round(self.start, 6), "duration_s": round(self.duration, 6), "attrs": self.attrs,
+                "error": self.error}
+
+_CURRENT: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+def current_span() -> Optional[Span]:
+    return _CURRENT.get()
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """Times the enclosed block as a child of the current span (works inside coroutines too)."""
+    s = Span(name, _CURRENT.get(), attrs)
+    token = _CURRENT.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.duration = time.perf_counter() - s._t0
+        _CURRENT.reset(token)
+        _record(s)
+
+def bind_context(fn: Callable) -> Callable:
+    """`fn` running in the caller's context (current span) when called from another thread."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+# -------------------------
+# Metrics
+# -------------------------
+class _Series:
+    __slots__ = ("count", "total", "errors", "buckets", "recent", "counters")
+
+    def __init__(self):
+        self.count, self.total, self.errors = 0, 0.0, 0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent: deque = deque(maxlen=QUANTILE_WINDOW)
+        self.counters: Dict[str, float] = {}
+
+_SERIES: Dict[tuple, _Series] = {}
+_METRICS_LOCK = threading.Lock()
+
+def _record(s: Span):
+    label = next(((a, str(s.attrs[a])) for a in _SERIES_ATTRS if s.attrs.get(a)), ())
+    key = (s.name, label)
+    with _METRICS_LOCK:
+        series = _SERIES.get(key)
+        if series is None:
+            series = _SERIES[key] = _Series()
+        series.count += 1
+        series.total += s.duration
+        series.recent.append(s.duration)
+        if s.error is not None:
+            series.errors += 1
+        for i, bound in enumerate(BUCKETS):
+            if s.duration <= bound:
+                series.buckets[i] += 1
+        for attr in _COUNTED_ATTRS:
+            value = s.attrs.get(attr)
+            if isinstance(value, (int, float)):
+                series.counters[attr] = series.counters.get(attr, 0) + value
+        cache = s.attrs.get("cache")
+        if cache:
+            series.counters[f"cache_{cache}"] = series.counters.get(f"cache_{cache}", 0) + 1
+    if TRACE_PATH:
+        _export(s)
+
+def quantile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _labels(name: str, label: tuple, **extra) -> str:
+    labels = {"span": name, **dict([label] if label else []), **extra}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+def prometheus_metrics(prefix: str = "carecrew") -> str:
+    """All span series in the Prometheus text exposition format."""
+    with _METRICS_LOCK:
+        snapshot = {key: (s.count, s.total, s.errors, list(s.buckets), list(s.recent), dict(s.counters))
+                    for key, s in _SERIES.items()}
+    lines = [f"# HELP {prefix}_span_seconds Span latency.", f"# TYPE {prefix}_span_seconds histogram"]
+    for (name, label), (count, total, _, buckets, _, _) in sorted(snapshot.items()):
+        for bound, n in zip(BUCKETS, buckets):
+            lines.append(f"{prefix}_span_seconds_bucket{_labels(name, label, le=bound)} {n}")
+        lines.append(f"{prefix}_span_seconds_bucket{_labels(name, label, le='+Inf')} {count}")
+        lines.append(f"{prefix}_span_seconds_sum{_labels(name, label)} {total:.6f}")
+        lines.append(f"{prefix}_span_seconds_count{_labels(name, label)} {count}")
+    lines += [f"# HELP {prefix}_span_latency_seconds Span latency quantiles over the last {QUANTILE_WINDOW} samples.",
+              f"# TYPE {prefix}_span_latency_seconds summary"]
+    for (name, label), (count, total, _, _, recent, _) in sorted(snapshot.items()):
+        for q in (0.5, 0.95, 0.99):
+            lines.append(f"{prefix}_span_latency_seconds{_labels(name, label, quantile=q)} {quantile(recent, q):.6f}")
+        lines.append(f"{prefix}_span_latency_seconds_sum{_labels(name, label)} {total:.6f}")
+        lines.append(f"{prefix}_span_latency_seconds_count{_labels(name, label)} {count}")
+    lines += [f"# HELP {prefix}_span_errors_total Spans that ended with an exception.",
+              f"# TYPE {prefix}_span_errors_total counter"]
+    for (name, label), (_, _, errors, _, _, _) in sorted(snapshot.items()):
+        lines.append(f"{prefix}_span_errors_total{_labels(name, label)} {errors}")
+    lines += [f"# HELP {prefix}_span_attr_total Sums of span attributes (tokens, bytes, retries, cache results).",
+              f"# TYPE {prefix}_span_attr_total counter"]
+    for (name, label), (_, _, _, _, _, counters) in sorted(snapshot.items()):
+        for attr, value in sorted(counters.items()):
+            lines.append(f"{prefix}_span_attr_total{_labels(name, label, attr=attr)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+def reset_metrics():
+    with _METRICS_LOCK:
+        _SERIES.clear()
+
+# -------------------------
+# JSONL export
+# -------------------------
+_export_lock = threading.Lock()
+_export_file = None
+
+def set_trace_path(path: str):
+    """Starts (or, with "", stops) writing spans to `path`."""
+    global TRACE_PATH, _export_file
+    with _export_lock:
+        if _export_file is not None:
+            _export_file.close()
+            _export_file = None
+        TRACE_PATH = path
+
+def _export(s: Span):
+    global _export_file
+    line = json.dumps(s.to_dict(), default=str, ensure_ascii=False)
+    with _export_lock:
+        if _export_file is None:
+            if os.path.dirname(TRACE_PATH):
+                os.makedirs(os.path.dirname(TRACE_PATH), exist_ok=True)
+            _export_file = open(TRACE_PATH, "a", encoding="utf-8", buffering=1)
+        _export_file.write(line + "\n")
+
+# -------------------------
+# Report
+# -------------------------
+def read_spans(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _row(name: str, durations: List[float], width: int) -> str:
+    return (f"{name:<{width}} {len(durations):>6} {sum(durations):>9.2f} {quantile(durations, 0.5):>8.3f} "
+            f"{quantile(durations, 0.95):>8.3f} {quantile(durations, 0.99):>8.3f}")
+
+def report(spans: List[Dict[str, Any]]) -> str:
+    """Per-stage latency table, I/O span table, and the time each stage spent in each kind of I/O."""
+    by_id = {s["span_id"]: s for s in spans}
+    traces = {s["trace_id"] for s in spans}
+
+    def stage_of(s) -> Optional[str]:
+        while s is not None:
+            if s["name"] == "stage":
+                return s["attrs"].get("stage")
+            s = by_id.get(s["parent_id"])
+        return None
+
+    stages: Dict[str, List[float]] = {}
+    io: Dict[str, List[float]] = {}
+    breakdown: Dict[str, Dict[str, float]] = {}
+    errors: Dict[str, int] = {}
+    for s in spans:
+        if s.get("error"):
+            errors[s["name"]] = errors.get(s["name"], 0) + 1
+        if s["name"] == "stage":
+            stages.setdefault(s["attrs"].get("stage", "?"), []).append(s["duration_s"])
+        elif s["name"] != "pipeline":
+            io.setdefault(s["name"], []).append(s["duration_s"])
+            stage = stage_of(by_id.get(s["parent_id"]))
+            if stage is not None:
+                per = breakdown.setdefault(stage, {})
+                per[s["name"]] = per.get(s["name"], 0.0) + s["duration_s"]
+
+    out = [f"{len(spans)} spans in {len(traces)} trace(s)"]
+    pipelines = [s["duration_s"] for s in spans if s["name"] == "pipeline"]
+    if pipelines:
+        out.append(f"Pipeline wall time: p50 {quantile(pipelines, 0.5):.2f}s, p95 {quantile(pipelines, 0.95):.2f}s")
+    for title, table in (("Stages", stages), ("Spans", io)):
+        if not table:
+            continue
+        width = max(len(k) for k in table) + 2
+        out += ["", title, f"{'':<{width}} {'count':>6} {'total s':>9} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}"]
+        for name, durations in sorted(table.items(), key=lambda kv: -sum(kv[1])):
+            out.append(_row(name, durations, width))
+    if breakdown:
+        out += ["", "Time inside each stage by span (summed; concurrent spans can exceed the stage time)"]
+        for stage, per in sorted(breakdown.items(), key=lambda kv: -sum(stages.get(kv[0], [0]))):
+            parts = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in sorted(per.items(), key=lambda kv: -kv[1]))
+            out.append(f"  {stage}: {parts}")
+    if errors:
+        out += ["", "Errors: " + ", ".join(f"{name} x{n}" for name, n in sorted(errors.items()))]
+    return "\n".join(out)
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Pipeline trace tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_report = sub.add_parser("report", help="summarize a JSONL trace file into a per-stage latency breakdown")
+    p_report.add_argument("path", nargs="?", default=TRACE_PATH or os.path.join(".cache", "traces.jsonl"))
+    args = ap.parse_args(argv)
+
+    if args.cmd == "report":
+        print(report(read_spans(args.path)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])